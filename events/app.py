@@ -19,107 +19,980 @@ Add, edit, and fetch events list.
 
 import os
 import datetime
+import re
+import functools
 import json
+import time
 import pymongo
-from bson import json_util, ObjectId
+from bson import ObjectId
 
-from flask import Flask, request
+from flask import Flask, request, make_response
 from werkzeug.exceptions import BadRequestKeyError
-from eventclass import Event
+from eventclass import (Event, EVENT_PROJECTION, FIELD_ATTRIBUTES,
+                        event_projection)
+from changefeed import ChangeFeed
+from prefixindex import PrefixIndex, normalize
+from responsecache import ResponseCache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # pylint: disable=invalid-name
 
 app = Flask(__name__)  # pylint: disable=invalid-name
 
+MAX_PAGE_SIZE = 1000  # upper bound on the `limit` query parameter
+NDJSON_MIMETYPE = 'application/x-ndjson'
+DEFAULT_SEARCH_LIMIT = 20  # results returned by /v1/search by default
+MAX_SEARCH_OFFSET = 10000  # upper bound on the /v1/search `offset`
+MAX_BATCH_IDS = 100  # most events looked up by one /v1/batch request
+MAX_BULK_EVENTS = 10000  # most events accepted by one /v1/add_bulk request
+BULK_CHUNK_SIZE = 1000  # events written per insert_many call
+# fields of bulk events, which unlike form fields may be any JSON type
+BULK_STRING_FIELDS = ['event_name', 'description', 'author_id', 'event_time']
+# collection tracking the version of each collection, see conditional()
+VERSIONS_COLLECTION = 'collection_versions'
+DEFAULT_SUGGESTIONS = 10  # suggestions returned by /v1/suggest by default
+MAX_SUGGESTIONS = 50  # upper bound on the /v1/suggest `limit` parameter
+# seconds between checks for writes to the collection by other instances,
+# which NAME_INDEX has to be rebuilt to include
+NAME_INDEX_MAX_AGE = 5
+# seconds a collection version read from the DB is reused for, so that
+# cached responses can be served without a DB round trip
+VERSION_MAX_AGE = 1
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024  # size cap of RESPONSE_CACHE
+# each /v1/stream client holds one of gunicorn's 8 threads, so only some
+# may subscribe at once to leave threads for other requests
+MAX_STREAM_SUBSCRIBERS = 4
+STREAM_KEEPALIVE_SECONDS = 15  # most time between messages on /v1/stream
+STREAM_MAX_SECONDS = 300  # time after which /v1/stream is closed
+STREAM_RETRY_MILLISECONDS = 3000  # time clients wait before reconnecting
+SSE_MIMETYPE = 'text/event-stream'
+
+# indexes on the events collection, created at startup by ensure_indexes()
+INDEXES = [
+    # matches in the name count ten times as much as in the description
+    pymongo.IndexModel([('name', pymongo.TEXT), ('description', pymongo.TEXT)],
+                       weights={'name': 10, 'description': 1},
+                       name='name_text'),
+    pymongo.IndexModel([('event_time', pymongo.ASCENDING)],
+                       name='event_time'),
+]
+
+# fields holding times, stored as native datetimes
+TIME_FIELDS = ['event_time', 'created_at']
+# ISO 8601 times accepted by parse_time(), as (date, clock, UTC offset)
+ISO_TIME_PATTERN = re.compile(
+    r'(\d{4}-\d{2}-\d{2})(?:[T ](\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?))?'
+    r'(Z|[+-]\d{2}:?\d{2})?')
+# strptime formats of the clock part of ISO_TIME_PATTERN, by its length
+CLOCK_FORMATS = {5: '%H:%M', 8: '%H:%M:%S', 9: '%H:%M:%S.%f'}
+
+# event names indexed by prefix for /v1/suggest, see refresh_name_index()
+NAME_INDEX = PrefixIndex()
+
+# serialized GET responses for the current collection version, see cached()
+RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+
+# inserts and deletes of events, streamed by /v1/stream
+CHANGE_FEED = ChangeFeed(MAX_STREAM_SUBSCRIBERS)
+
+# last collection version read, as (collection, version, time.monotonic()),
+# see get_current_version()
+VERSION_MEMO = {}
+
+
+def conditional(view):
+    """Decorates a GET view to answer conditional requests.
+
+    Successful responses carry an ETag and Last-Modified derived from the
+    version of the collection. The ETag also names the representation, so
+    JSON and NDJSON responses for one URL never share one. If the client's
+    copy is still current, 304 Not Modified is returned without running the
+    view or querying the collection itself. Other methods run the view as is.
+    """
+    @functools.wraps(view)
+    def conditional_view(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+        try:
+            version = get_current_version(app.config['COLLECTION'])
+        except ConnectionError:  # let the view report the DB error
+            return view(*args, **kwargs)
+        etag = f'{app.config["COLLECTION"].name}-{version["version"]}'
+        if wants_ndjson():
+            etag += '-ndjson'
+        last_modified = version['last_modified']
+        if request.if_none_match:
+            # compared weakly, as proxies may have weakened the ETag
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = (request.if_modified_since is not None
+                            and last_modified is not None
+                            and request.if_modified_since >= last_modified)
+        if not_modified:
+            response = app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True  # always revalidate
+        response.vary.add('Accept')
+        return response
+    return conditional_view
+
+
+def cached(normalize_args=None):
+    """Decorates a GET view to serve its responses from RESPONSE_CACHE.
+
+    Responses are cached by path, query arguments and whether NDJSON is
+    accepted, for the current version of the collection, so any write makes
+    them stale. Only whole 200 responses are cached, not streamed ones.
+
+    Args:
+        normalize_args (dict): Functions to apply to query arguments before
+            they become part of the cache key, so that requests with the
+            same results share an entry.
+    """
+    normalize_args = normalize_args or {}
+
+    def decorator(view):
+        @functools.wraps(view)
+        def cached_view(*args, **kwargs):
+            collection = app.config['COLLECTION']
+            try:
+                version = get_current_version(collection)['version']
+            except ConnectionError:  # let the view report the DB error
+                return view(*args, **kwargs)
+            key = (request.path, wants_ndjson(), tuple(sorted(
+                (name, normalize_args.get(name, str)(value))
+                for name, value in request.args.items(multi=True))))
+            entry = RESPONSE_CACHE.get(collection, version, key)
+            if entry is not None:
+                body, mimetype = entry
+                return app.response_class(body, mimetype=mimetype)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                RESPONSE_CACHE.put(collection, version, key,
+                                   response.get_data(), response.mimetype)
+            return response
+        return cached_view
+    return decorator
+
 
 @app.route('/v1/', methods=['GET'])
+@conditional
+@cached()
 def get_all_events():
-    """Return a list of all events currently in the DB."""
+    """Return a page of the events currently in the DB, ordered by _id.
+
+    Query parameters (all optional):
+        limit: maximum number of events to return, at most MAX_PAGE_SIZE.
+            If omitted, all events are returned.
+        after: `next_cursor` from a previous page; only events after it are
+            returned.
+        from, to: ISO 8601 times; only events with an event_time at or after
+            `from` and before `to` are returned.
+        fields: comma-separated attributes to return for each event, e.g.
+            'name,event_time'. The _id is always returned. If omitted, all
+            attributes are returned.
+
+    The response includes a `next_cursor` to pass as `after` to fetch the
+    following page, or None if there are no more events.
+
+    If the request accepts application/x-ndjson, events are instead streamed
+    one per line straight from the DB cursor. The cursor for the next page is
+    then the _id of the last event received.
+    """
     try:
-        events = app.config['COLLECTION'].find({})
-        events_dict = build_events_dict(events)
-        # handle MongoDB objects (e.g. ObjectID) that aren't JSON serializable
-        return json.loads(json_util.dumps(events_dict))
+        limit, after = parse_page_args(request.args)
+        time_range = parse_time_range(request.args)
+        fields = parse_fields(request.args)
+    except ValueError as error:
+        return f'Error: {error}', 400
+    try:
+        events = find_events_page(app.config['COLLECTION'], limit, after,
+                                  time_range, event_projection(fields))
+        if wants_ndjson():
+            return ndjson_response(serialize_events(events, fields))
+        events_dict = build_events_dict(events, fields)
+        events_dict['next_cursor'] = get_next_cursor(
+            events_dict['events'], limit)
+        return json_response(events_dict)
     except DBNotConnectedError:
         return 'Events database was undefined.', 500
 
 
 @app.route('/v1/search', methods=['GET'])
+@conditional
+@cached(normalize_args={'name': normalize})
 def search_event():
     """Search for the event with the given name in the DB.
 
     Uses MongoDB text search, which ignores capitalization and stop words, and
-    searches on word stems.
+    searches on word stems. Relies on the text index built at startup by
+    ensure_indexes(), which matches on both name and description but weighs
+    the name higher. The best matches are returned first.
+
+    Query parameters:
+        name: words to search for.
+        limit: maximum number of events to return, at most MAX_PAGE_SIZE.
+            Defaults to DEFAULT_SEARCH_LIMIT.
+        offset: number of best matches to skip, at most MAX_SEARCH_OFFSET.
+        fields: attributes to return for each event, as for GET /v1/.
+
+    The response includes a `next_offset` to pass as `offset` to fetch the
+    next matches, or None if there are no more.
     """
     try:
         event_name = request.args['name']
-        # create a text index on name to enable searching
-        app.config['COLLECTION'].create_index([('name', 'text')])
-        events = text_search_event_name(app.config['COLLECTION'], event_name)
-        events_dict = build_events_dict(events)
-        # handles MongoDB objects (e.g. ObjectID) that aren't JSON serializable
-        return json.loads(json_util.dumps(events_dict))
+        limit, offset = parse_search_args(request.args)
+        fields = parse_fields(request.args)
     except BadRequestKeyError:      # missing event attributes
         return 'Event name was entered incorrectly.', 400
+    except ValueError as error:
+        return f'Error: {error}', 400
+    try:
+        events = text_search_event_name(
+            app.config['COLLECTION'], event_name, limit, offset,
+            event_projection(fields))
+        events_dict = build_events_dict(events, fields)
+        events_dict['next_offset'] = (
+            offset + limit if events_dict['num_events'] == limit else None)
+        return json_response(events_dict)
+    except DBNotConnectedError:
+        return 'Events database was undefined.', 500
+
+
+@app.route('/v1/suggest', methods=['GET'])
+def suggest_event_names():
+    """Suggest events whose name has a word starting with the given prefix.
+
+    Meant for typeahead as the user types, so answered from NAME_INDEX in
+    memory rather than by querying the DB.
+
+    Query parameters:
+        q: Prefix to look up, ignoring case and extra whitespace. May span
+            several words, e.g. 'knative sum'.
+        limit: Maximum number of suggestions, at most MAX_SUGGESTIONS.
+            Defaults to DEFAULT_SUGGESTIONS.
+
+    Response:
+        suggestions: list of {'event_id', 'name'} of matching events.
+        num_suggestions: number of suggestions returned.
+    """
+    try:
+        prefix = request.args['q']
+        limit = request.args.get('limit', str(DEFAULT_SUGGESTIONS))
+        if not limit.isdigit() or not 0 < int(limit) <= MAX_SUGGESTIONS:
+            raise ValueError(
+                f'limit must be an integer from 1 to {MAX_SUGGESTIONS}.')
+        refresh_name_index(app.config['COLLECTION'])
+    except BadRequestKeyError:
+        return 'Prefix to suggest events for was missing.', 400
+    except ValueError as error:
+        return f'Error: {error}', 400
     except DBNotConnectedError:
         return 'Events database was undefined.', 500
+    suggestions = []
+    if prefix.strip():
+        suggestions = [{'event_id': event_id, 'name': name}
+                       for event_id, name in NAME_INDEX.suggest(
+                           prefix, int(limit))]
+    return json_response(
+        {'suggestions': suggestions, 'num_suggestions': len(suggestions)})
+
+
+@app.route('/v1/stream', methods=['GET'])
+def stream_changes():
+    """Stream events as they are added, as Server-Sent Events.
+
+    Each change is sent as an SSE `event` named after the operation
+    ('insert' or 'delete') whose `data` is JSON with the `_id` of the event
+    and, for inserts, the whole `document`. A comment is sent every
+    STREAM_KEEPALIVE_SECONDS while there are no changes.
+
+    The stream is closed after STREAM_MAX_SECONDS, or early if the client
+    can't keep up, and EventSource clients then reconnect on their own.
+    Changes made while disconnected are not resent.
+
+    Response:
+        503: MAX_STREAM_SUBSCRIBERS clients are already subscribed.
+    """
+    subscription = CHANGE_FEED.subscribe()
+    if subscription is None:
+        response = make_response('Too many clients are streaming.', 503)
+        response.retry_after = STREAM_RETRY_MILLISECONDS // 1000
+        return response
+    response = app.response_class(
+        sse_messages(subscription), mimetype=SSE_MIMETYPE)
+    response.call_on_close(subscription.close)
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'  # don't buffer in proxies
+    return response
 
 
 @app.route('/v1/add', methods=['POST'])
 def add_event():
     """Adds the posted event into the database."""
     try:
-        info = {
-            'name': request.form['event_name'],
-            'description': request.form['description'],
-            'author': request.form['author_id'],
-            'event_time': request.form['event_time']
-        }
-        current_time = datetime.datetime.utcnow().isoformat(sep=' ',
-                                                            timespec='seconds')
-        info = build_event_info(info, current_time)
+        info = parse_event_fields(request.form)
+        info = build_event_info(info, get_current_time())
         event = Event(**info)
-        app.config['COLLECTION'].insert_one(event.dict)
+        result = app.config['COLLECTION'].insert_one(event.dict)
+        version = bump_collection_version(app.config['COLLECTION'])
+        NAME_INDEX.add([(str(result.inserted_id), event.name)],
+                       app.config['COLLECTION'], version)
+        CHANGE_FEED.publish_local(
+            'insert', result.inserted_id,
+            dict(event.dict, _id=result.inserted_id))
         return 'Event added.', 201
     except BadRequestKeyError:      # missing event attributes
         return 'Event info was entered incorrectly.', 400
+    except ValueError as error:     # malformatted event attributes
+        return f'Error: {error}', 400
     except DBNotConnectedError:
         return 'Events database was undefined.', 500
 
 
+@app.route('/v1/add_bulk', methods=['POST'])
+def add_events_in_bulk():
+    """Adds a batch of events, e.g. a whole festival schedule, at once.
+
+    Request body is either a JSON array or newline-delimited JSON (with
+    Content-Type application/x-ndjson) of objects with the same fields as
+    the form posted to /v1/add. At most MAX_BULK_EVENTS may be sent at once.
+
+    Response:
+        201: all events were added.
+        207: only some events were added.
+        400: error message if the body could not be parsed.
+        On 201 and 207, `results` holds for each item, in order, either the
+        `_id` of the added event or the `error` that prevented adding it.
+    """
+    try:
+        items = parse_bulk_body(request)
+    except ValueError as error:
+        return f'Error: {error}', 400
+    try:
+        results, inserted = insert_events_in_bulk(
+            app.config['COLLECTION'], items, get_current_time())
+    except DBNotConnectedError:
+        return 'Events database was undefined.', 500
+    num_added = len(inserted)
+    if num_added:
+        version = bump_collection_version(app.config['COLLECTION'])
+        NAME_INDEX.add([(str(event['_id']), event['name'])
+                        for event in inserted],
+                       app.config['COLLECTION'], version)
+        for event in inserted:
+            CHANGE_FEED.publish_local('insert', event['_id'], event)
+    status = 201 if num_added == len(results) else 207
+    return json_response(
+        {'results': results, 'num_added': num_added}, status)
+
+
 @app.route('/v1/edit/<event_id>', methods=['PUT'])
 def edit_event(event_id):
     """Edit the event with the given id."""
 
 
-@app.route('/v1/<event_id>', methods=['PUT'])
+@app.route('/v1/batch', methods=['GET'])
+@conditional
+@cached()
+def get_events_by_ids():
+    """Retrieve several events by ID with a single query.
+
+    Query parameters:
+        ids: comma-separated IDs of the events, at most MAX_BATCH_IDS.
+        fields: attributes to return for each event, as for GET /v1/.
+
+    Events are returned in the order their IDs were given, each at most
+    once. IDs of events that don't exist are left out.
+    """
+    try:
+        event_ids = parse_event_ids(request.args['ids'])
+        fields = parse_fields(request.args)
+    except BadRequestKeyError:
+        return 'IDs of the events were missing.', 400
+    except ValueError as error:
+        return f'Error: {error}', 400
+    try:
+        events = app.config['COLLECTION'].find(
+            {'_id': {'$in': event_ids}}, event_projection(fields))
+        events_by_id = {event['_id']: event for event in events}
+        events_dict = build_events_dict(
+            (events_by_id[event_id] for event_id in event_ids
+             if event_id in events_by_id), fields)
+        return json_response(events_dict)
+    except DBNotConnectedError:
+        return 'Events database was undefined.', 500
+
+
+# PUT is still accepted for clients written before GET was supported
+@app.route('/v1/<event_id>', methods=['GET', 'PUT'])
+@conditional
 def get_one_event(event_id):
-    """Retrieve one event by event_id."""
+    """Retrieve one event by event_id.
+
+    Returns the same format as GET /v1/, with one event or none if it
+    doesn't exist.
+    """
+    if not ObjectId.is_valid(event_id):
+        return f'Error: "{event_id}" is not an event ID.', 400
     try:
-        events = app.config['COLLECTION'].find({'_id': ObjectId(event_id)})
-        events = [Event(**ev).dict for ev in events]
-        events_dict = build_events_dict(events)
-        # handle MongoDB objects (e.g. ObjectID) that aren't JSON serializable
-        return json.loads(json_util.dumps(events_dict))
+        event = app.config['COLLECTION'].find_one(
+            {'_id': ObjectId(event_id)}, EVENT_PROJECTION)
+        events_dict = build_events_dict([] if event is None else [event])
+        return json_response(events_dict)
     except DBNotConnectedError:
         return 'Events database was undefined.', 500
 
 
+def parse_event_fields(fields):
+    """Maps the fields posted to add an event to event info attributes.
+
+    Raises:
+        KeyError: if a field is missing.
+        ValueError: if event_time is not an ISO 8601 time.
+    """
+    return {
+        'name': fields['event_name'],
+        'description': fields['description'],
+        'author': fields['author_id'],
+        'event_time': parse_time(fields['event_time'])
+    }
+
+
+def parse_time(time_string):
+    """Parses an ISO 8601 time string into a naive UTC datetime.
+
+    Accepts e.g. '2019-06-11 10:33', '2019-06-11T10:33:01' and
+    '2019-06-11T10:33:01Z'. Times without an offset are taken to be in UTC.
+
+    Raises:
+        ValueError: if time_string is not an ISO 8601 time.
+    """
+    match = None
+    if isinstance(time_string, str):
+        match = ISO_TIME_PATTERN.fullmatch(time_string.strip())
+    try:
+        if match is None:
+            raise ValueError
+        date, clock, offset = match.groups()
+        clock = clock or '00:00'
+        time = datetime.datetime.strptime(
+            f'{date} {clock}', '%Y-%m-%d ' + CLOCK_FORMATS[min(len(clock), 9)])
+    except ValueError:
+        raise ValueError(f'"{time_string}" is not an ISO 8601 time.')
+    if offset not in (None, 'Z'):
+        sign = -1 if offset[0] == '-' else 1
+        time -= sign * datetime.timedelta(hours=int(offset[1:3]),
+                                          minutes=int(offset[-2:]))
+    return time
+
+
+def parse_time_range(args):
+    """Parses the `from` and `to` arguments into a MongoDB range query.
+
+    Returns:
+        dict: Query operators matching times at or after `from` and before
+            `to`, empty if neither is given.
+
+    Raises:
+        ValueError: if either argument is malformatted.
+    """
+    time_range = {}
+    if 'from' in args:
+        time_range['$gte'] = parse_time(args['from'])
+    if 'to' in args:
+        time_range['$lt'] = parse_time(args['to'])
+    return time_range
+
+
+def get_current_time():
+    """Returns the current UTC time, truncated to the second."""
+    return datetime.datetime.utcnow().replace(microsecond=0)
+
+
+def migrate_string_times(coll, fields=None):
+    """Converts times stored as ISO strings into native datetimes.
+
+    Events added before times were stored natively hold them as strings,
+    which can't be range-queried. Times that don't parse are left as they
+    are. Safe to run more than once.
+
+    Args:
+        coll (pymongo.collection): The collection to migrate.
+        fields (list): Names of the time fields, defaults to TIME_FIELDS.
+
+    Returns:
+        dict: Number of documents 'converted' and number of times that were
+            'unparseable'.
+    """
+    if fields is None:
+        fields = TIME_FIELDS
+    report = {'converted': 0, 'unparseable': 0}
+    query = {'$or': [{field: {'$type': 'string'}} for field in fields]}
+    for document in coll.find(query, {field: True for field in fields}):
+        converted = {}
+        for field in fields:
+            if isinstance(document.get(field), str):
+                try:
+                    converted[field] = parse_time(document[field])
+                except ValueError:
+                    report['unparseable'] += 1
+        if converted:
+            coll.update_one({'_id': document['_id']}, {'$set': converted})
+            report['converted'] += 1
+    return report
+
+
+def parse_bulk_body(req):
+    """Parses the JSON array or NDJSON body of a bulk request into a list.
+
+    Raises:
+        ValueError: if the body is malformatted or too long.
+    """
+    body = req.get_data()
+    if req.mimetype == NDJSON_MIMETYPE:
+        items = [json.loads(line) for line in body.splitlines()
+                 if line.strip()]
+    else:
+        items = json.loads(body)
+        if not isinstance(items, list):
+            raise ValueError('Body must be a JSON array of events.')
+    if len(items) > MAX_BULK_EVENTS:
+        raise ValueError(f'At most {MAX_BULK_EVENTS} events may be added.')
+    return items
+
+
+def insert_events_in_bulk(coll, items, created_at):
+    """Validates and inserts many events using unordered bulk writes.
+
+    Args:
+        coll (pymongo.collection): The collection to insert into.
+        items (list): Dicts with the fields posted to add an event.
+        created_at (datetime): Time the events were added.
+
+    Returns:
+        tuple: (results, inserted) where results is a list holding for each
+            item, in order, a dict with either the `_id` of the inserted
+            event or the `error` that prevented inserting it, and inserted
+            is a list of the events that were inserted.
+    """
+    results = [None] * len(items)
+    inserted = []
+    valid = []  # (index in items, event dict) pairs to insert
+    for index, item in enumerate(items):
+        try:
+            for field in BULK_STRING_FIELDS:
+                if not isinstance(item[field], str):
+                    raise TypeError(f'{field} must be a string.')
+            info = build_event_info(parse_event_fields(item), created_at)
+            event = Event(**info).dict
+            event['_id'] = ObjectId()
+            valid.append((index, event))
+        except (KeyError, TypeError, ValueError):
+            results[index] = {'error': 'Event info was entered incorrectly.'}
+    for start in range(0, len(valid), BULK_CHUNK_SIZE):
+        chunk = valid[start:start + BULK_CHUNK_SIZE]
+        write_errors = {}
+        try:
+            coll.insert_many([event for _, event in chunk], ordered=False)
+        except pymongo.errors.BulkWriteError as error:
+            write_errors = {write_error['index']: write_error['errmsg']
+                            for write_error in error.details['writeErrors']}
+        for position, (index, event) in enumerate(chunk):
+            if position in write_errors:
+                results[index] = {'error': write_errors[position]}
+            else:
+                results[index] = {'_id': event['_id']}
+                inserted.append(event)
+    return results, inserted
+
+
 def build_event_info(info, time):
     """Adds created_at time to event info dict."""
     return {**info, 'created_at': time}
 
 
-def build_events_dict(events_cursor):
+def build_events_dict(events_cursor, fields=None):
     """Builds a dict in the correct format for returning through a GET request.
 
-    Takes in a mongoDB cursor from querying the DB.
+    Takes in a mongoDB cursor from querying the DB, and optionally the fields
+    it was projected to.
     """
-    events_list = [Event(**ev).dict for ev in events_cursor]
+    events_list = list(serialize_events(events_cursor, fields))
     num_events = len(events_list)
     return {'events': events_list, 'num_events': num_events}
 
 
-def text_search_event_name(coll, name):
-    return coll.find({'$text': {'$search': name}})
+def serialize_events(events_cursor, fields=None):
+    """Converts event documents into dicts of all fields or only of fields."""
+    if fields is None:
+        return Event.from_cursor(events_cursor)
+    return Event.fields_from_cursor(events_cursor, fields)
+
+
+def parse_fields(args):
+    """Parses the comma-separated `fields` argument, e.g. 'name,event_time'.
+
+    Returns:
+        list: Requested event attributes, or None if `fields` isn't given.
+
+    Raises:
+        ValueError: if a field isn't an event attribute.
+    """
+    if 'fields' not in args:
+        return None
+    fields = [field.strip() for field in args['fields'].split(',')]
+    for field in fields:
+        if field not in FIELD_ATTRIBUTES:
+            raise ValueError(f'fields must be from {FIELD_ATTRIBUTES}.')
+    return list(dict.fromkeys(fields))
+
+
+def parse_page_args(args):
+    """Parses and validates the `limit` and `after` pagination arguments.
+
+    Returns:
+        tuple: (limit, after) where limit is an int or None and after is an
+            ObjectId or None.
+
+    Raises:
+        ValueError: if either argument is malformatted.
+    """
+    limit = args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= MAX_PAGE_SIZE:
+            raise ValueError(
+                f'limit must be an integer from 1 to {MAX_PAGE_SIZE}.')
+        limit = int(limit)
+    after = args.get('after')
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise ValueError('after must be a cursor from a previous page.')
+        after = ObjectId(after)
+    return limit, after
+
+
+def parse_search_args(args):
+    """Parses and validates the `limit` and `offset` search arguments.
+
+    Returns:
+        tuple: (limit, offset) as ints.
+
+    Raises:
+        ValueError: if either argument is malformatted.
+    """
+    limit = args.get('limit', str(DEFAULT_SEARCH_LIMIT))
+    if not limit.isdigit() or not 0 < int(limit) <= MAX_PAGE_SIZE:
+        raise ValueError(
+            f'limit must be an integer from 1 to {MAX_PAGE_SIZE}.')
+    offset = args.get('offset', '0')
+    if not offset.isdigit() or int(offset) > MAX_SEARCH_OFFSET:
+        raise ValueError(
+            f'offset must be an integer from 0 to {MAX_SEARCH_OFFSET}.')
+    return int(limit), int(offset)
+
+
+def parse_event_ids(ids):
+    """Parses a comma-separated list of event IDs, dropping repeats.
+
+    Returns:
+        list: ObjectIds in the order given.
+
+    Raises:
+        ValueError: if an ID is malformatted or there are too many.
+    """
+    event_ids = [event_id.strip() for event_id in ids.split(',')]
+    if len(event_ids) > MAX_BATCH_IDS:
+        raise ValueError(f'At most {MAX_BATCH_IDS} events may be retrieved.')
+    for event_id in event_ids:
+        if not ObjectId.is_valid(event_id):
+            raise ValueError(f'"{event_id}" is not an event ID.')
+    return list(dict.fromkeys(ObjectId(event_id) for event_id in event_ids))
+
+
+def find_events_page(coll, limit=None, after=None, time_range=None,
+                     projection=EVENT_PROJECTION):
+    """Finds one page of events, walking the _id index in ascending order.
+
+    Args:
+        coll (pymongo.collection): The collection to search in.
+        limit (int): Maximum number of events to return, or None for all.
+        after (ObjectId): Only return events with an _id greater than this.
+        time_range (dict): Query operators the event_time must match, e.g.
+            from parse_time_range().
+        projection (dict): Fields of the events to return.
+
+    Returns:
+        pymongo.cursor: Cursor over the events in the page.
+    """
+    query = {} if after is None else {'_id': {'$gt': after}}
+    if time_range:
+        query['event_time'] = time_range
+    cursor = coll.find(query, projection).sort('_id', pymongo.ASCENDING)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+def get_next_cursor(events_list, limit):
+    """Returns the cursor for the page after events_list, or None if last."""
+    if limit is None or len(events_list) < limit:
+        return None
+    return str(events_list[-1]['_id'])
+
+
+def get_collection_version(collection):
+    """Returns the version of the collection, which increases on every write.
+
+    Returns:
+        dict: 'version' (int) counting the writes to the collection and
+            'last_modified' (datetime) of the last write, or None if the
+            collection has never been written to.
+    """
+    version = collection.database[VERSIONS_COLLECTION].find_one(
+        {'_id': collection.name})
+    if version is None:
+        return {'version': 0, 'last_modified': None}
+    return {'version': version['version'],
+            'last_modified': version['last_modified'].replace(
+                tzinfo=datetime.timezone.utc)}
+
+
+def bump_collection_version(collection):
+    """Records a write to the collection so cached copies are revalidated.
+
+    Returns:
+        int: The new version of the collection.
+    """
+    # HTTP dates have a resolution of one second
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    version = collection.database[VERSIONS_COLLECTION].find_one_and_update(
+        {'_id': collection.name},
+        {'$inc': {'version': 1}, '$set': {'last_modified': now}},
+        upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+    memo = VERSION_MEMO.get('latest')
+    if (memo is None or memo[0] is not collection
+            or memo[1]['version'] < version['version']):
+        # this instance sees its own writes without waiting VERSION_MAX_AGE
+        VERSION_MEMO['latest'] = (
+            collection,
+            {'version': version['version'],
+             'last_modified': now.replace(tzinfo=datetime.timezone.utc)},
+            time.monotonic())
+    return version['version']
+
+
+def get_current_version(collection, max_age=VERSION_MAX_AGE):
+    """Returns get_collection_version(), reusing it for max_age seconds.
+
+    Writes through this instance update the version right away, see
+    bump_collection_version(), while writes by other instances are seen
+    within max_age seconds.
+    """
+    memo = VERSION_MEMO.get('latest')
+    now = time.monotonic()
+    if memo is not None and memo[0] is collection and now - memo[2] < max_age:
+        return memo[1]
+    version = get_collection_version(collection)
+    VERSION_MEMO['latest'] = (collection, version, now)
+    return version
+
+
+def refresh_name_index(collection, max_age=NAME_INDEX_MAX_AGE):
+    """Rebuilds NAME_INDEX from the collection if it is out of date.
+
+    Events added through this instance are put in the index as they are
+    added. To pick up writes by other instances, the version of the
+    collection is compared with the index's, at most once every `max_age`
+    seconds so that most lookups don't touch the DB.
+    """
+    now = time.monotonic()
+    if (NAME_INDEX.source is collection
+            and now - NAME_INDEX.checked_at < max_age):
+        return
+    version = get_collection_version(collection)['version']
+    if NAME_INDEX.source is not collection or NAME_INDEX.version != version:
+        events = collection.find({}, {'name': True})
+        NAME_INDEX.build(
+            ((str(event['_id']), event['name']) for event in events
+             if isinstance(event.get('name'), str)),
+            collection, version)
+    NAME_INDEX.checked_at = now
+
+
+def encode_bson_value(value):
+    """Encodes BSON types as MongoDB extended JSON, like bson.json_util does.
+
+    Used as the `default` hook of the JSON encoder for values it can't
+    serialize natively.
+    """
+    if isinstance(value, ObjectId):
+        return {'$oid': str(value)}
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        millis = value.microsecond // 1000
+        return {'$date': value.strftime('%Y-%m-%dT%H:%M:%S')
+                         + (f'.{millis:03d}' if millis else '') + 'Z'}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(obj):
+    """Serializes obj to JSON bytes in a single pass.
+
+    Uses orjson when it is installed and falls back to the standard library.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=encode_bson_value,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(obj, default=encode_bson_value).encode()
+
+
+def json_response(obj, status=200):
+    """Returns a JSON response with BSON types encoded as extended JSON."""
+    return app.response_class(dumps(obj), status=status,
+                              mimetype='application/json')
+
+
+def wants_ndjson():
+    """Determines if the client asked for newline-delimited JSON."""
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(documents):
+    """Streams documents as newline-delimited JSON, one document per line.
+
+    Documents are encoded as they are pulled from the iterable (e.g. a
+    MongoDB cursor), so the whole result is never held in memory.
+    """
+    return app.response_class(
+        (dumps(document) + b'\n' for document in documents),
+        mimetype=NDJSON_MIMETYPE)
+
+
+def sse_messages(subscription, max_seconds=None):
+    """Yields changes from the subscription as Server-Sent Events messages.
+
+    Stops after max_seconds, defaulting to STREAM_MAX_SECONDS, or once the
+    subscription is lost.
+    """
+    if max_seconds is None:
+        max_seconds = STREAM_MAX_SECONDS
+    deadline = time.monotonic() + max_seconds
+    yield f'retry: {STREAM_RETRY_MILLISECONDS}\n\n'.encode()
+    while not subscription.lost:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        change = subscription.get(min(STREAM_KEEPALIVE_SECONDS, remaining))
+        if change is None:
+            yield b': keepalive\n\n'
+        elif not subscription.lost:
+            yield (b'event: ' + change['operation'].encode()
+                   + b'\ndata: ' + dumps(change) + b'\n\n')
+
+
+def text_search_event_name(coll, name, limit=DEFAULT_SEARCH_LIMIT, offset=0,
+                           projection=EVENT_PROJECTION):
+    """Finds the events best matching name with MongoDB text search.
+
+    Args:
+        coll (pymongo.collection): The collection to search in.
+        name (str): Words to search for.
+        limit (int): Maximum number of events to return.
+        offset (int): Number of best matches to skip.
+        projection (dict): Fields of the events to return.
+
+    Yields:
+        dict: Matching events, most relevant first.
+    """
+    projection = dict(projection, score={'$meta': 'textScore'})
+    events = coll.find({'$text': {'$search': name}}, projection).sort(
+        [('score', {'$meta': 'textScore'})]).skip(offset).limit(limit)
+    for event in events:
+        del event['score']  # only needed for sorting
+        yield event
+
+
+def ensure_indexes(collection, indexes=None):
+    """Reconciles the indexes on the collection with the declared indexes.
+
+    Creates declared indexes that are missing and rebuilds declared indexes
+    whose spec has drifted from the one in the DB. Indexes in the DB that are
+    not declared are left alone, but reported, except for a text index in
+    the way of a declared one. Run once at startup so that request handlers
+    never have to create indexes.
+
+    Args:
+        collection (pymongo.collection): The collection to reconcile.
+        indexes (list): pymongo.IndexModels to declare, defaults to INDEXES.
+
+    Returns:
+        dict: Names of the indexes that were 'created', 'rebuilt', 'failed'
+            to build, and that exist in the DB but are 'undeclared'.
+    """
+    if indexes is None:
+        indexes = INDEXES
+    existing = collection.index_information()
+    declared = {index.document['name'] for index in indexes}
+    report = {'created': [], 'rebuilt': [], 'failed': [], 'undeclared': []}
+    for index in indexes:
+        name = index.document['name']
+        try:
+            if name not in existing:
+                # a collection can only have one text index, so an
+                # undeclared one is replaced by the declared one
+                replaced = [
+                    other for other, info in existing.items()
+                    if other not in declared and is_text_index(info)
+                    and is_text_index(index.document)]
+                for other in replaced:
+                    collection.drop_index(other)
+                    del existing[other]
+                collection.create_indexes([index])
+                report['rebuilt' if replaced else 'created'].append(name)
+            elif not index_matches(existing[name], index.document):
+                collection.drop_index(name)
+                collection.create_indexes([index])
+                report['rebuilt'].append(name)
+        except pymongo.errors.OperationFailure:
+            report['failed'].append(name)
+    report['undeclared'] = [
+        name for name in existing if name not in declared and name != '_id_']
+    for outcome, names in report.items():
+        if names:
+            app.logger.warning('Indexes %s on %s: %s',
+                               outcome, collection.name, ', '.join(names))
+    return report
+
+
+def is_text_index(info):
+    """Determines if an index, from index_information() or a spec, is text."""
+    return pymongo.TEXT in dict(info['key']).values()
+
+
+def index_matches(info, spec):
+    """Determines if an index from index_information() matches an index spec.
+
+    Text indexes are stored by MongoDB under the internal `_fts` key, so they
+    are compared by their weighted fields instead.
+    """
+    key = list(spec['key'].items())
+    text_fields = [field for field, kind in key if kind == pymongo.TEXT]
+    if text_fields and 'weights' in info:
+        weights = spec.get('weights', {field: 1 for field in text_fields})
+        return info['weights'] == weights
+    return (list(info['key']) == key
+            and info.get('unique', False) == spec.get('unique', False))
 
 
 class DBNotConnectedError(ConnectionError):
@@ -142,7 +1015,11 @@ def connect_to_mongodb():   # pragma: no cover
     mongodb_uri = os.environ.get('MONGODB_URI')
     if mongodb_uri is None:
         return Thrower()  # not able to find db config var
-    return pymongo.MongoClient(mongodb_uri).eventsDB.all_events
+    collection = pymongo.MongoClient(mongodb_uri).eventsDB.all_events
+    ensure_indexes(collection)
+    refresh_name_index(collection)
+    CHANGE_FEED.watch(collection)
+    return collection
 
 
 app.config['COLLECTION'] = connect_to_mongodb()  # None if can't connect
@@ -0,0 +1,69 @@
+"""Benchmark for converting event documents from the DB into dict form.
+
+Compares constructing an Event per document against the bulk
+Event.from_cursor() path used by the events service. Run with:
+
+    python3 benchmark_eventclass.py
+"""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import timeit
+from bson import ObjectId
+from eventclass import Event
+
+NUM_EVENTS = 10000
+REPEAT = 10
+
+
+def make_documents(num_events):
+    """Makes event documents shaped like those returned by the DB."""
+    return [{'_id': ObjectId(),
+             'event_id': None,
+             'name': f'event {i}',
+             'description': 'an event to benchmark',
+             'author': 'admin',
+             'created_at': '2019-06-11 10:33:01',
+             'event_time': '2019-06-12 18:00:00'}
+            for i in range(num_events)]
+
+
+def per_event(documents):
+    """Converts documents by constructing an Event for each one."""
+    return [Event(**document).dict for document in documents]
+
+
+def from_cursor(documents):
+    """Converts documents with the bulk Event.from_cursor() path."""
+    return list(Event.from_cursor(documents))
+
+
+def main():
+    """Times each conversion and prints the results."""
+    documents = make_documents(NUM_EVENTS)
+    assert per_event(documents) == from_cursor(documents)
+    results = {}
+    for convert in (per_event, from_cursor):
+        seconds = min(timeit.repeat(
+            lambda: convert(documents), number=1, repeat=REPEAT))
+        results[convert.__name__] = seconds
+        print(f'{convert.__name__:>12}: {seconds * 1000:7.2f} ms '
+              f'for {NUM_EVENTS} events')
+    speedup = results['per_event'] / results['from_cursor']
+    print(f'from_cursor is {speedup:.1f}x faster than per_event')
+
+
+if __name__ == '__main__':
+    main()
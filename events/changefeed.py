@@ -0,0 +1,157 @@
+"""Publishes inserts and deletes on a collection to subscribed streams."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import queue
+import threading
+import time
+import pymongo
+
+# change stream pipeline selecting the operations published to subscribers
+PIPELINE = [{'$match': {'operationType': {'$in': ['insert', 'delete']}}}]
+# seconds to wait before reopening a change stream that failed
+RETRY_SECONDS = 1
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class Subscription():
+    """Queue of changes for one subscriber.
+
+    If the subscriber falls more than `max_queued` changes behind, it is
+    marked `lost` and gets no more changes, as it has missed some. It should
+    then refetch what it needs and subscribe again.
+    """
+
+    def __init__(self, feed, max_queued):
+        self._feed = feed
+        self._queue = queue.Queue(maxsize=max_queued)
+        self.lost = False
+
+    def put(self, change):
+        """Queues a change, marking the subscription lost if it's full."""
+        if self.lost:
+            return
+        try:
+            self._queue.put_nowait(change)
+        except queue.Full:
+            self.lost = True
+
+    def get(self, timeout):
+        """Returns the next change, or None if none comes within timeout."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """Unsubscribes from the feed."""
+        self._feed.unsubscribe(self)
+
+
+class ChangeFeed():
+    """Fans out changes to a collection to every subscriber.
+
+    Changes come from a MongoDB change stream if the DB supports them (it
+    must be a replica set), which includes writes made by every instance of
+    the service. Otherwise the service publishes its own writes with
+    publish_local(), which is also how the feed is driven in tests.
+
+    Changes are dicts with the `operation` ('insert' or 'delete'), the `_id`
+    of the document and, for inserts, the `document`.
+    """
+
+    def __init__(self, max_subscribers, max_queued=100):
+        self.max_subscribers = max_subscribers
+        self.max_queued = max_queued
+        self.watching = False  # True while driven by a change stream
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """Returns a new Subscription, or None if there are too many."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self, self.max_queued)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        """Stops sending changes to the subscription."""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, operation, document_id, document=None):
+        """Sends a change to every subscriber."""
+        change = {'operation': operation, '_id': document_id}
+        if document is not None:
+            change['document'] = document
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(change)
+
+    def publish_local(self, operation, document_id, document=None):
+        """Publishes a write made by this instance.
+
+        Does nothing while a change stream is watched, as the change stream
+        publishes the write itself.
+        """
+        if not self.watching:
+            self.publish(operation, document_id, document)
+
+    def watch(self, collection):
+        """Publishes changes from a change stream on the collection.
+
+        Returns:
+            bool: False if the DB doesn't support change streams, in which
+                case writes must be published with publish_local().
+        """
+        try:
+            stream = collection.watch(PIPELINE)
+        except pymongo.errors.PyMongoError as error:
+            logger.warning('Change streams unavailable on %s, only '
+                           'publishing local writes: %s', collection.name,
+                           error)
+            return False
+        self.watching = True
+        threading.Thread(target=self._relay, args=(collection, stream),
+                         daemon=True).start()
+        return True
+
+    def _relay(self, collection, stream):
+        """Publishes changes from the stream, reopening it if it fails."""
+        resume_token = None
+        while True:
+            try:
+                if stream is None:
+                    stream = collection.watch(
+                        PIPELINE, resume_after=resume_token)
+                with stream:
+                    for change in stream:
+                        self.publish(change['operationType'],
+                                     change['documentKey']['_id'],
+                                     change.get('fullDocument'))
+                        resume_token = stream.resume_token
+            except pymongo.errors.PyMongoError as error:
+                logger.warning('Change stream on %s failed: %s',
+                               collection.name, error)
+            stream = None
+            time.sleep(RETRY_SECONDS)
@@ -15,6 +15,7 @@
 # limitations under the License.
 
 from collections import namedtuple
+from operator import itemgetter
 
 EVENT_ATTRIBUTES = [
     'event_id',
@@ -24,6 +25,19 @@ EVENT_ATTRIBUTES = [
     'created_at',
     'event_time']
 
+# attributes holding event info, i.e. every attribute but the event_id
+INFO_ATTRIBUTES = [att for att in EVENT_ATTRIBUTES if att != 'event_id']
+
+# MongoDB projection selecting exactly the fields used to construct an Event
+EVENT_PROJECTION = {att: True for att in EVENT_ATTRIBUTES}
+
+# attributes that can be selected with fields_from_cursor()
+FIELD_ATTRIBUTES = ['_id'] + INFO_ATTRIBUTES
+
+_ID_FIELDS = {'_id', 'event_id'}
+_INFO_FIELDS = set(INFO_ATTRIBUTES)
+_get_info = itemgetter(*INFO_ATTRIBUTES)  # pylint: disable=invalid-name
+
 
 class Event(namedtuple('EventTuple', EVENT_ATTRIBUTES)):
     """Class for representing events.
@@ -32,19 +46,19 @@ class Event(namedtuple('EventTuple', EVENT_ATTRIBUTES)):
     manipulating event info from user input.
     """
 
+    __slots__ = ()  # store attributes in the underlying tuple only
+
     def __new__(cls, **info):
         """Constructs an event object represented by a EventTuple namedtuple.
 
         Raises a ValueError if any attributes are missing or if extra
         attributes are included.
         """
-        if 'event_id' not in info:
-            info['event_id'] = None
+        event_id = info.pop('event_id', None)
         if '_id' in info:       # found DB-generated ID, override given one
-            info['event_id'] = info['_id']
-            del info['_id']
+            event_id = info.pop('_id')
         try:
-            return super(Event, cls).__new__(cls, **info)
+            return super(Event, cls).__new__(cls, event_id, **info)
         except TypeError:
             raise ValueError('Event info was formatted incorrectly.')
 
@@ -52,12 +66,11 @@ class Event(namedtuple('EventTuple', EVENT_ATTRIBUTES)):
         """Determines if two events have the same info, excluding event_id."""
         if not isinstance(other, Event):
             return False
-        for att in EVENT_ATTRIBUTES:
-            if att == 'event_id':
-                continue
-            elif getattr(self, att) != getattr(other, att):
-                return False
-        return True
+        return self[1:] == other[1:]
+
+    def __ne__(self, other):
+        """Determines if two events have different info."""
+        return not self == other
 
     def get_dict(self):
         """Returns event info in dict form.
@@ -65,10 +78,68 @@ class Event(namedtuple('EventTuple', EVENT_ATTRIBUTES)):
         Usually used to insert event info into the dictionary, so this converts
         the field event_id into _id to correspond with the MongoDB _id field.
         """
-        info = self._asdict()
+        info = dict(zip(EVENT_ATTRIBUTES, self))
         if info['event_id']:    # only create _id field if event_id is not None
-            info['_id'] = info['event_id']
-            del info['event_id']
+            info['_id'] = info.pop('event_id')
         return info
 
     dict = property(get_dict)
+
+    @staticmethod
+    def from_cursor(documents):
+        """Converts event documents from the DB directly into dict form.
+
+        Yields the same dicts as `Event(**document).dict` for each document,
+        with the same validation, but without constructing Event objects.
+        Query with EVENT_PROJECTION so documents carry only event fields.
+
+        Args:
+            documents: Iterable of event documents, e.g. a pymongo cursor.
+
+        Raises:
+            ValueError: A document has missing or extra attributes.
+        """
+        for document in documents:
+            if document.keys() - _ID_FIELDS != _INFO_FIELDS:
+                raise ValueError('Event info was formatted incorrectly.')
+            event_id = (document['_id'] if '_id' in document
+                        else document.get('event_id'))
+            if event_id:    # only create _id field if event_id is not None
+                info = dict(zip(INFO_ATTRIBUTES, _get_info(document)))
+                info['_id'] = event_id
+            else:
+                info = dict(zip(EVENT_ATTRIBUTES,
+                                (event_id, *_get_info(document))))
+            yield info
+
+    @staticmethod
+    def fields_from_cursor(documents, fields):
+        """Converts event documents from the DB into dicts of some fields.
+
+        Yields dicts with the `_id` and the given fields of each document.
+        Query with event_projection(fields) so documents carry only these.
+
+        Args:
+            documents: Iterable of event documents, e.g. a pymongo cursor.
+            fields (list): Attributes to include, from FIELD_ATTRIBUTES.
+
+        Raises:
+            ValueError: A document is missing one of the fields.
+        """
+        for document in documents:
+            info = {'_id': document['_id']}
+            try:
+                info.update((field, document[field]) for field in fields)
+            except KeyError:
+                raise ValueError('Event info was formatted incorrectly.')
+            yield info
+
+
+def event_projection(fields):
+    """Returns the MongoDB projection selecting the given event fields.
+
+    If fields is None, selects the fields used to construct an Event.
+    """
+    if fields is None:
+        return EVENT_PROJECTION
+    return dict.fromkeys(['_id', *fields], True)
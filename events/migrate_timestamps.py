@@ -0,0 +1,28 @@
+"""Migrates event times stored as strings to native datetimes.
+
+Run once against the events DB after deploying native time storage:
+
+    MONGODB_URI="mongodb+srv://..." python3 migrate_timestamps.py
+"""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import app
+
+if __name__ == '__main__':  # pragma: no cover
+    REPORT = app.migrate_string_times(app.app.config['COLLECTION'])
+    app.bump_collection_version(app.app.config['COLLECTION'])
+    print(f'Converted {REPORT["converted"]} events, '
+          f'{REPORT["unparseable"]} times could not be parsed.')
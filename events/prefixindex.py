@@ -0,0 +1,122 @@
+"""In-memory index for looking up event names by prefix."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import threading
+
+
+def normalize(text):
+    """Lowercases text and collapses its whitespace for matching."""
+    return ' '.join(text.split()).casefold()
+
+
+def name_keys(name):
+    """Returns the keys a name is indexed under, one per word it contains.
+
+    Each key runs from the start of a word to the end of the name, so that
+    e.g. 'Knative Summit' is found by both 'kna' and 'sum'.
+    """
+    words = normalize(name).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class PrefixIndex():
+    """Sorted array of name keys, searched with bisect.
+
+    Entries are (key, name, event_id) tuples. Lookups never take the lock:
+    writers build a new array and swap it in, so a reader always sees a
+    complete one.
+
+    Attributes:
+        source: Collection the index was built from, or None if never built.
+        version: Version of `source` the index reflects.
+        checked_at: time.monotonic() when `version` was last compared with
+            the collection's.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._lock = threading.Lock()
+        self.source = None
+        self.version = None
+        self.checked_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def build(self, events, source=None, version=None):
+        """Replaces the contents of the index.
+
+        Args:
+            events (iterable): (event_id, name) pairs.
+            source (pymongo.collection): Collection the events came from.
+            version (int): Version of the collection they were read at.
+        """
+        entries = sorted(
+            (key, name, event_id)
+            for event_id, name in events for key in name_keys(name))
+        with self._lock:
+            self._entries = entries
+            self.source = source
+            self.version = version
+
+    def add(self, events, source, version):
+        """Adds newly written events to the index.
+
+        The events are only added if they are the sole change since the
+        index was built, i.e. `version` directly follows the version of the
+        index. Otherwise the index is left to be rebuilt.
+
+        Args:
+            events (iterable): (event_id, name) pairs.
+            source (pymongo.collection): Collection the events were added to.
+            version (int): Version of the collection after adding them.
+
+        Returns:
+            bool: True if the events were added.
+        """
+        with self._lock:
+            if (source is not self.source or self.version is None
+                    or version != self.version + 1):
+                return False
+            entries = list(self._entries)
+            for event_id, name in events:
+                for key in name_keys(name):
+                    bisect.insort(entries, (key, name, event_id))
+            self._entries = entries
+            self.version = version
+            return True
+
+    def suggest(self, prefix, limit):
+        """Finds events with a word or run of words starting with prefix.
+
+        Returns:
+            list: Up to `limit` (event_id, name) pairs in order of the
+                matched key.
+        """
+        prefix = normalize(prefix)
+        entries = self._entries
+        suggestions = []
+        seen = set()
+        start = bisect.bisect_left(entries, (prefix,))
+        for i in range(start, len(entries)):
+            key, name, event_id = entries[i]
+            if len(suggestions) >= limit or not key.startswith(prefix):
+                break
+            if event_id not in seen:
+                seen.add(event_id)
+                suggestions.append((event_id, name))
+        return suggestions
@@ -0,0 +1,103 @@
+"""In-memory cache of serialized responses, invalidated by collection version.
+"""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache():
+    """LRU cache of response bodies for one version of a collection.
+
+    Every entry was computed from the same version of the same collection.
+    Looking up or storing an entry for a newer version or another collection
+    empties the cache, so entries never outlive the data they were built
+    from.
+
+    Attributes:
+        max_bytes: Most bytes of response bodies kept at once. The least
+            recently used entries are evicted to stay under it.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (body, mimetype)
+        self._num_bytes = 0
+        self._source = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def num_bytes(self):
+        """Total size of the cached response bodies."""
+        return self._num_bytes
+
+    def get(self, source, version, key):
+        """Returns the (body, mimetype) cached for key, or None if missing."""
+        with self._lock:
+            if not self._switch_version(source, version):
+                return None
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, source, version, key, body, mimetype):
+        """Caches a response body built from version of source.
+
+        Bodies too large to ever fit in max_bytes are not cached.
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if not self._switch_version(source, version):
+                return
+            if key in self._entries:
+                self._num_bytes -= len(self._entries.pop(key)[0])
+            self._entries[key] = (body, mimetype)
+            self._num_bytes += len(body)
+            while self._num_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._num_bytes -= len(evicted)
+
+    def clear(self):
+        """Removes all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._num_bytes = 0
+
+    def _switch_version(self, source, version):
+        """Empties the cache if it holds entries for an older version.
+
+        Must be called with the lock held.
+
+        Returns:
+            bool: False if version is older than the cached entries, e.g.
+                when a slow request finishes after a write.
+        """
+        if source is self._source:
+            if version < self._version:
+                return False
+            if version == self._version:
+                return True
+        self._entries.clear()
+        self._num_bytes = 0
+        self._source = source
+        self._version = version
+        return True
@@ -0,0 +1,89 @@
+"""Unit tests for the ChangeFeed publishing changes to streams."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest import mock
+import pymongo
+import changefeed
+
+
+class StopRelay(Exception):
+    """Raised to stop ChangeFeed._relay() from retrying in tests."""
+
+
+class TestChangeFeed(unittest.TestCase):
+    """Test subscribing to and publishing on a ChangeFeed."""
+
+    def setUp(self):
+        self.feed = changefeed.ChangeFeed(max_subscribers=2, max_queued=2)
+
+    def test_publish(self):
+        """Changes are sent to every subscriber."""
+        first, second = self.feed.subscribe(), self.feed.subscribe()
+        self.feed.publish('insert', 1, {'_id': 1})
+        expected = {'operation': 'insert', '_id': 1, 'document': {'_id': 1}}
+        self.assertEqual(first.get(0), expected)
+        self.assertEqual(second.get(0), expected)
+        self.assertIsNone(first.get(0))
+
+    def test_max_subscribers(self):
+        """Subscribers past max_subscribers are refused until one leaves."""
+        first = self.feed.subscribe()
+        self.feed.subscribe()
+        self.assertIsNone(self.feed.subscribe())
+        first.close()
+        self.assertEqual(len(self.feed), 1)
+        self.assertIsNotNone(self.feed.subscribe())
+
+    def test_lost_subscription(self):
+        """Subscribers that fall too far behind are marked lost."""
+        subscription = self.feed.subscribe()
+        for document_id in range(3):
+            self.feed.publish('delete', document_id)
+        self.assertTrue(subscription.lost)
+
+    def test_publish_local(self):
+        """Local writes are only published without a change stream."""
+        subscription = self.feed.subscribe()
+        self.feed.publish_local('delete', 1)
+        self.assertEqual(subscription.get(0)['_id'], 1)
+        self.feed.watching = True
+        self.feed.publish_local('delete', 2)
+        self.assertIsNone(subscription.get(0))
+
+    def test_watch_unsupported(self):
+        """DBs without change streams fall back to publishing locally."""
+        collection = mock.MagicMock()
+        collection.watch.side_effect = pymongo.errors.OperationFailure(
+            'The $changeStream stage is only supported on replica sets')
+        self.assertFalse(self.feed.watch(collection))
+        self.assertFalse(self.feed.watching)
+
+    def test_relay(self):
+        """Changes from the change stream are published."""
+        subscription = self.feed.subscribe()
+        stream = mock.MagicMock()
+        stream.__enter__.return_value = stream
+        stream.__iter__.return_value = iter([
+            {'operationType': 'insert', 'documentKey': {'_id': 1},
+             'fullDocument': {'_id': 1, 'name': 'new'}},
+            {'operationType': 'delete', 'documentKey': {'_id': 2}}])
+        with mock.patch('changefeed.time.sleep', side_effect=StopRelay):
+            with self.assertRaises(StopRelay):
+                self.feed._relay(mock.MagicMock(), stream)
+        self.assertEqual(subscription.get(0)['document']['name'], 'new')
+        self.assertEqual(subscription.get(0),
+                         {'operation': 'delete', '_id': 2})
@@ -57,6 +57,31 @@ class TestEventsClass(unittest.TestCase):
         with self.assertRaises(ValueError):
             app.Event(**info_extra_field)
 
+    def test_from_cursor(self):
+        """Bulk conversion matches constructing each event."""
+        documents = [self.test_info, self.test_info_with_id,
+                     self.test_info_with_db_id]
+        expected = [app.Event(**dict(document)).dict
+                    for document in documents]
+        self.assertEqual(list(app.Event.from_cursor(documents)), expected)
+
+    def test_from_cursor_error(self):
+        """Bulk conversion rejects malformatted documents."""
+        info_missing_name = self.test_info.copy()
+        del info_missing_name['name']
+        info_extra_field = self.test_info.copy()
+        info_extra_field['extra'] = 'hello'
+
+        with self.assertRaises(ValueError):
+            list(app.Event.from_cursor([info_missing_name]))
+        with self.assertRaises(ValueError):
+            list(app.Event.from_cursor([info_extra_field]))
+
+    def test_no_instance_dict(self):
+        """Events store their attributes in slots only."""
+        event = app.Event(**self.test_info)
+        self.assertFalse(hasattr(event, '__dict__'))
+
     def test_events_equal(self):
         event = app.Event(**self.test_info)
         event_same = app.Event(**self.test_info)
@@ -85,5 +110,31 @@ class TestEventsClass(unittest.TestCase):
         self.assertNotEqual(self.test_info, test_info_str_time)
 
 
+class TestFieldsFromCursor(unittest.TestCase):
+    """Test app.Event.fields_from_cursor() and app.event_projection()."""
+
+    def setUp(self):
+        self.document = {'_id': 1, 'name': 'test_event',
+                         'event_time': EXAMPLE_TIME_STRING}
+
+    def test_fields_from_cursor(self):
+        """Only the _id and the given fields are included."""
+        events = list(app.Event.fields_from_cursor(
+            [self.document], ['event_time']))
+        self.assertEqual(events,
+                         [{'_id': 1, 'event_time': EXAMPLE_TIME_STRING}])
+
+    def test_missing_field(self):
+        """Documents missing a field are rejected."""
+        with self.assertRaises(ValueError):
+            list(app.Event.fields_from_cursor([self.document], ['author']))
+
+    def test_event_projection(self):
+        """Projections select the _id and the given fields."""
+        self.assertEqual(app.event_projection(['name']),
+                         {'_id': True, 'name': True})
+        self.assertEqual(app.event_projection(None), app.EVENT_PROJECTION)
+
+
 if __name__ == '__main__':
     unittest.main()
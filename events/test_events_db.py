@@ -15,8 +15,12 @@
 # limitations under the License.
 
 import unittest
+from unittest import mock
 import datetime
+import json
+from bson import ObjectId, json_util
 import mongomock
+import pymongo
 import app
 
 EXAMPLE_TIME_STRING = datetime.datetime(
@@ -56,5 +60,174 @@ class TestEventsDB(unittest.TestCase):
         self.assertEqual(info['created_at'], EXAMPLE_TIME_STRING)
 
 
+class TestTimes(unittest.TestCase):
+    """Test parsing and migrating event times."""
+
+    def test_parse_time(self):
+        """ISO 8601 times are parsed into naive UTC datetimes."""
+        expected = datetime.datetime(2019, 6, 11, 10, 33)
+        for time_string in ['2019-06-11 10:33', '2019-06-11T10:33:00',
+                            '2019-06-11T10:33:00Z',
+                            '2019-06-11T12:33:00+02:00',
+                            '2019-06-11T09:03:00.000-01:30']:
+            self.assertEqual(app.parse_time(time_string), expected)
+
+    def test_parse_bad_time(self):
+        """Times that aren't ISO 8601 raise a ValueError."""
+        for time_string in ['2019-06-11T25:00', '7-30-2019', 'soon', '', None]:
+            with self.assertRaises(ValueError):
+                app.parse_time(time_string)
+
+    def test_parse_time_range(self):
+        """from and to are parsed into a range query."""
+        self.assertEqual(app.parse_time_range({}), {})
+        self.assertEqual(
+            app.parse_time_range({'from': '2019-06-11 10:00',
+                                  'to': '2019-06-11 18:00'}),
+            {'$gte': datetime.datetime(2019, 6, 11, 10),
+             '$lt': datetime.datetime(2019, 6, 11, 18)})
+
+    def test_migrate_string_times(self):
+        """String times are converted and unparseable ones left alone."""
+        coll = mongomock.MongoClient().eventsDB.all_events
+        event_info = {'name': 'test_event',
+                      'description': 'testing!',
+                      'author': 'admin'}
+        coll.insert_many([
+            dict(event_info, event_time=EXAMPLE_TIME_STRING,
+                 created_at=EXAMPLE_TIME_STRING),
+            dict(event_info, event_time='7-30-2019',
+                 created_at=EXAMPLE_TIME_STRING),
+            dict(event_info, event_time=datetime.datetime(2019, 6, 11),
+                 created_at=datetime.datetime(2019, 6, 11))])
+        report = app.migrate_string_times(coll)
+        self.assertEqual(report, {'converted': 2, 'unparseable': 1})
+        self.assertEqual(coll.count_documents(
+            {'created_at': {'$type': 'date'}}), 3)
+        self.assertEqual(coll.count_documents(
+            {'event_time': {'$type': 'string'}}), 1)
+        # nothing left to convert
+        self.assertEqual(app.migrate_string_times(coll)['converted'], 0)
+
+
+class TestTextSearch(unittest.TestCase):
+    """Test app.text_search_event_name()."""
+
+    def test_ranked_page(self):
+        """Matches are sorted by text score and paged."""
+        coll = mock.MagicMock()
+        cursor = coll.find.return_value.sort.return_value.skip.return_value
+        cursor.limit.return_value = iter([{'name': 'stage', 'score': 1.5}])
+        events = list(app.text_search_event_name(coll, 'stage', 5, 10))
+        self.assertEqual(events, [{'name': 'stage'}])
+        query, projection = coll.find.call_args[0]
+        self.assertEqual(query, {'$text': {'$search': 'stage'}})
+        self.assertEqual(projection['score'], {'$meta': 'textScore'})
+        coll.find.return_value.sort.assert_called_once_with(
+            [('score', {'$meta': 'textScore'})])
+        coll.find.return_value.sort.return_value.skip.assert_called_once_with(
+            10)
+        cursor.limit.assert_called_once_with(5)
+
+
+class TestEnsureIndexes(unittest.TestCase):
+    """Test app.ensure_indexes()."""
+
+    def setUp(self):
+        """Create mock DB for testing."""
+        self.coll = mongomock.MongoClient().eventsDB.all_events
+
+    def test_creates_missing_indexes(self):
+        """Declared indexes are created on an empty collection."""
+        report = app.ensure_indexes(self.coll)
+        declared = [index.document['name'] for index in app.INDEXES]
+        self.assertEqual(report['created'], declared)
+        for name in declared:
+            self.assertIn(name, self.coll.index_information())
+
+    def test_idempotent(self):
+        """Reconciling twice does no work the second time."""
+        app.ensure_indexes(self.coll)
+        report = app.ensure_indexes(self.coll)
+        self.assertEqual(report['created'], [])
+        self.assertEqual(report['rebuilt'], [])
+
+    def test_rebuilds_drifted_index(self):
+        """An index with a declared name but a different spec is rebuilt."""
+        self.coll.create_index([('author', pymongo.ASCENDING)],
+                               name=app.INDEXES[0].document['name'])
+        report = app.ensure_indexes(self.coll)
+        self.assertEqual(report['rebuilt'], [app.INDEXES[0].document['name']])
+
+    def test_rebuilds_text_index_with_new_fields(self):
+        """The name-only text index of existing DBs is rebuilt weighted."""
+        self.coll.create_index([('name', pymongo.TEXT)])  # named name_text
+        report = app.ensure_indexes(self.coll)
+        self.assertEqual(report['rebuilt'], ['name_text'])
+        self.assertEqual(report['failed'], [])
+        self.assertEqual(
+            list(self.coll.index_information()['name_text']['key']),
+            [('name', 'text'), ('description', 'text')])
+
+    def test_replaces_undeclared_text_index(self):
+        """A text index under another name is replaced by the declared one."""
+        self.coll.create_index([('name', pymongo.TEXT)], name='text_search')
+        report = app.ensure_indexes(self.coll)
+        self.assertEqual(report['rebuilt'], ['name_text'])
+        self.assertEqual(report['undeclared'], [])
+        self.assertNotIn('text_search', self.coll.index_information())
+        self.assertIn('name_text', self.coll.index_information())
+
+    def test_text_index_weights(self):
+        """Text indexes are compared by weights where the DB reports them."""
+        spec = app.INDEXES[0].document
+        info = {'key': [('_fts', 'text'), ('_ftsx', 1)],
+                'weights': {'name': 10, 'description': 1}}
+        self.assertTrue(app.index_matches(info, spec))
+        info['weights'] = {'name': 1}
+        self.assertFalse(app.index_matches(info, spec))
+
+    def test_reports_undeclared_index(self):
+        """Indexes that are not declared are reported but not dropped."""
+        self.coll.create_index([('author', pymongo.ASCENDING)], name='extra')
+        report = app.ensure_indexes(self.coll)
+        self.assertEqual(report['undeclared'], ['extra'])
+        self.assertIn('extra', self.coll.index_information())
+
+
+class TestDumps(unittest.TestCase):
+    """Test app.dumps()."""
+
+    def setUp(self):
+        """Create a document with BSON types."""
+        self.document = {
+            '_id': ObjectId(),
+            'created_at': datetime.datetime(2019, 6, 11, 10, 33, 1),
+            'updated_at': datetime.datetime(2019, 6, 11, 10, 33, 1, 250000),
+            'names': ['a', 'b'],
+            'count': 2}
+
+    def test_matches_json_util(self):
+        """Output has the same extended JSON shape as bson.json_util."""
+        self.assertEqual(json.loads(app.dumps(self.document)),
+                         json.loads(json_util.dumps(self.document)))
+
+    def test_round_trip(self):
+        """Output can be loaded back into the original BSON types."""
+        self.assertEqual(json_util.loads(app.dumps(self.document)),
+                         self.document)
+
+    def test_without_orjson(self):
+        """Standard library fallback produces the same output."""
+        with mock.patch('app.orjson', None):
+            self.assertEqual(json.loads(app.dumps(self.document)),
+                             json.loads(json_util.dumps(self.document)))
+
+    def test_unserializable(self):
+        """Unknown types raise a TypeError."""
+        with self.assertRaises(TypeError):
+            app.dumps({'unknown': object()})
+
+
 if __name__ == '__main__':
     unittest.main()
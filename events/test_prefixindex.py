@@ -0,0 +1,72 @@
+"""Unit tests for the PrefixIndex of event names."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from prefixindex import PrefixIndex, name_keys
+
+EVENTS = [
+    ('0', 'Knative Summit Keynote'),
+    ('1', 'Serverless Summit'),
+    ('2', 'Summer   BBQ'),
+    ('3', 'Keynote Q&A')]
+
+
+class TestPrefixIndex(unittest.TestCase):
+    """Test building, adding to and searching a PrefixIndex."""
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.build(EVENTS, source='events', version=1)
+
+    def test_name_keys(self):
+        """A name is indexed from the start of each of its words."""
+        self.assertEqual(name_keys('Knative  Summit'),
+                         ['knative summit', 'summit'])
+        self.assertEqual(name_keys('   '), [])
+
+    def test_suggest_prefix_of_any_word(self):
+        """Names are found by a prefix of any of their words."""
+        self.assertEqual(self.index.suggest('key', 10),
+                         [('0', 'Knative Summit Keynote'),
+                          ('3', 'Keynote Q&A')])
+        self.assertEqual(
+            [event_id for event_id, _ in self.index.suggest('SUM', 10)],
+            ['2', '1', '0'])
+
+    def test_suggest_several_words(self):
+        """Prefixes spanning several words match runs of words."""
+        self.assertEqual(self.index.suggest(' summer  bb', 10),
+                         [('2', 'Summer   BBQ')])
+        self.assertEqual(self.index.suggest('summit key', 10),
+                         [('0', 'Knative Summit Keynote')])
+        self.assertEqual(self.index.suggest('summit z', 10), [])
+
+    def test_suggest_limit(self):
+        """At most limit suggestions are returned."""
+        self.assertEqual(len(self.index.suggest('s', 2)), 2)
+
+    def test_add_next_version(self):
+        """New events are added if they are the only change."""
+        self.assertTrue(self.index.add([('4', 'Summit Party')], 'events', 2))
+        self.assertEqual(self.index.version, 2)
+        self.assertIn(('4', 'Summit Party'), self.index.suggest('party', 10))
+
+    def test_add_out_of_date(self):
+        """Events aren't added if the index missed other changes."""
+        self.assertFalse(self.index.add([('4', 'Summit Party')], 'events', 3))
+        self.assertFalse(self.index.add([('4', 'Summit Party')], 'other', 2))
+        self.assertEqual(self.index.suggest('party', 10), [])
+        self.assertEqual(self.index.version, 1)
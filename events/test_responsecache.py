@@ -0,0 +1,68 @@
+"""Unit tests for the ResponseCache of serialized responses."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from responsecache import ResponseCache
+
+MIMETYPE = 'application/json'
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test caching, evicting and invalidating responses."""
+
+    def setUp(self):
+        self.cache = ResponseCache(max_bytes=10)
+        self.source = object()
+
+    def test_get_put(self):
+        """Cached bodies are returned for the same version."""
+        self.assertIsNone(self.cache.get(self.source, 1, 'a'))
+        self.cache.put(self.source, 1, 'a', b'1234', MIMETYPE)
+        self.assertEqual(self.cache.get(self.source, 1, 'a'),
+                         (b'1234', MIMETYPE))
+        self.assertEqual(self.cache.num_bytes, 4)
+
+    def test_evict_least_recently_used(self):
+        """Entries used least recently are evicted to stay under max_bytes."""
+        self.cache.put(self.source, 1, 'a', b'1234', MIMETYPE)
+        self.cache.put(self.source, 1, 'b', b'1234', MIMETYPE)
+        self.cache.get(self.source, 1, 'a')
+        self.cache.put(self.source, 1, 'c', b'1234', MIMETYPE)
+        self.assertIsNone(self.cache.get(self.source, 1, 'b'))
+        self.assertIsNotNone(self.cache.get(self.source, 1, 'a'))
+        self.assertEqual(self.cache.num_bytes, 8)
+        # too large to cache at all
+        self.cache.put(self.source, 1, 'd', b'12345678901', MIMETYPE)
+        self.assertIsNone(self.cache.get(self.source, 1, 'd'))
+        self.assertEqual(len(self.cache), 2)
+
+    def test_new_version(self):
+        """A newer version or another source empties the cache."""
+        self.cache.put(self.source, 1, 'a', b'1234', MIMETYPE)
+        self.assertIsNone(self.cache.get(self.source, 2, 'a'))
+        self.assertEqual(len(self.cache), 0)
+        self.cache.put(self.source, 2, 'a', b'1234', MIMETYPE)
+        self.assertIsNone(self.cache.get(object(), 2, 'a'))
+        self.assertEqual(self.cache.num_bytes, 0)
+
+    def test_old_version(self):
+        """Responses built from an older version are neither served nor
+        cached."""
+        self.cache.put(self.source, 2, 'a', b'1234', MIMETYPE)
+        self.cache.put(self.source, 1, 'b', b'1234', MIMETYPE)
+        self.assertIsNone(self.cache.get(self.source, 1, 'a'))
+        self.assertIsNone(self.cache.get(self.source, 2, 'b'))
+        self.assertIsNotNone(self.cache.get(self.source, 2, 'a'))
@@ -86,6 +86,22 @@ class TestUploadEventRoute(unittest.TestCase):
 
         self.assertEqual(self.coll.count_documents({}), 1)
 
+    def test_add_event_stores_datetimes(self):
+        """Test event times are stored as native datetimes."""
+        self.client.post('/v1/add', data=VALID_REQUEST_INFO)
+        event = self.coll.find_one()
+        self.assertEqual(event['event_time'],
+                         datetime.datetime(2019, 6, 11, 10, 33, 1))
+        self.assertIsInstance(event['created_at'], datetime.datetime)
+
+    def test_add_invalid_event_time(self):
+        """Test posting of event with a malformatted time."""
+        response = self.client.post(
+            '/v1/add', data=dict(VALID_REQUEST_INFO, event_time='soon'))
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.coll.count_documents({}), 0)
+
     def test_add_invalid_event(self):
         """Test posting of invalid event with missing attributes."""
         response = self.client.post(
@@ -106,6 +122,152 @@ class TestUploadEventRoute(unittest.TestCase):
             self.assertEqual(self.coll.count_documents({}), 0)
 
 
+class TestBulkAddEventsRoute(unittest.TestCase):
+    """Test bulk add events endpoint POST /v1/add_bulk."""
+
+    def setUp(self):
+        """Set up test client and mock DB."""
+        self.coll = mongomock.MongoClient().db.collection
+        app.app.config['COLLECTION'] = self.coll
+        app.app.config['TESTING'] = True
+        self.client = app.app.test_client()
+
+    def test_add_json_array(self):
+        """Test adding a JSON array of valid events."""
+        response = self.client.post(
+            '/v1/add_bulk', json=[VALID_REQUEST_INFO] * 3)
+        self.assertEqual(response.status_code, 201)
+        data = json_util.loads(response.data)
+        self.assertEqual(data['num_added'], 3)
+        self.assertEqual(self.coll.count_documents({}), 3)
+        for result in data['results']:
+            self.assertEqual(self.coll.count_documents(
+                {'_id': result['_id']}), 1)
+
+    def test_add_ndjson(self):
+        """Test adding newline-delimited JSON events."""
+        body = '\n'.join(json_util.dumps(VALID_REQUEST_INFO)
+                         for _ in range(2))
+        response = self.client.post(
+            '/v1/add_bulk', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.coll.count_documents({}), 2)
+
+    def test_partially_invalid(self):
+        """Test invalid items are reported without blocking valid ones."""
+        items = [VALID_REQUEST_INFO,
+                 INVALID_REQUEST_INFO_MISSING_ATTRIBUTE,
+                 'not an event',
+                 VALID_REQUEST_INFO]
+        with patch('app.BULK_CHUNK_SIZE', 1):
+            response = self.client.post('/v1/add_bulk', json=items)
+        self.assertEqual(response.status_code, 207)
+        data = json_util.loads(response.data)
+        self.assertEqual(data['num_added'], 2)
+        self.assertEqual(
+            ['_id' in result for result in data['results']],
+            [True, False, False, True])
+        self.assertEqual(self.coll.count_documents({}), 2)
+
+    def test_non_string_fields(self):
+        """Test items with fields that aren't strings are not inserted."""
+        items = [dict(VALID_REQUEST_INFO, **{field: 123})
+                 for field in app.BULK_STRING_FIELDS]
+        response = self.client.post(
+            '/v1/add_bulk', json=items + [VALID_REQUEST_INFO])
+        self.assertEqual(response.status_code, 207)
+        data = json_util.loads(response.data)
+        self.assertEqual(data['num_added'], 1)
+        self.assertEqual(['error' in result for result in data['results']],
+                         [True] * len(items) + [False])
+        self.assertEqual(self.coll.count_documents({}), 1)
+
+    def test_write_errors(self):
+        """Test events rejected by the DB are reported per item."""
+        error = app.pymongo.errors.BulkWriteError({'writeErrors': [
+            {'index': 1, 'errmsg': 'E11000 duplicate key error'}]})
+        with patch.object(self.coll, 'insert_many', side_effect=error):
+            response = self.client.post(
+                '/v1/add_bulk', json=[VALID_REQUEST_INFO] * 2)
+        self.assertEqual(response.status_code, 207)
+        data = json_util.loads(response.data)
+        self.assertIn('_id', data['results'][0])
+        self.assertEqual(data['results'][1]['error'],
+                         'E11000 duplicate key error')
+
+    def test_malformatted_body(self):
+        """Test bodies that are not a JSON array of events."""
+        for body in ['{"event_name": "not in an array"}', '[not json']:
+            response = self.client.post(
+                '/v1/add_bulk', data=body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.coll.count_documents({}), 0)
+
+    def test_db_not_defined(self):
+        """Test adding events when DB connection is undefined."""
+        with environ(app.os.environ):
+            if 'MONGODB_URI' in app.os.environ:
+                del app.os.environ['MONGODB_URI']
+            app.app.config['COLLECTION'] = app.connect_to_mongodb()
+            response = self.client.post(
+                '/v1/add_bulk', json=[VALID_REQUEST_INFO])
+            self.assertEqual(response.status_code, 500)
+
+
+class TestStreamChangesRoute(unittest.TestCase):
+    """Test streaming changes at endpoint GET /v1/stream."""
+
+    def setUp(self):
+        """Set up test client and mock DB."""
+        self.coll = mongomock.MongoClient().db.collection
+        app.app.config['COLLECTION'] = self.coll
+        app.app.config['TESTING'] = True
+        self.client = app.app.test_client()
+
+    @patch('app.STREAM_MAX_SECONDS', 0.2)
+    def test_stream_added_events(self):
+        """Events added while streaming are sent as SSE messages."""
+        response = self.client.get('/v1/stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.client.post('/v1/add', data=VALID_REQUEST_INFO)
+        self.client.post('/v1/add_bulk', json=[VALID_REQUEST_INFO])
+        messages = response.get_data().split(b'\n\n')
+        response.close()
+        self.assertEqual(len(app.CHANGE_FEED), 0)
+
+        self.assertTrue(messages[0].startswith(b'retry: '))
+        changes = [message.split(b'\n') for message in messages
+                   if message.startswith(b'event: ')]
+        self.assertEqual(len(changes), 2)
+        for event_line, data_line in changes:
+            self.assertEqual(event_line, b'event: insert')
+            change = json_util.loads(data_line[len(b'data: '):])
+            self.assertEqual(change['document']['name'],
+                             VALID_REQUEST_INFO['event_name'])
+            self.assertEqual(change['_id'], change['document']['_id'])
+
+    @patch('app.STREAM_MAX_SECONDS', 0.2)
+    @patch('app.STREAM_KEEPALIVE_SECONDS', 0.05)
+    def test_keepalive(self):
+        """Comments are sent while there are no changes."""
+        response = self.client.get('/v1/stream')
+        self.assertIn(b': keepalive\n\n', response.get_data())
+        response.close()
+
+    def test_too_many_subscribers(self):
+        """Clients past MAX_STREAM_SUBSCRIBERS are turned away."""
+        subscriptions = [app.CHANGE_FEED.subscribe()
+                         for _ in range(app.MAX_STREAM_SUBSCRIBERS)]
+        try:
+            response = self.client.get('/v1/stream')
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+        finally:
+            for subscription in subscriptions:
+                subscription.close()
+
+
 class TestGetEventsRoute(unittest.TestCase):
     """Test retrieve all events endpoint GET /v1/."""
 
@@ -140,6 +302,171 @@ class TestGetEventsRoute(unittest.TestCase):
         self.assertEqual(len(data['events']), 0)
         self.assertEqual(data['num_events'], 0)
 
+    def test_paginate_events(self):
+        """Test walking through all events one page at a time."""
+        event = {key: value for key, value in VALID_DB_EVENT.items()
+                 if key != '_id'}
+        app.app.config['COLLECTION'].insert_many(
+            [dict(event) for _ in range(5)])
+
+        seen_ids = []
+        cursor = None
+        for _ in range(3):
+            query = {'limit': 2}
+            if cursor is not None:
+                query['after'] = cursor
+            response = self.client.get('/v1/', query_string=query)
+            self.assertEqual(response.status_code, 200)
+            data = json_util.loads(response.data)
+            seen_ids += [event['_id'] for event in data['events']]
+            cursor = data['next_cursor']
+
+        self.assertIsNone(cursor)
+        self.assertEqual(seen_ids, sorted(seen_ids))
+        self.assertEqual(len(set(seen_ids)), 5)
+
+    def test_stream_ndjson(self):
+        """Test streaming events one per line as newline-delimited JSON."""
+        app.app.config['COLLECTION'].insert_many(self.fake_events)
+
+        response = self.client.get(
+            '/v1/', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.data.splitlines()
+        self.assertEqual(len(lines), len(self.fake_events))
+        for line, fake_event in zip(lines, self.fake_events):
+            self.assertEqual(json_util.loads(line)['name'], fake_event['name'])
+
+    def test_time_range(self):
+        """Test filtering events by a range of event times."""
+        for hour in [9, 12, 15, 18]:
+            self.client.post('/v1/add', data=dict(
+                VALID_REQUEST_INFO, event_time=f'2019-06-11 {hour}:00'))
+
+        response = self.client.get('/v1/', query_string={
+            'from': '2019-06-11 12:00', 'to': '2019-06-11T18:00:00Z'})
+        self.assertEqual(response.status_code, 200)
+        data = json_util.loads(response.data)
+        self.assertEqual([event['event_time'].hour
+                          for event in data['events']], [12, 15])
+
+        response = self.client.get('/v1/', query_string={'from': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        """Test revalidating the event list with its ETag."""
+        app.app.config['COLLECTION'].insert_many(self.fake_events)
+        response = self.client.get('/v1/')
+        etag = response.headers['ETag']
+
+        response = self.client.get('/v1/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        response = self.client.get('/v1/',
+                                   headers={'If-None-Match': 'W/' + etag})
+        self.assertEqual(response.status_code, 304)
+
+        # adding an event changes the ETag
+        self.client.post('/v1/add', data=VALID_REQUEST_INFO)
+        response = self.client.get('/v1/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        data = json_util.loads(response.data)
+        self.assertEqual(data['num_events'], len(self.fake_events) + 1)
+
+    def test_conditional_get_ndjson(self):
+        """Test JSON and NDJSON responses are revalidated separately."""
+        app.app.config['COLLECTION'].insert_many(self.fake_events)
+        etag = self.client.get('/v1/').headers['ETag']
+        ndjson = {'Accept': 'application/x-ndjson'}
+        response = self.client.get(
+            '/v1/', headers=dict(ndjson, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        response = self.client.get('/v1/', headers=dict(
+            ndjson, **{'If-None-Match': response.headers['ETag']}))
+        self.assertEqual(response.status_code, 304)
+
+    def test_conditional_get_last_modified(self):
+        """Test revalidating the event list with its Last-Modified date."""
+        self.client.post('/v1/add', data=VALID_REQUEST_INFO)
+        response = self.client.get('/v1/')
+        last_modified = response.headers['Last-Modified']
+
+        response = self.client.get(
+            '/v1/', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_cached_response(self):
+        """Test repeated requests are answered without querying the DB."""
+        app.app.config['COLLECTION'].insert_many(self.fake_events)
+        first = self.client.get('/v1/')
+        with patch('app.find_events_page') as mock_find, \
+                patch('app.get_collection_version') as mock_version:
+            response = self.client.get('/v1/')
+            mock_find.assert_not_called()
+            mock_version.assert_not_called()
+        self.assertEqual(response.data, first.data)
+        self.assertEqual(response.mimetype, 'application/json')
+
+        # adding an event makes the cached response stale
+        self.client.post('/v1/add', data=VALID_REQUEST_INFO)
+        data = json_util.loads(self.client.get('/v1/').data)
+        self.assertEqual(data['num_events'], len(self.fake_events) + 1)
+
+    def test_fields(self):
+        """Test returning only the requested fields of each event."""
+        app.app.config['COLLECTION'].insert_many(
+            [dict(event) for event in self.fake_events])
+        response = self.client.get('/v1/', query_string={
+            'fields': 'name,event_time', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        data = json_util.loads(response.data)
+        self.assertEqual(list(data['events'][0]),
+                         ['_id', 'name', 'event_time'])
+        self.assertEqual(data['next_cursor'], str(data['events'][0]['_id']))
+
+        response = self.client.get(
+            '/v1/', query_string={'fields': 'name'},
+            headers={'Accept': 'application/x-ndjson'})
+        for line in response.data.splitlines():
+            self.assertEqual(list(json_util.loads(line)), ['_id', 'name'])
+
+    def test_bad_fields(self):
+        """Test requesting fields events don't have."""
+        for fields in ['password', 'name,', '']:
+            response = self.client.get('/v1/',
+                                       query_string={'fields': fields})
+            self.assertEqual(response.status_code, 400)
+
+    def test_no_limit_has_no_next_page(self):
+        """Test retrieving all events returns no cursor."""
+        app.app.config['COLLECTION'].insert_many(self.fake_events)
+
+        response = self.client.get('/v1/')
+        data = json_util.loads(response.data)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_bad_page_args(self):
+        """Test malformatted limit and after parameters."""
+        for query in [{'limit': 0},
+                      {'limit': 'ten'},
+                      {'limit': app.MAX_PAGE_SIZE + 1},
+                      {'after': 'not an id'}]:
+            response = self.client.get('/v1/', query_string=query)
+            self.assertEqual(response.status_code, 400)
+
+    def test_malformatted_stored_event(self):
+        """Test that a bad event in the DB is a server error, not a 400."""
+        event_id = app.app.config['COLLECTION'].insert_one(
+            {'name': 'no other fields'}).inserted_id
+        with patch.dict(app.app.config, {'PROPAGATE_EXCEPTIONS': False}):
+            for path in ['/v1/', f'/v1/batch?ids={event_id}']:
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 500)
+
     def test_db_not_defined(self):
         """Test getting events when DB connection is undefined."""
         with environ(app.os.environ):
@@ -203,6 +530,46 @@ class TestSearchEventsRoute(unittest.TestCase):
         self.assertEqual(len(data['events']), 0)
         self.assertEqual(data['num_events'], 0)
 
+    def test_search_limit_offset(self):
+        """Limit and offset are passed to the search and set next_offset."""
+        with patch('app.text_search_event_name',
+                   return_value=[VALID_DB_EVENT]) as mock_search:
+            response = self.client.get('/v1/search', query_string={
+                'name': VALID_EVENT_NAME, 'limit': 1, 'offset': 3})
+            self.assertEqual(mock_search.call_args[0][2:4], (1, 3))
+        data = json_util.loads(response.data)
+        self.assertEqual(data['next_offset'], 4)
+
+        with patch('app.text_search_event_name',
+                   return_value=[VALID_DB_EVENT]) as mock_search:
+            response = self.client.get('/v1/search',
+                                       query_string={'name': 'event'})
+            self.assertEqual(mock_search.call_args[0][2:4],
+                             (app.DEFAULT_SEARCH_LIMIT, 0))
+        data = json_util.loads(response.data)
+        self.assertIsNone(data['next_offset'])
+
+    def test_search_bad_limit_offset(self):
+        """Malformatted limit and offset parameters."""
+        for query in [{'limit': 0}, {'limit': app.MAX_PAGE_SIZE + 1},
+                      {'offset': -1}, {'offset': 'one'},
+                      {'offset': app.MAX_SEARCH_OFFSET + 1}]:
+            query['name'] = VALID_EVENT_NAME
+            response = self.client.get('/v1/search', query_string=query)
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_cached(self):
+        """Searches differing only in case and spacing share a response."""
+        with patch('app.text_search_event_name',
+                   return_value=[VALID_DB_EVENT]) as mock_search:
+            self.client.get('/v1/search?name=' + VALID_EVENT_NAME)
+            response = self.client.get(
+                '/v1/search?name= ' + VALID_EVENT_NAME.upper())
+            self.assertEqual(mock_search.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        data = json_util.loads(response.data)
+        self.assertEqual(data['events'][0]['name'], VALID_EVENT_NAME)
+
     def test_search_malformatted_name(self):
         """Malformatted query when searching for events."""
         response = self.client.get('/v1/search?bad_arg=' + 'not allowed')
@@ -218,8 +585,63 @@ class TestSearchEventsRoute(unittest.TestCase):
             self.assertEqual(response.status_code, 500)
 
 
+class TestSuggestEventNamesRoute(unittest.TestCase):
+    """Test suggesting events by name prefix at endpoint GET /v1/suggest."""
+
+    def setUp(self):
+        """Set up test client and seed mock DB."""
+        self.coll = mongomock.MongoClient().db.collection
+        app.app.config['COLLECTION'] = self.coll
+        app.app.config['TESTING'] = True
+        self.client = app.app.test_client()
+        self.coll.insert_many([
+            {'name': 'Knative Summit'}, {'name': 'Summer BBQ'}])
+
+    def get_suggested_names(self, query):
+        """Returns the names of the events suggested for the query string."""
+        response = self.client.get('/v1/suggest?' + query)
+        self.assertEqual(response.status_code, 200)
+        data = json_util.loads(response.data)
+        self.assertEqual(data['num_suggestions'], len(data['suggestions']))
+        return [suggestion['name'] for suggestion in data['suggestions']]
+
+    def test_suggest(self):
+        """Events are suggested by a prefix of any word in their name."""
+        self.assertEqual(self.get_suggested_names('q=sum'),
+                         ['Summer BBQ', 'Knative Summit'])
+        self.assertEqual(self.get_suggested_names('q=sum&limit=1'),
+                         ['Summer BBQ'])
+        self.assertEqual(self.get_suggested_names('q=nothing'), [])
+        self.assertEqual(self.get_suggested_names('q='), [])
+
+    def test_suggest_added_event(self):
+        """Events added through the service are suggested right away."""
+        self.get_suggested_names('q=sum')
+        self.client.post('/v1/add', data=VALID_REQUEST_INFO)
+        self.assertEqual(self.get_suggested_names('q=valid'),
+                         [VALID_REQUEST_INFO['event_name']])
+
+    def test_suggest_event_added_elsewhere(self):
+        """Events added by other instances are suggested after a refresh."""
+        self.get_suggested_names('q=sum')
+        self.coll.insert_one({'name': 'Summit Party'})
+        app.bump_collection_version(self.coll)
+        # not checked for until NAME_INDEX_MAX_AGE has passed
+        self.assertEqual(self.get_suggested_names('q=party'), [])
+        app.NAME_INDEX.checked_at -= app.NAME_INDEX_MAX_AGE
+        self.assertEqual(self.get_suggested_names('q=party'),
+                         ['Summit Party'])
+
+    def test_suggest_bad_args(self):
+        """The prefix is required and the limit must be in range."""
+        for query in ['', 'q=sum&limit=0', 'q=sum&limit=ten',
+                      f'q=sum&limit={app.MAX_SUGGESTIONS + 1}']:
+            response = self.client.get('/v1/suggest?' + query)
+            self.assertEqual(response.status_code, 400)
+
+
 class TestGetEventByID(unittest.TestCase):
-    """Test searching for an event by name at endpoint GET /v1/."""
+    """Test retrieving an event by ID at endpoint GET /v1/<event_id>."""
 
     def setUp(self):
         """Set up test client and seed mock DB."""
@@ -228,15 +650,15 @@ class TestGetEventByID(unittest.TestCase):
         app.app.config['TESTING'] = True
         self.client = app.app.test_client()
         self.fake_events = [
-            VALID_DB_EVENT,
-            VALID_DB_EVENT_WITH_ID
+            dict(VALID_DB_EVENT),
+            dict(VALID_DB_EVENT_WITH_ID)
         ]
         self.coll.insert_many(self.fake_events)
 
     def test_search_existing_event(self):
         """Search for an event that exists in the DB."""
-        id_to_search = VALID_DB_EVENT['_id']
-        response = self.client.put(f'/v1/{id_to_search}')
+        id_to_search = self.fake_events[0]['_id']
+        response = self.client.get(f'/v1/{id_to_search}')
         self.assertEqual(response.status_code, 200)
         data = json_util.loads(response.data)
 
@@ -244,26 +666,109 @@ class TestGetEventByID(unittest.TestCase):
         self.assertEqual(len(data['events']), 1)
         self.assertEqual(data['num_events'], 1)
 
+    def test_put_still_supported(self):
+        """Events can still be retrieved with PUT."""
+        id_to_search = self.fake_events[0]['_id']
+        response = self.client.put(f'/v1/{id_to_search}')
+        self.assertEqual(response.status_code, 200)
+        data = json_util.loads(response.data)
+        self.assertEqual(data['events'][0]['_id'], id_to_search)
+
     def test_search_nonexisting_event(self):
         """Search for an event that doesn't exist in the DB."""
         nonexistent_event_id = '123456789123456789123456'
-        response = self.client.put('/v1/' + nonexistent_event_id)
+        response = self.client.get('/v1/' + nonexistent_event_id)
         self.assertEqual(response.status_code, 200)
         data = json_util.loads(response.data)
 
         self.assertEqual(len(data['events']), 0)
         self.assertEqual(data['num_events'], 0)
 
+    def test_malformatted_id(self):
+        """Search for an ID that can't be an event's."""
+        response = self.client.get('/v1/not_an_id')
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        """Revalidate an event with its ETag."""
+        response = self.client.get(f'/v1/{self.fake_events[0]["_id"]}')
+        response = self.client.get(
+            f'/v1/{self.fake_events[0]["_id"]}',
+            headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_put_not_conditional(self):
+        """PUT ignores the ETag and always returns the event."""
+        event_id = self.fake_events[0]['_id']
+        etag = self.client.get(f'/v1/{event_id}').headers['ETag']
+        response = self.client.put(f'/v1/{event_id}',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
+
     def test_db_not_defined(self):
         """Test getting events when DB connection is undefined."""
-        id_to_search = VALID_DB_EVENT['_id']
+        id_to_search = self.fake_events[0]['_id']
         with environ(app.os.environ):
             if 'MONGODB_URI' in app.os.environ:
                 del app.os.environ['MONGODB_URI']
             app.app.config['COLLECTION'] = app.connect_to_mongodb()
-            response = self.client.put(f'/v1/{id_to_search}')
+            response = self.client.get(f'/v1/{id_to_search}')
             self.assertEqual(response.status_code, 500)
 
 
+class TestGetEventsByIDs(unittest.TestCase):
+    """Test retrieving several events at endpoint GET /v1/batch."""
+
+    def setUp(self):
+        """Set up test client and seed mock DB."""
+        self.coll = mongomock.MongoClient().db.collection
+        app.app.config['COLLECTION'] = self.coll
+        app.app.config['TESTING'] = True
+        self.client = app.app.test_client()
+        self.event_ids = [
+            str(self.coll.insert_one(dict(event)).inserted_id)
+            for event in [VALID_DB_EVENT, VALID_DB_EVENT_WITH_ID]]
+
+    def get_event_ids(self, ids):
+        """Returns the IDs of the events retrieved for ids."""
+        response = self.client.get('/v1/batch', query_string={'ids': ids})
+        self.assertEqual(response.status_code, 200)
+        data = json_util.loads(response.data)
+        self.assertEqual(data['num_events'], len(data['events']))
+        return [str(event['_id']) for event in data['events']]
+
+    def test_get_events_by_ids(self):
+        """Events are returned once each, in the order requested."""
+        missing_id = '123456789123456789123456'
+        ids = [self.event_ids[1], missing_id, self.event_ids[0],
+               self.event_ids[1]]
+        self.assertEqual(self.get_event_ids(','.join(ids)),
+                         [self.event_ids[1], self.event_ids[0]])
+        self.assertEqual(self.get_event_ids(missing_id), [])
+
+    def test_one_query(self):
+        """All events are found with one query."""
+        with patch.object(self.coll, 'find', wraps=self.coll.find) as find:
+            self.get_event_ids(','.join(self.event_ids))
+            find.assert_called_once()
+
+    def test_fields(self):
+        """Only the requested fields of each event are returned."""
+        response = self.client.get('/v1/batch', query_string={
+            'ids': ','.join(self.event_ids), 'fields': 'name'})
+        data = json_util.loads(response.data)
+        self.assertEqual([list(event) for event in data['events']],
+                         [['_id', 'name'], ['_id', 'name']])
+
+    def test_bad_ids(self):
+        """IDs are required, must be well formatted and not too many."""
+        too_many = ','.join([self.event_ids[0]] * (app.MAX_BATCH_IDS + 1))
+        for query in [{}, {'ids': ''}, {'ids': 'abc'},
+                      {'ids': self.event_ids[0] + ',abc'},
+                      {'ids': too_many}]:
+            response = self.client.get('/v1/batch', query_string=query)
+            self.assertEqual(response.status_code, 400)
+
 if __name__ == '__main__':
     unittest.main()
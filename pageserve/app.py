@@ -18,23 +18,65 @@ Serve web UI and act as an API gateway to other services.
 # limitations under the License.
 
 import os
-from flask import Flask, render_template, request, url_for, session, redirect
+import re
+import time
+import datetime
+import threading
+from collections import OrderedDict
+from flask import (Flask, render_template, request, url_for, session,
+                   redirect, jsonify, make_response)
 from werkzeug.exceptions import BadRequestKeyError  # WSGI library for Flask
 
 import requests
+from streamrelay import StreamRelay
 
 app = Flask(__name__)  # pylint: disable=invalid-name
 
+# most responses kept by get_with_revalidation() for revalidating
+REVALIDATION_CACHE_SIZE = 128
+REVALIDATION_CACHE = OrderedDict()
+REVALIDATION_CACHE_LOCK = threading.Lock()
+
+# pages streaming changes share one stream from each service per worker,
+# see StreamRelay, and under gunicorn's gevent workers (see the Dockerfile)
+# each only holds a greenlet, so many may be open at once. This leaves half
+# of the Dockerfile's 1000 worker connections for other requests.
+MAX_STREAM_CLIENTS = 500  # per service and worker
+STREAM_RELAYS = {}  # URL of a service's stream -> StreamRelay
+STREAM_RELAYS_LOCK = threading.Lock()
+# seconds to wait for data from a stream, which sends keepalives more often
+STREAM_READ_TIMEOUT = 60
+STREAM_KEEPALIVE_SECONDS = 15  # most time between messages to clients
+STREAM_MAX_SECONDS = 300  # time after which a client's stream is closed
+STREAM_RETRY_MILLISECONDS = 3000  # time clients wait before reconnecting
+
+# number of posts shown per page, older ones are linked to
+POSTS_PAGE_SIZE = 20
+# number of events shown per page of search results, more are linked to
+SEARCH_PAGE_SIZE = 20
+
+# how times from the events and posts services are shown in templates
+DISPLAY_TIME_FORMAT = '%Y-%m-%d %H:%M'
+# formats of the UTC times sent by the events and posts services
+UTC_TIME_FORMATS = ['%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S.%fZ']
+
 
 @app.route('/v1/', methods=['GET'])
 def index():
-    """Displays home page with all past posts."""
+    """Displays home page with a page of past posts, newest first.
+
+    An optional `before` query parameter is the cursor of the page to show.
+    """
     try:
+        posts, next_cursor = get_posts(before=request.args.get('before'))
         return render_template(
             'index.html',
-            posts=get_posts(),
+            posts=posts,
+            next_cursor=next_cursor,
+            post_events=get_events_of_posts(posts),
+            post_authors=get_authors_of_posts(posts),
             auth=is_organizer(get_user()),
-            events=get_events(),
+            events=get_events(fields=['name']),
             app_config=app.config
         )
     except RuntimeError as error:
@@ -46,17 +88,26 @@ def search_event():
     """
     Searches for the event(s) with the given name.
 
-    Displays a page with all results if query is successful.
+    Displays a page of SEARCH_PAGE_SIZE results if query is successful, best
+    matches first. An optional `offset` form field is the number of matches
+    to skip, and the page links to the next one if there are more.
     """
     try:
         event_name = request.form['event_name']
-        response = requests.get(app.config['EVENTS_ENDPOINT'] + 'search',
-                                params={'name': event_name})
+        offset = request.form.get('offset', '0')
+        if not offset.isdigit():
+            return 'Error: offset must be a number.', 400
+        response = requests.get(
+            app.config['EVENTS_ENDPOINT'] + 'search',
+            params={'name': event_name, 'limit': SEARCH_PAGE_SIZE,
+                    'offset': offset})
         if response.status_code == 200:
             return render_template(
                 'search_results.html',
                 auth=is_organizer(get_user()),
                 events=parse_events(response.json()),
+                event_name=event_name,
+                next_offset=response.json().get('next_offset'),
                 app_config=app.config
             )
         else:
@@ -74,7 +125,7 @@ def query_event_by_id():
     """
     try:
         event_id = request.args['event_id']
-        response = requests.put(app.config['EVENTS_ENDPOINT'] + event_id)
+        response = requests.get(app.config['EVENTS_ENDPOINT'] + event_id)
         if response.status_code == 200:
             return render_template(
                 'search_results.html',
@@ -88,22 +139,106 @@ def query_event_by_id():
         return f'Error: {error}.', 400
 
 
+@app.route('/v1/suggest_events', methods=['GET'])
+def suggest_events():
+    """Suggests events whose name starts with what's typed in the search box.
+
+    Relays the `q` and `limit` parameters to the events service's
+    /v1/suggest and returns its JSON list of suggestions.
+    """
+    response = requests.get(app.config['EVENTS_ENDPOINT'] + 'suggest',
+                            params=request.args)
+    if response.status_code != 200:
+        return 'Unable to retrieve suggestions', response.status_code
+    return jsonify(response.json())
+
+
+@app.route('/v1/stream/<service>', methods=['GET'])
+def relay_stream(service):
+    """Relays the Server-Sent Events stream of changes to events or posts.
+
+    The changes come from one stream of the service shared by every client,
+    see get_stream_relay(). A comment is sent every STREAM_KEEPALIVE_SECONDS
+    while there are no changes. The stream is closed after
+    STREAM_MAX_SECONDS, or early if the service's stream fails or the client
+    can't keep up, and EventSource clients then reconnect on their own.
+
+    Args:
+        service: 'events' or 'posts', whose /v1/stream is relayed.
+
+    Response:
+        503: MAX_STREAM_CLIENTS clients are already streaming the service.
+    """
+    endpoints = {'events': 'EVENTS_ENDPOINT', 'posts': 'POSTS_ENDPOINT'}
+    if service not in endpoints:
+        return f'No stream of {service}.', 404
+    subscription = get_stream_relay(
+        app.config[endpoints[service]] + 'stream').subscribe()
+    if subscription is None:
+        response = make_response('Too many clients are streaming.', 503)
+        response.retry_after = STREAM_RETRY_MILLISECONDS // 1000
+        return response
+    response = app.response_class(
+        sse_messages(subscription), mimetype='text/event-stream')
+    response.call_on_close(subscription.close)
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'  # don't buffer in proxies
+    return response
+
+
+def get_stream_relay(url):
+    """Returns the StreamRelay of the stream at url, creating it if needed."""
+    with STREAM_RELAYS_LOCK:
+        if url not in STREAM_RELAYS:
+            STREAM_RELAYS[url] = StreamRelay(
+                url, MAX_STREAM_CLIENTS, read_timeout=STREAM_READ_TIMEOUT,
+                retry_seconds=STREAM_RETRY_MILLISECONDS / 1000)
+        return STREAM_RELAYS[url]
+
+
+def sse_messages(subscription, max_seconds=None):
+    """Yields the messages relayed to the subscription, with keepalives.
+
+    Stops after max_seconds, defaulting to STREAM_MAX_SECONDS, or once the
+    subscription is lost.
+    """
+    if max_seconds is None:
+        max_seconds = STREAM_MAX_SECONDS
+    deadline = time.monotonic() + max_seconds
+    yield f'retry: {STREAM_RETRY_MILLISECONDS}\n\n'.encode()
+    while not subscription.lost:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        message = subscription.get(min(STREAM_KEEPALIVE_SECONDS, remaining))
+        if message is None:
+            yield b': keepalive\n\n'
+        elif not subscription.lost:
+            yield message
+
+
 @app.route('/v1/get_posts/<event_id>', methods=['GET'])
 def get_posts_for_event(event_id):
-    """Retrieves all posts for a certain event and displays in web template."""
-    response = requests.get(app.config['POSTS_ENDPOINT'] +
-                            f'by_event/{event_id}')
-    if response.status_code == 200:
-        return render_template(
-            'index.html',
-            posts=parse_posts(response.json()),
-            auth=is_organizer(get_user()),
-            events=get_events(),
-            sub_event=event_id,
-            app_config=app.config
-        )
-    else:
+    """Retrieves a page of posts for a certain event and displays in web template.
+
+    Takes the same `before` query parameter as index().
+    """
+    try:
+        posts, next_cursor = get_posts(
+            event_id, before=request.args.get('before'))
+    except RuntimeError:
         return 'Unable to retrieve events', 500
+    return render_template(
+        'index.html',
+        posts=posts,
+        next_cursor=next_cursor,
+        post_events=get_events_of_posts(posts),
+        post_authors=get_authors_of_posts(posts),
+        auth=is_organizer(get_user()),
+        events=get_events(fields=['name']),
+        sub_event=event_id,
+        app_config=app.config
+    )
 
 
 @app.route('/v1/delete_post/<post_id>', methods=['DELETE'])
@@ -188,6 +323,21 @@ def authenticate_with_users_service(gauth_token):
         data={'gauth_token': gauth_token})
 
 
+def authorize_with_users_service(gauth_token):
+    """Proxy the user service to authenticate and authorize a user.
+
+    Args:
+        gauth_token(str): Google ID token to authenticate.
+
+    Response:
+        response: response from the users service, with the user object
+            and its 'is_organizer' authorization
+    """
+    return requests.post(
+        app.config['USERS_ENDPOINT'] + 'authenticate_and_authorize',
+        data={'gauth_token': gauth_token})
+
+
 @app.route('/v1/add_post', methods=['POST'])
 def add_post():
     """Add post by calling posts service.
@@ -254,12 +404,27 @@ def add_event():
         return f'Error: {error}', 400
 
 
-def get_posts():
-    """Gets all posts from posts service."""
+def get_posts(event_id=None, before=None):
+    """Gets a page of posts, or of posts for one event, from posts service.
+
+    Args:
+        event_id (str): ID of the event to get posts for, or None for all.
+        before (str): Cursor of the page to get, or None for the newest.
+
+    Returns:
+        tuple: (posts, next_cursor) where posts is the parsed list of posts,
+            newest first, and next_cursor is the cursor of the following
+            page or None if there are no older posts.
+    """
     url = app.config['POSTS_ENDPOINT']
-    response = requests.get(url, params={})
-    if response.status_code == 200:
-        return parse_posts(response.json())
+    if event_id is not None:
+        url += f'by_event/{event_id}'
+    params = {'limit': POSTS_PAGE_SIZE}
+    if before is not None:
+        params['before'] = before
+    response_json = get_with_revalidation(url, params=params)
+    if response_json is not None:
+        return parse_posts(response_json), response_json.get('next_cursor')
     raise RuntimeError('Error in retrieving posts.')
 
 
@@ -274,20 +439,107 @@ def parse_posts(posts_dict):
     Returns:
         list: parsed list of posts.
     """
-    # TODO(cmei4444): implement parsing on posts - timestamps are formatted
-    # unreadably currently
-    return posts_dict['posts']
+    return format_times(posts_dict['posts'])
+
 
+def get_events(fields=None):
+    """Gets all sub-events from events service.
 
-def get_events():
-    """Gets all sub-events from events service."""
+    Args:
+        fields (list): Attributes of the events to get, besides the _id.
+            Gets all attributes if None.
+    """
     url = app.config['EVENTS_ENDPOINT']
-    response = requests.get(url, params={})
-    if response.status_code == 200:
-        return parse_events(response.json())
+    params = {} if fields is None else {'fields': ','.join(fields)}
+    response_json = get_with_revalidation(url, params=params)
+    if response_json is not None:
+        return parse_events(response_json)
     raise RuntimeError('Error in retrieving events.')
 
 
+def get_events_of_posts(posts):
+    """Gets the events the given posts were made in, in one request.
+
+    Fails soft: if the events can't be retrieved, posts are shown with only
+    the IDs of their events.
+
+    Returns:
+        dict: Events by ID, for the events that could be retrieved.
+    """
+    # the events service rejects the whole batch if any ID is malformatted
+    event_ids = sorted({post['event_id'] for post in posts
+                        if isinstance(post.get('event_id'), str)
+                        and re.fullmatch('[0-9a-f]{24}', post['event_id'])})
+    if not event_ids:
+        return {}
+    url = app.config['EVENTS_ENDPOINT'] + 'batch'
+    try:
+        response_json = get_with_revalidation(
+            url, params={'ids': ','.join(event_ids), 'fields': 'name'})
+    except requests.exceptions.RequestException:
+        return {}
+    if response_json is None:
+        return {}
+    return {event['_id']['$oid']: event
+            for event in parse_events(response_json)}
+
+
+def get_authors_of_posts(posts):
+    """Gets the names and roles of the authors of posts, in one request.
+
+    Fails soft: if the authors can't be retrieved, posts are shown with only
+    the IDs of their authors.
+
+    Returns:
+        dict: Users by ID, with their 'name' and 'is_organizer', for the
+            authors that could be retrieved.
+    """
+    author_ids = sorted({post['author_id'] for post in posts
+                         if isinstance(post.get('author_id'), str)})
+    if not author_ids:
+        return {}
+    try:
+        response = requests.post(
+            app.config['USERS_ENDPOINT'] + 'users/batch',
+            data={'user_ids': author_ids})
+    except requests.exceptions.RequestException:
+        return {}
+    if response.status_code != 200:
+        return {}
+    return {user['user_id']: user for user in response.json()['users']}
+
+
+def get_with_revalidation(url, params):
+    """GETs JSON from another service, revalidating any copy fetched before.
+
+    Responses with an ETag are kept in REVALIDATION_CACHE. Later requests for
+    the same url and params send the ETag in If-None-Match, and if the
+    service answers 304 Not Modified the kept copy is returned instead of
+    downloading it again.
+
+    Returns:
+        The decoded JSON body, or None if the service did not return 200.
+    """
+    key = (url, tuple(sorted(params.items())))
+    with REVALIDATION_CACHE_LOCK:
+        cached = REVALIDATION_CACHE.get(key)
+    headers = {'If-None-Match': cached[0]} if cached else {}
+    response = requests.get(url, params=params, headers=headers)
+    if response.status_code == 304 and cached:
+        return cached[1]
+    if response.status_code != 200:
+        return None
+    response_json = response.json()
+    etag = response.headers.get('ETag')
+    if etag:
+        with REVALIDATION_CACHE_LOCK:
+            REVALIDATION_CACHE[key] = (etag, response_json)
+            REVALIDATION_CACHE.move_to_end(key)
+            if len(REVALIDATION_CACHE) > REVALIDATION_CACHE_SIZE:
+                REVALIDATION_CACHE.popitem(last=False)
+    return response_json
+
+
 def parse_events(events_dict):
     """Parses response from events service to be used in HTML templates.
 
@@ -299,26 +551,54 @@ def parse_events(events_dict):
     Returns:
         list: parsed list of events.
     """
-    # TODO(cmei4444): implement parsing on events - timestamps are formatted
-    # unreadably currently
-    return events_dict['events']
+    return format_times(events_dict['events'])
+
+
+def format_times(value):
+    """Replaces extended JSON times in a response with readable strings.
+
+    The events and posts services send times as {'$date': <ISO 8601>}. These
+    are formatted with DISPLAY_TIME_FORMAT wherever they are nested in value,
+    and everything else is kept as it is. Returns a new structure rather than
+    changing value, which may be shared through REVALIDATION_CACHE.
+    """
+    if isinstance(value, list):
+        return [format_times(item) for item in value]
+    if isinstance(value, dict):
+        if value.keys() == {'$date'}:
+            return format_time(value['$date'])
+        return {key: format_times(item) for key, item in value.items()}
+    return value
+
+
+def format_time(time_string):
+    """Formats an ISO 8601 UTC time for display, or returns it unchanged."""
+    for time_format in UTC_TIME_FORMATS:
+        try:
+            time = datetime.datetime.strptime(
+                time_string.replace('+00:00', 'Z'), time_format)
+        except (AttributeError, ValueError):
+            continue
+        return time.strftime(DISPLAY_TIME_FORMAT)
+    return time_string
 
 
 def is_organizer(user):
-    """Determines if the user with the given info is an event organizer."""
+    """Determines if the user from get_user() is an event organizer."""
     if user is None:
         return False
-    url = app.config['USERS_ENDPOINT'] + 'authorization'
-    response = requests.post(url, data={'user_id': user['user_id']})
-    return response.json()['is_organizer'] is True
+    return user.get('is_organizer') is True
 
 
 def get_user():
-    """Retrieves the current user of the app or None if not signed in."""
+    """Retrieves the current user of the app or None if not signed in.
+
+    The user comes with its 'is_organizer' authorization, from a single
+    request to the users service.
+    """
     try:
         if 'gauth_token' in session:
-            response = authenticate_with_users_service(
-                session['gauth_token'])
+            response = authorize_with_users_service(session['gauth_token'])
             if response.status_code == 201:
                 return response.json()
         return None  # Not signed in
@@ -0,0 +1,166 @@
+"""Shares one upstream Server-Sent Events stream among many clients."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import queue
+import threading
+import time
+import requests
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class Subscription():
+    """Queue of messages for one client of a relay.
+
+    If the client falls more than `max_queued` messages behind, or the
+    upstream stream fails, it is marked `lost` and gets no more messages, as
+    it has missed some. It should then reconnect.
+    """
+
+    def __init__(self, relay, max_queued):
+        self._relay = relay
+        self._queue = queue.Queue(maxsize=max_queued)
+        self.lost = False
+
+    def put(self, message):
+        """Queues a message, marking the subscription lost if it's full."""
+        if self.lost:
+            return
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.lost = True
+
+    def get(self, timeout):
+        """Returns the next message, or None if none comes within timeout."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """Unsubscribes from the relay."""
+        self._relay.unsubscribe(self)
+
+
+class StreamRelay():
+    """Fans out the messages of one upstream SSE stream to every subscriber.
+
+    A background thread opens the upstream stream when the first client
+    subscribes and closes it once the last one has left, so an instance
+    holds one connection to the service however many pages are open.
+    Keepalives and `retry` fields from upstream are not relayed, as the
+    clients are sent their own.
+
+    Attributes:
+        url: URL of the upstream stream.
+        max_subscribers: Most clients subscribed at once.
+        max_queued: Most messages queued for a client before it is lost.
+        read_timeout: Seconds to wait for data from upstream, which sends
+            keepalives more often.
+        retry_seconds: Seconds to wait before reopening a failed stream.
+    """
+
+    def __init__(self, url, max_subscribers, max_queued=100, read_timeout=60,
+                 retry_seconds=3):
+        self.url = url
+        self.max_subscribers = max_subscribers
+        self.max_queued = max_queued
+        self.read_timeout = read_timeout
+        self.retry_seconds = retry_seconds
+        self._subscribers = set()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """Returns a new Subscription, or None if there are too many."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self, self.max_queued)
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._relay, name='stream-relay', daemon=True)
+                self._thread.start()
+            return subscription
+
+    def unsubscribe(self, subscription):
+        """Stops sending messages to the subscription."""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, message):
+        """Sends a message to every subscriber."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def _drop_subscribers(self):
+        """Marks every subscriber lost, as they are missing messages."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.lost = True
+
+    def _has_subscribers(self):
+        """Determines if the thread should go on, and if not lets it end."""
+        with self._lock:
+            if not self._subscribers:
+                self._thread = None
+                return False
+            return True
+
+    def _relay(self):
+        """Publishes messages from upstream until there are no subscribers."""
+        while self._has_subscribers():
+            opened_at = time.monotonic()
+            try:
+                with requests.get(self.url, stream=True,
+                                  timeout=(5, self.read_timeout)) as response:
+                    response.raise_for_status()
+                    for message in iter_messages(response):
+                        if message.startswith(b'event: '):
+                            self.publish(message)
+                        if not self._has_subscribers():
+                            return
+                # the service closes streams after a while, reopen it at once
+                # unless it was closed right away
+                if time.monotonic() - opened_at >= self.retry_seconds:
+                    continue
+            except requests.exceptions.RequestException as error:
+                logger.warning('Stream at %s failed: %s', self.url, error)
+            self._drop_subscribers()
+            time.sleep(self.retry_seconds)
+
+
+def iter_messages(response):
+    """Yields the messages of an SSE response, each ending in a blank line.
+
+    Lines must end in a line feed, as those of the events and posts services
+    do.
+    """
+    buffer = b''
+    for chunk in response.iter_content(chunk_size=None):
+        buffer += chunk
+        *messages, buffer = buffer.split(b'\n\n')
+        for message in messages:
+            yield message + b'\n\n'
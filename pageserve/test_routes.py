@@ -206,7 +206,9 @@ class TestMainTemplateRoutes(TestCase):
 
     @patch('app.get_user', MagicMock(return_value=AUTHORIZED_USER_OBJECT))
     @patch('app.is_organizer', MagicMock(return_value=True))
-    @patch('app.get_posts', MagicMock(return_value=EXAMPLE_POSTS))
+    @patch('app.get_posts', MagicMock(return_value=(EXAMPLE_POSTS, 'next')))
+    @patch('app.get_events', MagicMock(return_value=EXAMPLE_EVENTS))
+    @patch('app.get_events_of_posts', MagicMock(return_value={}))
     def test_index(self):
         """Checks index page is rendered correctly by GET /v1/."""
         response = self.client.get('/v1/')
@@ -215,8 +217,49 @@ class TestMainTemplateRoutes(TestCase):
 
         self.assertContext('auth', True)
         self.assertContext('posts', EXAMPLE_POSTS)
+        self.assertContext('next_cursor', 'next')
+        self.assertContext('events', EXAMPLE_EVENTS)
         self.assertContext('app_config', app.app.config)
 
+    @patch('app.get_user', MagicMock(return_value=AUTHORIZED_USER_OBJECT))
+    @patch('app.is_organizer', MagicMock(return_value=True))
+    @patch('app.get_events', MagicMock(return_value=EXAMPLE_EVENTS))
+    @patch('app.get_events_of_posts', MagicMock(return_value={}))
+    def test_index_image_variants(self):
+        """Checks resized variants of images are shown when available."""
+        post = dict(EXAMPLE_POSTS[0],
+                    files=['original.jpg', 'other.gif'],
+                    variants=[{'thumbnail': 'thumbnail.webp',
+                               'display': 'display.webp'}, None])
+        with patch('app.get_posts', MagicMock(return_value=([post], None))):
+            response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, 200)
+        page = response.data.decode()
+        self.assertIn('<a href="original.jpg"><img src="display.webp" '
+                      'srcset="thumbnail.webp 320w, display.webp 1280w"', page)
+        self.assertIn('<img src="other.gif"', page)
+
+    @patch('app.get_user', MagicMock(return_value=AUTHORIZED_USER_OBJECT))
+    @patch('app.is_organizer', MagicMock(return_value=True))
+    @patch('app.get_events', MagicMock(return_value=EXAMPLE_EVENTS))
+    @patch('app.get_events_of_posts', MagicMock(return_value={}))
+    def test_index_author_names(self):
+        """Checks posts show the names of their authors when found."""
+        posts = [dict(EXAMPLE_POSTS[0], author_id='organizer_id'),
+                 dict(EXAMPLE_POSTS[1], author_id='unknown_id')]
+        authors = {'organizer_id': {'user_id': 'organizer_id',
+                                    'name': 'Jane Doe',
+                                    'is_organizer': True}}
+        with patch('app.get_posts', MagicMock(return_value=(posts, None))), \
+                patch('app.get_authors_of_posts',
+                      MagicMock(return_value=authors)):
+            response = self.client.get('/v1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContext('post_authors', authors)
+        page = response.data.decode()
+        self.assertIn('Posted by Jane Doe (organizer) at', page)
+        self.assertIn('Posted by unknown_id at', page)
+
     @patch('app.get_user', MagicMock(return_value=AUTHORIZED_USER_OBJECT))
     @patch('app.is_organizer', MagicMock(return_value=True))
     @patch('app.get_posts', MagicMock(side_effect=RuntimeError))
@@ -279,7 +322,31 @@ class TestSearchEventsRoute(TestCase):
 
         self.assertContext('auth', True)
         self.assertContext('events', EXAMPLE_EVENTS)
+        self.assertContext('next_offset', None)
         self.assertContext('app_config', app.app.config)
+        self.assertEqual(mock_requests.last_request.qs, {
+            'name': ['valid_event'], 'limit': [str(app.SEARCH_PAGE_SIZE)],
+            'offset': ['0']})
+
+    @patch('app.is_organizer', MagicMock(return_value=True))
+    @requests_mock.Mocker()
+    def test_search_more_results(self, mock_requests):
+        """Test pages of search results link to the next one."""
+        mock_requests.get(self.expected_url,
+                          json={'events': EXAMPLE_EVENTS,
+                                'num_events': len(EXAMPLE_EVENTS),
+                                'next_offset': 40},
+                          status_code=200)
+        query = {'event_name': 'valid_event', 'offset': '20'}
+        response = self.client.post('/v1/search_event', data=query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_requests.last_request.qs['offset'], ['20'])
+        self.assertContext('next_offset', 40)
+        self.assertIn(b'name="offset" value="40"', response.data)
+
+        query = {'event_name': 'valid_event', 'offset': 'next'}
+        response = self.client.post('/v1/search_event', data=query)
+        self.assertEqual(response.status_code, 400)
 
     @patch('app.is_organizer', MagicMock(return_value=True))
     @requests_mock.Mocker()
@@ -336,7 +403,7 @@ class TestQueryEventsByIDRoute(TestCase):
     @requests_mock.Mocker()
     def test_query_existing_event(self, mock_requests):
         """Test querying for existing event."""
-        mock_requests.put(self.expected_url + EXAMPLE_EVENT_ID,
+        mock_requests.get(self.expected_url + EXAMPLE_EVENT_ID,
                           json={'events': EXAMPLE_EVENTS[0], 'num_events': 1},
                           status_code=200)
         query = {'event_id': EXAMPLE_EVENT_ID}
@@ -353,7 +420,7 @@ class TestQueryEventsByIDRoute(TestCase):
     def test_query_no_event_found(self, mock_requests):
         """Test querying for nonexisting event."""
         nonexistent_id = 'nonexistent1234567890123'
-        mock_requests.put(self.expected_url + nonexistent_id,
+        mock_requests.get(self.expected_url + nonexistent_id,
                           json={'events': [], 'num_events': 0},
                           status_code=200)
         query = {'event_id': nonexistent_id}
@@ -368,7 +435,7 @@ class TestQueryEventsByIDRoute(TestCase):
     @requests_mock.Mocker()
     def test_query_events_error(self, mock_requests):
         """Test events service error when querying for events."""
-        mock_requests.put(self.expected_url + EXAMPLE_EVENT_ID,
+        mock_requests.get(self.expected_url + EXAMPLE_EVENT_ID,
                           text='Error in getting events',
                           status_code=500)
         query = {'event_id': EXAMPLE_EVENT_ID}
@@ -409,12 +476,17 @@ class TestGetPostsForEventRoute(TestCase):
                           json={'posts': EXAMPLE_POSTS,
                                 'num_posts': len(EXAMPLE_POSTS)},
                           status_code=200)
+        event = dict(EXAMPLE_EVENTS[0], _id={'$oid': EXAMPLE_EVENT_ID})
+        mock_requests.get(app.app.config['EVENTS_ENDPOINT'] + 'batch',
+                          json={'events': [event], 'num_events': 1},
+                          status_code=200)
         response = self.client.get(f'/v1/get_posts/{EXAMPLE_EVENT_ID}')
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed('index.html')
 
         self.assertContext('auth', True)
         self.assertContext('posts', EXAMPLE_POSTS)
+        self.assertContext('post_events', {EXAMPLE_EVENT_ID: event})
         self.assertContext('app_config', app.app.config)
 
     def test_get_nonexistent_posts(self, mock_requests):
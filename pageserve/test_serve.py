@@ -22,9 +22,6 @@ import requests_mock
 import flask
 import app
 
-AUTHORIZED_RESPONSE_JSON = {'is_organizer': True}
-UNAUTHORIZED_RESPONSE_JSON = {'is_organizer': False}
-
 VALID_SESSION = {
     'user_id': 'abc123 pretend I am a user ID.',
     'name': 'Boaty McBoatface',
@@ -42,14 +39,14 @@ class TestServe(unittest.TestCase):
         """Checks if users service returns a correctly formatted object.
 
         Expects a user dictionary with a boolean 'is_organizer' field.
-        This test mocks app.authenticate_with_users_service() to always
+        This test mocks app.authorize_with_users_service() to always
         return the response of an authenticated user that is authorized.
         """
         with app.app.test_request_context(), app.app.test_client():
             mock_response = mock.MagicMock()
             mock_response.status_code = 201
             mock_response.json.return_value = {'is_organizer': True}
-            with mock.patch('app.authenticate_with_users_service',
+            with mock.patch('app.authorize_with_users_service',
                             return_value=mock_response):
                 flask.session['user_id'] = VALID_SESSION['user_id']
                 flask.session['name'] = VALID_SESSION['name']
@@ -72,23 +69,23 @@ class TestServe(unittest.TestCase):
             flask.session["gauth_token"] = VALID_SESSION["gauth_token"]
             self.assertIsNone(app.get_user())
 
-    @requests_mock.Mocker()
-    def test_is_organizer(self, requests_mocker):
-        """Tests if authorization is correctly retrieved from users service.
+    def test_is_organizer(self):
+        """Tests if authorization is read from the user object.
 
-        This test mocks away requests to the users service which is normally
-        called by app.is_organizer.
+        get_user() gets the authorization along with the user, so no request
+        is made to the users service.
         """
-        # is authorized
-        requests_mocker.post(app.app.config['USERS_ENDPOINT'] + 'authorization',
-                             json=AUTHORIZED_RESPONSE_JSON)
-        self.assertTrue(app.is_organizer(
-            {'user_id': 'Pretend I am authorized.'}))
-        # not authorized
-        requests_mocker.post(app.app.config['USERS_ENDPOINT'] + 'authorization',
-                             json=UNAUTHORIZED_RESPONSE_JSON)
-        self.assertFalse(app.is_organizer(
-            {'user_id': 'Pretend I am NOT authorized.'}))
+        with mock.patch('app.requests.post') as post:
+            # is authorized
+            self.assertTrue(app.is_organizer(
+                {'user_id': 'Pretend I am authorized.', 'is_organizer': True}))
+            # not authorized
+            self.assertFalse(app.is_organizer(
+                {'user_id': 'Pretend I am NOT authorized.',
+                 'is_organizer': False}))
+            self.assertFalse(app.is_organizer(
+                {'user_id': 'Pretend my authorization is unknown.'}))
+            post.assert_not_called()
         # No user sent give no authorization. This might happens when a user
         # is logged out so app.get_user() returns None.
         self.assertFalse(app.is_organizer(None))
@@ -114,15 +111,28 @@ class TestGetPosts(unittest.TestCase):
 
     def setUp(self):
         self.url = app.app.config['POSTS_ENDPOINT']
-        self.posts_dict = {'posts': ['these', 'are', 'fake', 'posts']}
+        self.posts_dict = {'posts': ['these', 'are', 'fake', 'posts'],
+                           'next_cursor': 'cursor'}
 
     @requests_mock.Mocker()
     def test_get_posts_success(self, mock_requests):
         """Test that posts are retrieved successfully."""
         mock_requests.get(
             self.url, text=json.dumps(self.posts_dict), status_code=200)
-        posts = app.get_posts()
+        posts, next_cursor = app.get_posts()
         self.assertTrue(posts, self.posts_dict)
+        self.assertEqual(next_cursor, 'cursor')
+        self.assertEqual(mock_requests.last_request.qs,
+                         {'limit': [str(app.POSTS_PAGE_SIZE)]})
+
+    @requests_mock.Mocker()
+    def test_get_older_posts(self, mock_requests):
+        """Test that the page before a cursor is requested."""
+        mock_requests.get(
+            self.url, text=json.dumps(self.posts_dict), status_code=200)
+        app.get_posts(before='2019-06-11T09:00:00+00:00_abc')
+        self.assertEqual(mock_requests.last_request.qs['before'],
+                         ['2019-06-11t09:00:00+00:00_abc'])
 
     @requests_mock.Mocker()
     def test_get_posts_fail(self, mock_requests):
@@ -147,6 +157,15 @@ class TestGetEvents(unittest.TestCase):
         posts = app.get_events()
         self.assertTrue(posts, self.events_dict)
 
+    @requests_mock.Mocker()
+    def test_get_events_fields(self, mock_requests):
+        """Test that only the requested fields are asked for."""
+        mock_requests.get(
+            self.url, text=json.dumps(self.events_dict), status_code=200)
+        app.get_events(fields=['name', 'event_time'])
+        self.assertEqual(mock_requests.last_request.qs,
+                         {'fields': ['name,event_time']})
+
     @requests_mock.Mocker()
     def test_get_events_fail(self, mock_requests):
         """Test error is raised when events cannot be retrieved."""
@@ -155,5 +174,234 @@ class TestGetEvents(unittest.TestCase):
             app.get_events()
 
 
+class TestGetEventsOfPosts(unittest.TestCase):
+    """Test app.get_events_of_posts with mock calls to events service."""
+
+    def setUp(self):
+        self.url = app.app.config['EVENTS_ENDPOINT'] + 'batch'
+        self.event_ids = ['5d0a7d5d8b1a2b3c4d5e6f70', '5d0a7d5d8b1a2b3c4d5e6f71']
+        self.posts = [{'event_id': self.event_ids[1]},
+                      {'event_id': self.event_ids[0]},
+                      {'event_id': self.event_ids[1]},
+                      {'event_id': 'not an event ID'}]
+        app.REVALIDATION_CACHE.clear()
+
+    @requests_mock.Mocker()
+    def test_get_events_of_posts(self, mock_requests):
+        """Events of all posts are retrieved in one request."""
+        events = [{'_id': {'$oid': event_id}, 'name': f'event {i}'}
+                  for i, event_id in enumerate(self.event_ids)]
+        mock_requests.get(self.url, json={'events': events, 'num_events': 2})
+        post_events = app.get_events_of_posts(self.posts)
+        self.assertEqual(mock_requests.call_count, 1)
+        self.assertEqual(mock_requests.last_request.qs,
+                         {'ids': [','.join(self.event_ids)],
+                          'fields': ['name']})
+        self.assertEqual(post_events[self.event_ids[1]]['name'], 'event 1')
+
+    @requests_mock.Mocker()
+    def test_get_events_of_posts_fail(self, mock_requests):
+        """No events are returned if they can't be retrieved."""
+        mock_requests.get(self.url, text='Error message.', status_code=500)
+        self.assertEqual(app.get_events_of_posts(self.posts), {})
+        mock_requests.get(self.url,
+                          exc=requests.exceptions.ConnectionError)
+        self.assertEqual(app.get_events_of_posts(self.posts), {})
+        self.assertEqual(app.get_events_of_posts([]), {})
+
+
+class TestGetAuthorsOfPosts(unittest.TestCase):
+    """Test app.get_authors_of_posts with mock calls to users service."""
+
+    def setUp(self):
+        self.url = app.app.config['USERS_ENDPOINT'] + 'users/batch'
+        self.posts = [{'author_id': 'b'}, {'author_id': 'a'},
+                      {'author_id': 'b'}, {}]
+
+    @requests_mock.Mocker()
+    def test_get_authors_of_posts(self, mock_requests):
+        """Authors of all posts are retrieved in one request."""
+        users = [{'user_id': 'a', 'name': 'Ann', 'is_organizer': False},
+                 {'user_id': 'b', 'name': 'Bob', 'is_organizer': True}]
+        mock_requests.post(self.url, json={'users': users})
+        post_authors = app.get_authors_of_posts(self.posts)
+        self.assertEqual(mock_requests.call_count, 1)
+        self.assertEqual(mock_requests.last_request.text,
+                         'user_ids=a&user_ids=b')
+        self.assertEqual(post_authors, {'a': users[0], 'b': users[1]})
+
+    @requests_mock.Mocker()
+    def test_get_authors_of_posts_fail(self, mock_requests):
+        """No authors are returned if they can't be retrieved."""
+        mock_requests.post(self.url, text='Error message.', status_code=500)
+        self.assertEqual(app.get_authors_of_posts(self.posts), {})
+        mock_requests.post(self.url,
+                           exc=requests.exceptions.ConnectionError)
+        self.assertEqual(app.get_authors_of_posts(self.posts), {})
+        self.assertEqual(app.get_authors_of_posts([]), {})
+        self.assertEqual(mock_requests.call_count, 2)
+
+
+class TestSuggestEvents(unittest.TestCase):
+    """Test app.suggest_events relaying to the events service."""
+
+    def setUp(self):
+        self.url = app.app.config['EVENTS_ENDPOINT'] + 'suggest'
+        self.client = app.app.test_client()
+
+    @requests_mock.Mocker()
+    def test_suggest_events(self, mock_requests):
+        """Suggestions are relayed along with the query."""
+        suggestions = {'suggestions': [{'event_id': '0', 'name': 'Summit'}],
+                       'num_suggestions': 1}
+        mock_requests.get(self.url, json=suggestions)
+        response = self.client.get('/v1/suggest_events?q=sum')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), suggestions)
+        self.assertEqual(mock_requests.last_request.qs, {'q': ['sum']})
+
+    @requests_mock.Mocker()
+    def test_suggest_events_fail(self, mock_requests):
+        """Errors from the events service are passed on."""
+        mock_requests.get(self.url, text='Error message.', status_code=400)
+        response = self.client.get('/v1/suggest_events')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestRelayStream(unittest.TestCase):
+    """Test app.relay_stream relaying streams of changes."""
+
+    def setUp(self):
+        self.client = app.app.test_client()
+        # relays are made anew with these, and their threads never started
+        for patcher in [mock.patch.dict(app.STREAM_RELAYS, clear=True),
+                        mock.patch('app.MAX_STREAM_CLIENTS', 1),
+                        mock.patch('app.STREAM_MAX_SECONDS', 0.2),
+                        mock.patch('streamrelay.threading.Thread')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_relay_stream(self):
+        """Changes from the stream of each service are relayed."""
+        for service, endpoint in [('events', 'EVENTS_ENDPOINT'),
+                                  ('posts', 'POSTS_ENDPOINT')]:
+            message = f'event: insert\ndata: {{"{service}": 1}}\n\n'
+            response = self.client.get(f'/v1/stream/{service}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            app.get_stream_relay(
+                app.app.config[endpoint] + 'stream').publish(message.encode())
+            data = response.get_data(as_text=True)
+            response.close()
+            self.assertTrue(data.startswith('retry: '))
+            self.assertIn(message, data)
+
+    def test_unknown_service(self):
+        """Only events and posts can be streamed."""
+        response = self.client.get('/v1/stream/users')
+        self.assertEqual(response.status_code, 404)
+
+    def test_lost_stream(self):
+        """The stream ends once the service's stream is lost."""
+        response = self.client.get('/v1/stream/posts')
+        relay = app.get_stream_relay(app.app.config['POSTS_ENDPOINT']
+                                     + 'stream')
+        relay._drop_subscribers()  # pylint: disable=protected-access
+        self.assertEqual(response.get_data(as_text=True), 'retry: 3000\n\n')
+        response.close()
+        self.assertEqual(len(relay), 0)
+
+    def test_too_many_clients(self):
+        """Clients past MAX_STREAM_CLIENTS are turned away."""
+        first = self.client.get('/v1/stream/posts')
+        response = self.client.get('/v1/stream/posts')
+        self.assertEqual(response.status_code, 503)
+        first.close()
+        response = self.client.get('/v1/stream/posts')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+
+class TestFormatTimes(unittest.TestCase):
+    """Test app.format_times on responses from other services."""
+
+    def test_format_times(self):
+        """Nested times are formatted and other values left alone."""
+        events = [{'name': 'launch',
+                   'event_time': {'$date': '2019-06-11T10:33:00Z'},
+                   'created_at': {'$date': '2019-06-10T08:00:01.250Z'},
+                   '_id': {'$oid': '5d0a7d5d8b1a2b3c4d5e6f70'}},
+                  'not an event']
+        formatted = app.format_times(events)
+        self.assertEqual(formatted[0]['event_time'], '2019-06-11 10:33')
+        self.assertEqual(formatted[0]['created_at'], '2019-06-10 08:00')
+        self.assertEqual(formatted[0]['_id'], events[0]['_id'])
+        self.assertEqual(formatted[1], 'not an event')
+        # the response itself isn't changed
+        self.assertEqual(events[0]['event_time'],
+                         {'$date': '2019-06-11T10:33:00Z'})
+
+    def test_unparseable_time(self):
+        """Times that can't be parsed are shown as sent."""
+        self.assertEqual(app.format_times({'$date': 1560249180000}),
+                         1560249180000)
+        self.assertEqual(app.format_times({'$date': 'soon'}), 'soon')
+
+
+class TestGetWithRevalidation(unittest.TestCase):
+    """Test app.get_with_revalidation with mock calls to other services."""
+
+    def setUp(self):
+        self.url = app.app.config['EVENTS_ENDPOINT']
+        self.events_dict = {'events': ['these', 'are', 'fake', 'events']}
+        app.REVALIDATION_CACHE.clear()
+
+    @requests_mock.Mocker()
+    def test_not_modified(self, mock_requests):
+        """Test a kept copy is revalidated and reused on 304."""
+        mock_requests.get(self.url, json=self.events_dict,
+                          headers={'ETag': '"v1"'}, status_code=200)
+        self.assertEqual(app.get_with_revalidation(self.url, {}),
+                         self.events_dict)
+        mock_requests.get(self.url, status_code=304)
+        self.assertEqual(app.get_with_revalidation(self.url, {}),
+                         self.events_dict)
+        self.assertEqual(
+            mock_requests.last_request.headers['If-None-Match'], '"v1"')
+
+    @requests_mock.Mocker()
+    def test_modified(self, mock_requests):
+        """Test a changed response replaces the kept copy."""
+        mock_requests.get(self.url, json=self.events_dict,
+                          headers={'ETag': '"v1"'}, status_code=200)
+        app.get_with_revalidation(self.url, {})
+        new_events_dict = {'events': ['new']}
+        mock_requests.get(self.url, json=new_events_dict,
+                          headers={'ETag': '"v2"'}, status_code=200)
+        self.assertEqual(app.get_with_revalidation(self.url, {}),
+                         new_events_dict)
+        self.assertEqual(app.REVALIDATION_CACHE[(self.url, ())][0], '"v2"')
+
+    @requests_mock.Mocker()
+    def test_no_etag(self, mock_requests):
+        """Test responses without an ETag are not kept."""
+        mock_requests.get(self.url, json=self.events_dict, status_code=200)
+        app.get_with_revalidation(self.url, {})
+        self.assertNotIn('If-None-Match', mock_requests.last_request.headers)
+        self.assertEqual(len(app.REVALIDATION_CACHE), 0)
+
+    @requests_mock.Mocker()
+    def test_cache_size_bounded(self, mock_requests):
+        """Test the least recently kept copies are evicted."""
+        mock_requests.get(self.url, json=self.events_dict,
+                          headers={'ETag': '"v1"'}, status_code=200)
+        with mock.patch('app.REVALIDATION_CACHE_SIZE', 2):
+            for page in range(3):
+                app.get_with_revalidation(self.url, {'page': page})
+        self.assertEqual(list(app.REVALIDATION_CACHE),
+                         [(self.url, (('page', 1),)),
+                          (self.url, (('page', 2),))])
+
+
 if __name__ == '__main__':
     unittest.main()
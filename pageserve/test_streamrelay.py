@@ -0,0 +1,121 @@
+"""Unit tests for relaying a stream of changes to many clients."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest import mock
+import requests_mock
+import streamrelay
+
+URL = 'http://events/v1/stream'
+BODY = (b'retry: 3000\n\n'
+        b'event: insert\ndata: {"_id": 1}\n\n'
+        b': keepalive\n\n'
+        b'event: delete\ndata: {"_id": 2}\n\n')
+
+
+class StopRelay(Exception):
+    """Raised to stop StreamRelay._relay() from retrying in tests."""
+
+
+class TestStreamRelay(unittest.TestCase):
+    """Test subscribing to and relaying a StreamRelay."""
+
+    def setUp(self):
+        self.relay = streamrelay.StreamRelay(URL, max_subscribers=2,
+                                             max_queued=2)
+        # _relay() is run by the tests instead
+        patcher = mock.patch('streamrelay.threading.Thread')
+        self.thread = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_publish(self):
+        """Messages are sent to every subscriber."""
+        first, second = self.relay.subscribe(), self.relay.subscribe()
+        self.relay.publish(b'event: insert\n\n')
+        self.assertEqual(first.get(0), b'event: insert\n\n')
+        self.assertEqual(second.get(0), b'event: insert\n\n')
+        self.assertIsNone(first.get(0))
+        self.thread.assert_called_once()  # one upstream for all subscribers
+
+    def test_max_subscribers(self):
+        """Subscribers past max_subscribers are refused until one leaves."""
+        first = self.relay.subscribe()
+        self.relay.subscribe()
+        self.assertIsNone(self.relay.subscribe())
+        first.close()
+        self.assertEqual(len(self.relay), 1)
+        self.assertIsNotNone(self.relay.subscribe())
+
+    def test_lost_subscription(self):
+        """Subscribers that fall too far behind are marked lost."""
+        subscription = self.relay.subscribe()
+        for _ in range(3):
+            self.relay.publish(b'event: delete\n\n')
+        self.assertTrue(subscription.lost)
+
+    @requests_mock.Mocker()
+    def test_relay(self, mock_requests):
+        """Only events are relayed, and a stream closed at once loses them."""
+        mock_requests.get(URL, content=BODY)
+        subscription = self.relay.subscribe()
+        with mock.patch('streamrelay.time.sleep', side_effect=StopRelay):
+            with self.assertRaises(StopRelay):
+                self.relay._relay()  # pylint: disable=protected-access
+        self.assertEqual(subscription.get(0),
+                         b'event: insert\ndata: {"_id": 1}\n\n')
+        self.assertEqual(subscription.get(0),
+                         b'event: delete\ndata: {"_id": 2}\n\n')
+        # the stream closed right away, so messages may have been missed
+        self.assertTrue(subscription.lost)
+
+    @requests_mock.Mocker()
+    def test_relay_error(self, mock_requests):
+        """Errors from the service lose the subscribers."""
+        mock_requests.get(URL, status_code=503)
+        subscription = self.relay.subscribe()
+        with mock.patch('streamrelay.time.sleep', side_effect=StopRelay):
+            with self.assertRaises(StopRelay), self.assertLogs(
+                    streamrelay.logger, 'WARNING'):
+                self.relay._relay()  # pylint: disable=protected-access
+        self.assertTrue(subscription.lost)
+
+    @requests_mock.Mocker()
+    def test_no_subscribers(self, mock_requests):
+        """The stream is closed once every subscriber has left."""
+        mock_requests.get(URL, content=BODY)
+        self.relay.subscribe().close()
+        self.relay._relay()  # pylint: disable=protected-access
+        self.assertFalse(mock_requests.called)
+        # the next subscriber starts relaying again
+        self.relay.subscribe()
+        self.assertEqual(self.thread.call_count, 2)
+
+
+class TestIterMessages(unittest.TestCase):
+    """Test streamrelay.iter_messages()."""
+
+    def test_split_chunks(self):
+        """Messages split across chunks are put back together."""
+        response = mock.Mock()
+        response.iter_content.return_value = iter(
+            [BODY[:20], BODY[20:21], BODY[21:]])
+        messages = list(streamrelay.iter_messages(response))
+        self.assertEqual(b''.join(messages), BODY)
+        self.assertEqual(len(messages), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
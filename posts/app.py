@@ -19,29 +19,194 @@
 # limitations under the License.
 
 import os
+import io
 import uuid
 import json
 import datetime
+import functools
+import re
+import hashlib
+import tempfile
+import time
+from concurrent import futures
 import pymongo
-from bson import json_util, ObjectId
-from flask import Flask, request
+from bson import ObjectId
+from flask import (Flask, request, make_response, send_from_directory,
+                   url_for)
+from werkzeug.datastructures import FileStorage
 from werkzeug.exceptions import BadRequestKeyError
-from google.cloud import storage
+from werkzeug.utils import secure_filename
+from changefeed import ChangeFeed
+from mediastore import GCSMediaStore, LocalMediaStore
+import derivatives
+from ingestqueue import IngestQueue
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # pylint: disable=invalid-name
 
 app = Flask(__name__)  # pylint: disable=invalid-name
 
 REQUIRED_ATTRIBUTES = {'event_id', 'author_id', 'text', 'files'}
+# attributes that can be selected with the `fields` query parameter
+FIELD_ATTRIBUTES = ['_id', 'event_id', 'author_id', 'text', 'files',
+                    'variants', 'created_at']
+NDJSON_MIMETYPE = 'application/x-ndjson'
+MAX_PAGE_SIZE = 1000  # upper bound on the `limit` query parameter
+# order of post lists, newest first; ties broken by _id for stable paging
+NEWEST_FIRST = [('created_at', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]
+# collection tracking the version of each collection, see conditional()
+VERSIONS_COLLECTION = 'collection_versions'
+# ISO 8601 times accepted by parse_time(), as (date, clock, UTC offset)
+ISO_TIME_PATTERN = re.compile(
+    r'(\d{4}-\d{2}-\d{2})(?:[T ](\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?))?'
+    r'(Z|[+-]\d{2}:?\d{2})?')
+# strptime formats of the clock part of ISO_TIME_PATTERN, by its length
+CLOCK_FORMATS = {5: '%H:%M', 8: '%H:%M:%S', 9: '%H:%M:%S.%f'}
+# each /v1/stream client holds one of gunicorn's 8 threads, so only some
+# may subscribe at once to leave threads for other requests
+MAX_STREAM_SUBSCRIBERS = 4
+STREAM_KEEPALIVE_SECONDS = 15  # most time between messages on /v1/stream
+STREAM_MAX_SECONDS = 300  # time after which /v1/stream is closed
+STREAM_RETRY_MILLISECONDS = 3000  # time clients wait before reconnecting
+SSE_MIMETYPE = 'text/event-stream'
+# file uploads to the media store run on a shared pool of threads, so each
+# post waits for its slowest file rather than the sum of all of them
+MAX_CONCURRENT_UPLOADS = 16  # across all posts being uploaded
+MAX_UPLOADS_PER_POST = 4  # so one post can't take every upload thread
+UPLOAD_EXECUTOR = futures.ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_UPLOADS, thread_name_prefix='upload')
+# collection next to the posts indexing stored media by content hash
+MEDIA_BLOBS_COLLECTION = 'media_blobs'
+HASH_CHUNK_SIZE = 1024 * 1024  # bytes of a file hashed at a time
+# media file names are unique, so served files can be cached for a year
+MEDIA_MAX_AGE = 365 * 24 * 60 * 60
+# resized variants of uploaded images are made in the background: threads
+# read the images and store the variants, and the CPU-bound resizing runs in
+# worker processes
+MAX_VARIANT_SOURCE_BYTES = 32 * 1024 * 1024  # larger images are linked as is
+MAX_PENDING_VARIANTS = 16  # images waiting for variants, more are skipped
+VARIANT_EXECUTOR = derivatives.VariantExecutor(
+    workers=2, max_pending=MAX_PENDING_VARIANTS)
+RESIZE_POOL = derivatives.ResizePool(workers=2)
+# posts sent with `Prefer: respond-async` are accepted once their files are
+# spooled to disk, then uploaded and inserted in batches in the background
+SPOOL_DIRECTORY = os.environ.get('SPOOL_DIRECTORY', tempfile.gettempdir())
+MAX_PENDING_POSTS = 256  # more are refused until some are inserted
+INGEST_WORKERS = 4  # posts whose files are uploaded at once
+INGEST_BATCH_SIZE = 50  # most posts inserted with one insert_many
+PENDING_RETRY_SECONDS = 5  # Retry-After when too many posts are pending
+
+# indexes on the posts collection, created at startup by ensure_indexes()
+INDEXES = [
+    pymongo.IndexModel([('event_id', pymongo.ASCENDING)] + NEWEST_FIRST,
+                       name='event_id_created_at'),
+    pymongo.IndexModel(NEWEST_FIRST, name='created_at'),
+]
+
+# inserts and deletes of posts, streamed by /v1/stream
+CHANGE_FEED = ChangeFeed(MAX_STREAM_SUBSCRIBERS)
+
+
+def conditional(view):
+    """Decorates a GET view to answer conditional requests.
+
+    Successful responses carry an ETag and Last-Modified derived from the
+    version of the collection. The ETag also names the representation, so
+    JSON and NDJSON responses for one URL never share one. If the client's
+    copy is still current, 304 Not Modified is returned without running the
+    view or querying the collection itself. Other methods run the view as is.
+    """
+    @functools.wraps(view)
+    def conditional_view(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+        try:
+            version = get_collection_version(app.config['COLLECTION'])
+        except ConnectionError:  # let the view report the DB error
+            return view(*args, **kwargs)
+        etag = f'{app.config["COLLECTION"].name}-{version["version"]}'
+        if wants_ndjson():
+            etag += '-ndjson'
+        last_modified = version['last_modified']
+        if request.if_none_match:
+            # compared weakly, as proxies may have weakened the ETag
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = (request.if_modified_since is not None
+                            and last_modified is not None
+                            and request.if_modified_since >= last_modified)
+        if not_modified:
+            response = app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True  # always revalidate
+        response.vary.add('Accept')
+        return response
+    return conditional_view
 
 
 @app.route('/v1/', methods=['GET'])
+@conditional
 def get_all_posts():
-    """Get all posts for the whole event."""
-    # serialize otherwise nonserializable ObjectIDs
-    post_list = find_posts_in_db(app.config['COLLECTION'])
-    return serialize_posts_to_json(post_list)
+    """Get a page of the posts for the whole event, newest first.
+
+    Query parameters (all optional):
+        limit: maximum number of posts to return, at most MAX_PAGE_SIZE.
+            If omitted, all posts are returned.
+        before: `next_cursor` from a previous page; only posts older than
+            the last post of that page are returned.
+        from, to: ISO 8601 times; only posts created at or after `from` and
+            before `to` are returned.
+        fields: comma-separated attributes to return for each post, e.g.
+            'author_id,text'. The _id is always returned.
+
+    The response includes a `next_cursor` to pass as `before` to fetch the
+    following page, or None if there are no more posts.
+
+    Streams posts as newline-delimited JSON if the request accepts
+    application/x-ndjson.
+    """
+    return respond_with_posts()
+
+
+@app.route('/v1/stream', methods=['GET'])
+def stream_changes():
+    """Stream posts as they are added and deleted, as Server-Sent Events.
+
+    Each change is sent as an SSE `event` named after the operation
+    ('insert' or 'delete') whose `data` is JSON with the `_id` of the post
+    and, for inserts, the whole `document`. A comment is sent every
+    STREAM_KEEPALIVE_SECONDS while there are no changes.
+
+    The stream is closed after STREAM_MAX_SECONDS, or early if the client
+    can't keep up, and EventSource clients then reconnect on their own.
+    Changes made while disconnected are not resent.
+
+    Response:
+        503: MAX_STREAM_SUBSCRIBERS clients are already subscribed.
+    """
+    subscription = CHANGE_FEED.subscribe()
+    if subscription is None:
+        response = make_response('Too many clients are streaming.', 503)
+        response.retry_after = STREAM_RETRY_MILLISECONDS // 1000
+        return response
+    response = app.response_class(
+        sse_messages(subscription), mimetype=SSE_MIMETYPE)
+    response.call_on_close(subscription.close)
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'  # don't buffer in proxies
+    return response
 
 
 @app.route('/v1/<post_id>', methods=['GET'])
+@conditional
 def get_post_by_id(post_id):
     """Get the post with the specified ID.
     """
@@ -61,7 +226,8 @@ def delete_post_by_id(post_id):
     """
     try:
         author_id = request.form['author_id']
-        return delete_post(post_id, author_id, app.config['COLLECTION'])
+        return delete_post(post_id, author_id, app.config['COLLECTION'],
+                           app.config['MEDIA_STORE'])
     except BadRequestKeyError:
         return 'Error: request missing `author_id`.', 400
 
@@ -76,6 +242,11 @@ def upload_new_post():
     text: text to be sent
     All the files the user wants to upload
     to the server.
+
+    Responds 201 with the ID of the post once it is inserted. If the request
+    has a `Prefer: respond-async` header, responds 202 with the ID as soon as
+    the post is validated and its files are spooled to disk instead, see
+    accept_post().
     """
     try:
         post = {
@@ -84,30 +255,106 @@ def upload_new_post():
             'text':  request.form['text'],
             'files': [file for file in request.files.values()]
         }
-        return str(upload_new_post_to_db(post, app.config['COLLECTION'])), 201
+        if 'respond-async' in request.headers.get('Prefer', ''):
+            return accept_post(
+                post, app.config['COLLECTION'], app.config['MEDIA_STORE'])
+        return str(upload_new_post_to_db(
+            post, app.config['COLLECTION'], app.config['MEDIA_STORE'])), 201
     except BadRequestKeyError:
         return f'Invalid request. Required data: {REQUIRED_ATTRIBUTES}.', 400
     except ValueError:
         return 'Post must contain text and/or files.', 400
 
 
+@app.route('/v1/media/<name>', methods=['GET'])
+def get_media(name):
+    """Serves a media file of a post, if media is stored on local disk."""
+    store = app.config['MEDIA_STORE']
+    if not isinstance(store, LocalMediaStore):
+        return 'Media is not served by this service.', 404
+    return send_from_directory(store.directory, name, max_age=MEDIA_MAX_AGE)
+
+
+@app.route('/v1/pending/<post_id>', methods=['GET'])
+def get_pending_post(post_id):
+    """Get the status of a post accepted with `Prefer: respond-async`.
+
+    Responds with JSON with a `status` of 'pending' until the post is
+    inserted, then 'done', or 'failed' with an `error` message.
+    """
+    if not ObjectId.is_valid(post_id):
+        return 'Error: invalid post ID.', 400
+    post_id = ObjectId(post_id)
+    status = INGEST_QUEUE.status(post_id)
+    if status is None:
+        # accepted by another instance, or too long ago to remember
+        if not app.config['COLLECTION'].count_documents(
+                {'_id': post_id}, limit=1):
+            return 'Pending post not found.', 404
+        status = {'status': 'done'}
+    response = json_response(status)
+    if status['status'] == 'done':
+        response.headers['Location'] = url_for(
+            'get_post_by_id', post_id=str(post_id))
+    return response
+
+
 @app.route('/v1/by_event/<event_id>', methods=['GET'])
+@conditional
 def get_all_posts_for_event(event_id):
-    """Get all posts matching the event with the specified ID."""
-    # serialize otherwise nonserializable ObjectIDs
-    post_list = find_posts_in_db(app.config['COLLECTION'], event_id=event_id)
-    return serialize_posts_to_json(post_list)
+    """Get a page of the posts matching the event with the specified ID.
 
+    Takes the same query parameters as get_all_posts().
+    """
+    return respond_with_posts(event_id)
 
-def delete_post(post_id, author_id, collection):
-    """Deletes the post matching post_id and author_id if it exists."""
-    result = collection.delete_one(
-        {'_id': ObjectId(post_id), 'author_id': author_id})
-    return (('Document deleted.', 204) if result.deleted_count
-            else ('Document not found.', 404))
 
+def respond_with_posts(event_id=None):
+    """Responds with the page of posts selected by the request's arguments.
 
-def find_posts_in_db(collection, post_id=None, event_id=None):
+    Args:
+        event_id (string): ID of an event to only list the posts of.
+    """
+    try:
+        time_range = parse_time_range(request.args)
+        projection = parse_fields(request.args)
+        limit, before = parse_page_args(request.args)
+    except ValueError as error:
+        return f'Error: {error}', 400
+    if limit is not None and projection is not None:
+        projection['created_at'] = True  # to make the next page's cursor
+    posts = query_posts_in_db(
+        app.config['COLLECTION'], event_id=event_id, time_range=time_range,
+        projection=projection, limit=limit, before=before)
+    if wants_ndjson():
+        return ndjson_response(posts)
+    post_list = list(posts)
+    next_cursor = None
+    if limit is not None and len(post_list) == limit:
+        next_cursor = make_page_cursor(post_list[-1])
+    return serialize_posts_to_json(post_list, next_cursor)
+
+
+def delete_post(post_id, author_id, collection, store):
+    """Deletes the post matching post_id and author_id if it exists.
+
+    Media files of the post are deleted from the store unless other posts
+    use them too.
+    """
+    post = collection.find_one_and_delete(
+        {'_id': ObjectId(post_id), 'author_id': author_id},
+        projection={'media': True})
+    if post is None:
+        return 'Document not found.', 404
+    bump_collection_version(collection)
+    CHANGE_FEED.publish_local('delete', ObjectId(post_id))
+    release_media(post.get('media', []), collection, store)
+    return 'Document deleted.', 204
+
+
+def find_posts_in_db(collection, post_id=None, event_id=None,
+                     time_range=None, projection=None, limit=None,
+                     before=None):
     """Finds all matching posts in the database.
 
     Query is configured using one or none of args `post_id` and `event_id`.
@@ -119,62 +366,658 @@ def find_posts_in_db(collection, post_id=None, event_id=None):
         collection (pymongo.collection): The collection to search in.
         post_id (string): ID of a post to search for.
         event_id (string): ID of an event to find all posts for.
+        time_range (dict): Query operators the created_at time of the posts
+            must match, e.g. from parse_time_range().
+        projection (dict): Fields of the posts to return, e.g. from
+            parse_fields(), or None for all fields.
+        limit (int): Maximum number of posts to return, or None for all.
+        before (tuple): (created_at, _id) of a post; only posts older than
+            it are returned. From parse_page_args().
+
+    Returns:
+        list: List of all matching post objects, newest first.
+    """
+    return list(query_posts_in_db(
+        collection, post_id, event_id, time_range, projection, limit,
+        before))
+
+
+def query_posts_in_db(collection, post_id=None, event_id=None,
+                      time_range=None, projection=None, limit=None,
+                      before=None):
+    """Queries for matching posts without reading them from the database.
+
+    Takes the same arguments as find_posts_in_db().
 
     Returns:
-        list: List of all matching post objects.
+        pymongo.cursor: Cursor over all matching post objects.
     """
     query = {}
     if post_id is not None:
         query = {'_id': post_id}
     elif event_id is not None:
         query = {'event_id': event_id}
-    cursor = collection.find(query)
-    list_of_posts = []
-    for post in cursor:
-        list_of_posts.append(post)
-    return list_of_posts
+    if time_range:
+        query['created_at'] = time_range
+    if before is not None:
+        created_at, post_id = before
+        query['$or'] = [{'created_at': {'$lt': created_at}},
+                        {'created_at': created_at, '_id': {'$lt': post_id}}]
+    cursor = collection.find(query, projection).sort(NEWEST_FIRST)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+def parse_page_args(args):
+    """Parses and validates the `limit` and `before` pagination arguments.
+
+    Returns:
+        tuple: (limit, before) where limit is an int or None and before is
+            a (created_at, _id) tuple or None.
+
+    Raises:
+        ValueError: if either argument is malformatted.
+    """
+    limit = args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= MAX_PAGE_SIZE:
+            raise ValueError(
+                f'limit must be an integer from 1 to {MAX_PAGE_SIZE}.')
+        limit = int(limit)
+    before = args.get('before')
+    if before is not None:
+        created_at, _, post_id = before.rpartition('_')
+        if not ObjectId.is_valid(post_id):
+            raise ValueError('before must be a cursor from a previous page.')
+        before = (parse_time(created_at), ObjectId(post_id))
+    return limit, before
+
+
+def make_page_cursor(post):
+    """Returns the cursor for the page of posts older than post."""
+    created_at = post['created_at']
+    if isinstance(created_at, str):  # legacy time, see connect_to_mongodb()
+        created_at = parse_time(created_at)
+    return f'{created_at.isoformat()}_{post["_id"]}'
+
+
+def parse_fields(args):
+    """Parses the comma-separated `fields` argument into a projection.
+
+    Returns:
+        dict: MongoDB projection of the requested attributes and the _id, or
+            None if `fields` isn't given.
+
+    Raises:
+        ValueError: if a field isn't a post attribute.
+    """
+    if 'fields' not in args:
+        return None
+    fields = [field.strip() for field in args['fields'].split(',')]
+    for field in fields:
+        if field not in FIELD_ATTRIBUTES:
+            raise ValueError(f'fields must be from {FIELD_ATTRIBUTES}.')
+    return dict.fromkeys(['_id', *fields], True)
 
 
 def generate_timestamp():
     """Generate timestamp of the current time for placement in db.
 
     Returns:
-        datetime: the current time.
+        datetime: the current UTC time, truncated to the second.
+    """
+    return datetime.datetime.utcnow().replace(microsecond=0)
+
+
+def parse_time(time_string):
+    """Parses an ISO 8601 time string into a naive UTC datetime.
+
+    Accepts e.g. '2019-06-11 10:33', '2019-06-11T10:33:01' and
+    '2019-06-11T10:33:01Z'. Times without an offset are taken to be in UTC.
+
+    Raises:
+        ValueError: if time_string is not an ISO 8601 time.
     """
-    return datetime.datetime.utcnow().isoformat(sep=' ', timespec='seconds')
+    match = None
+    if isinstance(time_string, str):
+        match = ISO_TIME_PATTERN.fullmatch(time_string.strip())
+    try:
+        if match is None:
+            raise ValueError
+        date, clock, offset = match.groups()
+        clock = clock or '00:00'
+        time = datetime.datetime.strptime(
+            f'{date} {clock}', '%Y-%m-%d ' + CLOCK_FORMATS[min(len(clock), 9)])
+    except ValueError:
+        raise ValueError(f'"{time_string}" is not an ISO 8601 time.')
+    if offset not in (None, 'Z'):
+        sign = -1 if offset[0] == '-' else 1
+        time -= sign * datetime.timedelta(hours=int(offset[1:3]),
+                                          minutes=int(offset[-2:]))
+    return time
 
 
-def serialize_posts_to_json(post_list):
-    """Serialize the post list into a json object.
+def parse_time_range(args):
+    """Parses the `from` and `to` arguments into a MongoDB range query.
+
+    Returns:
+        dict: Query operators matching times at or after `from` and before
+            `to`, empty if neither is given.
+
+    Raises:
+        ValueError: if either argument is malformatted.
+    """
+    time_range = {}
+    if 'from' in args:
+        time_range['$gte'] = parse_time(args['from'])
+    if 'to' in args:
+        time_range['$lt'] = parse_time(args['to'])
+    return time_range
+
+
+def migrate_string_times(collection):
+    """Converts created_at times stored as ISO strings into datetimes.
+
+    Posts made before times were stored natively hold them as strings, which
+    can't be range-queried. Times that don't parse are left as they are.
+    Safe to run more than once.
+
+    Returns:
+        dict: Number of posts 'converted' and number of times that were
+            'unparseable'.
+    """
+    report = {'converted': 0, 'unparseable': 0}
+    query = {'created_at': {'$type': 'string'}}
+    for post in collection.find(query, {'created_at': True}):
+        try:
+            created_at = parse_time(post['created_at'])
+        except ValueError:
+            report['unparseable'] += 1
+            continue
+        collection.update_one(
+            {'_id': post['_id']}, {'$set': {'created_at': created_at}})
+        report['converted'] += 1
+    return report
+
+
+def serialize_posts_to_json(post_list, next_cursor=None):
+    """Serialize the post list into a json response.
 
     Used for sending the results of a post query in an HTTP response.
     Handles non-serializable fields like bson.ObjectID.
 
     Args:
         post_list (list): List of post objects to serialize
+        next_cursor (str): Cursor for the following page of posts, if any.
 
     Returns:
-        dict: json-like wrapper around the list of posts in a 'posts' key
-            and the number of posts in a 'num_posts' key.
+        flask.Response: json wrapper around the list of posts in a 'posts'
+            key, the number of posts in a 'num_posts' key and the cursor in
+            a 'next_cursor' key.
     """
-    return json.loads(json_util.dumps(
+    return json_response(
         {'posts': post_list,
-         'num_posts': len(post_list)}))
+         'num_posts': len(post_list),
+         'next_cursor': next_cursor})
 
 
-def upload_file_to_cloud(file):
-    """Uploads a file to the GCloud Storage bucket.
+def get_collection_version(collection):
+    """Returns the version of the collection, which increases on every write.
 
     Returns:
-        str: Public URL of the file in the cloud.
+        dict: 'version' (int) counting the writes to the collection and
+            'last_modified' (datetime) of the last write, or None if the
+            collection has never been written to.
+    """
+    version = collection.database[VERSIONS_COLLECTION].find_one(
+        {'_id': collection.name})
+    if version is None:
+        return {'version': 0, 'last_modified': None}
+    return {'version': version['version'],
+            'last_modified': version['last_modified'].replace(
+                tzinfo=datetime.timezone.utc)}
+
+
+def bump_collection_version(collection):
+    """Records a write to the collection so cached copies are revalidated."""
+    # HTTP dates have a resolution of one second
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    collection.database[VERSIONS_COLLECTION].update_one(
+        {'_id': collection.name},
+        {'$inc': {'version': 1}, '$set': {'last_modified': now}},
+        upsert=True)
+
+
+def encode_bson_value(value):
+    """Encodes BSON types as MongoDB extended JSON, like bson.json_util does.
+
+    Used as the `default` hook of the JSON encoder for values it can't
+    serialize natively.
+    """
+    if isinstance(value, ObjectId):
+        return {'$oid': str(value)}
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        millis = value.microsecond // 1000
+        return {'$date': value.strftime('%Y-%m-%dT%H:%M:%S')
+                         + (f'.{millis:03d}' if millis else '') + 'Z'}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(obj):
+    """Serializes obj to JSON bytes in a single pass.
+
+    Uses orjson when it is installed and falls back to the standard library.
     """
-    filename = str(uuid.uuid4()) + '-' + file.filename
-    blob = CLOUD_STORAGE_BUCKET.blob(filename)
-    blob.upload_from_file(file)
-    return blob.public_url
+    if orjson is not None:
+        return orjson.dumps(obj, default=encode_bson_value,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(obj, default=encode_bson_value).encode()
 
 
-def upload_new_post_to_db(post, collection):
+def json_response(obj, status=200):
+    """Returns a JSON response with BSON types encoded as extended JSON."""
+    return app.response_class(dumps(obj), status=status,
+                              mimetype='application/json')
+
+
+def wants_ndjson():
+    """Determines if the client asked for newline-delimited JSON."""
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(documents):
+    """Streams documents as newline-delimited JSON, one document per line.
+
+    Documents are encoded as they are pulled from the iterable (e.g. a
+    MongoDB cursor), so the whole result is never held in memory.
+    """
+    return app.response_class(
+        (dumps(document) + b'\n' for document in documents),
+        mimetype=NDJSON_MIMETYPE)
+
+
+def sse_messages(subscription, max_seconds=None):
+    """Yields changes from the subscription as Server-Sent Events messages.
+
+    Stops after max_seconds, defaulting to STREAM_MAX_SECONDS, or once the
+    subscription is lost.
+    """
+    if max_seconds is None:
+        max_seconds = STREAM_MAX_SECONDS
+    deadline = time.monotonic() + max_seconds
+    yield f'retry: {STREAM_RETRY_MILLISECONDS}\n\n'.encode()
+    while not subscription.lost:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        change = subscription.get(min(STREAM_KEEPALIVE_SECONDS, remaining))
+        if change is None:
+            yield b': keepalive\n\n'
+        elif not subscription.lost:
+            yield (b'event: ' + change['operation'].encode()
+                   + b'\ndata: ' + dumps(change) + b'\n\n')
+
+
+def hash_file(file):
+    """Returns the SHA-256 hex digest of a file, then rewinds the file.
+
+    The file is read in chunks, so it never has to fit in memory.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(functools.partial(file.read, HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def store_media(file, filename, collection, store):
+    """Stores a file in the media store unless the same content already is.
+
+    Stored media is indexed by the SHA-256 of its contents in the
+    MEDIA_BLOBS_COLLECTION next to the posts, along with its name in the
+    store and the number of references to it. Storing known content only
+    adds a reference. References are given up with release_media().
+
+    Args:
+        file: File object to store.
+        filename (str): Name the file was uploaded with.
+        collection (pymongo.collection): Collection of the posts.
+        store (mediastore.MediaStore): Store to upload the file to.
+
+    Returns:
+        tuple: (digest, name) of the file in the store.
+    """
+    blobs = collection.database[MEDIA_BLOBS_COLLECTION]
+    digest = hash_file(file)
+    # blobs without references are being deleted, so can't be reused
+    blob = blobs.find_one_and_update(
+        {'_id': digest, 'refs': {'$gt': 0}}, {'$inc': {'refs': 1}})
+    if blob is not None:
+        return digest, blob['name']
+    name = str(uuid.uuid4()) + '-' + secure_filename(filename)
+    store.put(file, name)
+    blob = blobs.find_one_and_update(
+        {'_id': digest},
+        {'$setOnInsert': {'name': name}, '$inc': {'refs': 1}},
+        upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+    if blob['name'] != name:
+        # the same content was stored by another upload in the meantime
+        delete_files_from_store([name], store)
+    return digest, blob['name']
+
+
+def release_media(digests, collection, store):
+    """Gives up references to stored media, see store_media().
+
+    Files are deleted from the store when their last reference is released.
+    """
+    blobs = collection.database[MEDIA_BLOBS_COLLECTION]
+    for digest in digests:
+        blob = blobs.find_one_and_update(
+            {'_id': digest}, {'$inc': {'refs': -1}},
+            return_document=pymongo.ReturnDocument.AFTER)
+        if blob is None or blob['refs'] > 0:
+            continue
+        # unless the content was stored again since the update
+        if blobs.delete_one({'_id': digest, 'refs': {'$lte': 0}}).deleted_count:
+            delete_files_from_store([blob['name']], store)
+
+
+def upload_files_to_store(files, collection, store):
+    """Uploads files to the media store concurrently.
+
+    Uploads run on UPLOAD_EXECUTOR, at most MAX_UPLOADS_PER_POST at a time,
+    through store_media(). If any upload fails, no more are started and the
+    files that were stored are released again.
+
+    Args:
+        files (list): File objects to upload.
+        collection (pymongo.collection): Collection of the posts.
+        store (mediastore.MediaStore): Store to upload the files to.
+
+    Returns:
+        list: (digest, name) of each file in the store, in the order of
+            files.
+
+    Raises:
+        Exception: The error raised by the first failed upload.
+    """
+    remaining = iter(enumerate(files))
+    stored = [None] * len(files)
+    pending = {}  # future -> index of its file
+    error = None
+
+    def submit_next():
+        item = next(remaining, None)
+        if item is not None:
+            index, file = item
+            future = UPLOAD_EXECUTOR.submit(
+                store_media, file, file.filename, collection, store)
+            pending[future] = index
+
+    for _ in range(MAX_UPLOADS_PER_POST):
+        submit_next()
+    while pending:
+        done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            if future.cancelled():
+                continue
+            try:
+                stored[index] = future.result()
+            except Exception as upload_error:  # pylint: disable=broad-except
+                if error is None:
+                    error = upload_error
+                    for other in pending:
+                        other.cancel()  # if still queued behind other posts
+            if error is None:
+                submit_next()
+    if error is not None:
+        release_media([item[0] for item in stored if item is not None],
+                      collection, store)
+        raise error
+    return stored
+
+
+def delete_files_from_store(names, store):
+    """Deletes stored files, logging rather than raising any failures."""
+    for name in names:
+        try:
+            store.delete(name)
+        except Exception as error:  # pylint: disable=broad-except
+            app.logger.warning('Could not delete %s: %s', name, error)
+
+
+def read_images(files):
+    """Reads the images among uploaded files to make variants of.
+
+    Returns:
+        list: (index, data) pairs of the images, by their index in files.
+    """
+    images = []
+    for index, file in enumerate(files):
+        if not file.mimetype.startswith('image/'):
+            continue
+        file.seek(0)
+        data = file.read(MAX_VARIANT_SOURCE_BYTES + 1)
+        if len(data) <= MAX_VARIANT_SOURCE_BYTES:
+            images.append((index, data))
+    return images
+
+
+def create_variants(post_id, index, data, collection, store):
+    """Stores resized variants of an image of a post and links them from it.
+
+    The URLs of the variants are set in the post's `variants` list at the
+    image's index in its `files`, as a dict of URLs by variant name. Runs in
+    the background after the post is uploaded, so failures are logged.
+
+    Args:
+        post_id (ObjectId): ID of the post the image is attached to.
+        index (int): Index of the image in the post's files.
+        data (bytes): Contents of the image.
+        collection (pymongo.collection): Collection the post is in.
+        store (mediastore.MediaStore): Store to upload the variants to.
+    """
+    try:
+        variants = RESIZE_POOL.make_variants(data)
+        if not variants:
+            return  # not an image Pillow can read
+        urls = {}
+        digests = []
+        for variant, body in variants.items():
+            digest, name = store_media(
+                io.BytesIO(body), variant + derivatives.VARIANT_EXTENSION,
+                collection, store)
+            urls[variant] = store.url(name)
+            digests.append(digest)
+        result = collection.update_one(
+            {'_id': post_id},
+            {'$set': {f'variants.{index}': urls},
+             '$push': {'media': {'$each': digests}}})
+        if result.matched_count:
+            bump_collection_version(collection)
+        else:  # the post was deleted in the meantime
+            release_media(digests, collection, store)
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.warning('Could not create variants of file %d of post %s: '
+                           '%s', index, post_id, error)
+
+
+def submit_variants(post_id, images, collection, store):
+    """Queues create_variants() for images of a post on VARIANT_EXECUTOR.
+
+    Images are skipped while MAX_PENDING_VARIANTS others are waiting for
+    their variants, and only linked as they are.
+
+    Args:
+        post_id (ObjectId): ID of the post the images are attached to.
+        images (list): (index, data) pairs from read_images().
+        collection (pymongo.collection): Collection the post is in.
+        store (mediastore.MediaStore): Store to upload the variants to.
+    """
+    for index, data in images:
+        if VARIANT_EXECUTOR.submit(create_variants, post_id, index, data,
+                                   collection, store) is None:
+            app.logger.warning('Too many images waiting for variants, '
+                               'skipped file %d of post %s', index, post_id)
+
+
+def validate_post(post):
+    """Checks a post has the required attributes and text or files.
+
+    Raises:
+        ValueError: Has no text body (i.e. empty string) nor any files
+            to upload.
+        AttributeError: `post` has not enough or too many attributes.
+    """
+    if post.keys() != REQUIRED_ATTRIBUTES:
+        raise AttributeError(f'Post must have exactly the '
+                             'attributes {required_attributes}')
+    if not post['text'] and not post['files']:
+        raise ValueError('One of text or files must not be empty.')
+
+
+def accept_post(post, collection, store):
+    """Accepts a new post to upload and insert in the background.
+
+    Validates the post like upload_new_post_to_db() and spools its files to
+    SPOOL_DIRECTORY, then queues it on INGEST_QUEUE.
+
+    Args:
+        post (dict): Post to add, as for upload_new_post_to_db().
+        collection: pymongo collection to insert into.
+        store (mediastore.MediaStore): Store to upload the files to.
+
+    Returns:
+        flask.Response: 202 with the ID the post will have and the URL of
+            its status in the Location header, or 503 if too many posts are
+            pending.
+    """
+    validate_post(post)
+    post_id = ObjectId()
+    spooled = spool_files(post['files'])
+    job = {
+        'post': dict(post, _id=post_id, created_at=generate_timestamp()),
+        'spooled': spooled,
+        'collection': collection,
+        'store': store,
+    }
+    if not INGEST_QUEUE.submit(post_id, job):
+        remove_spooled_files(spooled)
+        response = make_response('Too many pending posts.', 503)
+        response.headers['Retry-After'] = PENDING_RETRY_SECONDS
+        return response
+    response = make_response(str(post_id), 202)
+    response.headers['Location'] = url_for(
+        'get_pending_post', post_id=str(post_id))
+    response.headers['Preference-Applied'] = 'respond-async'
+    return response
+
+
+def spool_files(files):
+    """Saves uploaded files to SPOOL_DIRECTORY, to upload after the request.
+
+    Returns:
+        list: (path, filename, mimetype) of each file.
+    """
+    spooled = []
+    try:
+        for file in files:
+            handle, path = tempfile.mkstemp(dir=SPOOL_DIRECTORY, prefix='post-')
+            os.close(handle)
+            spooled.append((path, file.filename, file.mimetype))
+            file.save(path)
+    except BaseException:
+        remove_spooled_files(spooled)
+        raise
+    return spooled
+
+
+def remove_spooled_files(spooled):
+    """Removes files saved by spool_files()."""
+    for path, _, _ in spooled:
+        try:
+            os.remove(path)
+        except OSError as error:
+            app.logger.warning('Could not remove %s: %s', path, error)
+
+
+def prepare_post(job):
+    """Uploads the spooled files of a post accepted by accept_post().
+
+    Run by INGEST_QUEUE before the post is inserted by insert_posts().
+
+    Returns:
+        dict: The job with the post ready to insert and its images to make
+            variants of.
+    """
+    post, store = job['post'], job['store']
+    files = [FileStorage(open(path, 'rb'), filename, content_type=mimetype)
+             for path, filename, mimetype in job['spooled']]
+    try:
+        stored = upload_files_to_store(files, job['collection'], store)
+        images = read_images(files)
+    finally:
+        for file in files:
+            file.close()
+        remove_spooled_files(job['spooled'])
+    post = dict(post,
+                files=[store.url(name) for _, name in stored],
+                media=[digest for digest, _ in stored],
+                variants=[None] * len(stored))
+    return dict(job, post=post, images=images)
+
+
+def insert_posts(jobs):
+    """Inserts posts prepared by prepare_post() in one insert_many.
+
+    Run by INGEST_QUEUE. The media of posts that can't be inserted is
+    released.
+
+    Returns:
+        list: An error for each post that could not be inserted and None
+            for each that was.
+    """
+    errors = [None] * len(jobs)
+    # every job has the same collection unless the config changed
+    by_collection = {}
+    for index, job in enumerate(jobs):
+        by_collection.setdefault(id(job['collection']), []).append(index)
+    for indexes in by_collection.values():
+        collection = jobs[indexes[0]]['collection']
+        try:
+            collection.insert_many(
+                [jobs[index]['post'] for index in indexes], ordered=False)
+        except pymongo.errors.BulkWriteError as error:
+            for write_error in error.details['writeErrors']:
+                errors[indexes[write_error['index']]] = write_error['errmsg']
+        except pymongo.errors.PyMongoError as error:
+            for index in indexes:
+                errors[index] = error
+        if any(errors[index] is None for index in indexes):
+            bump_collection_version(collection)
+        for index in indexes:
+            post, store = jobs[index]['post'], jobs[index]['store']
+            if errors[index] is not None:
+                release_media(post['media'], collection, store)
+                continue
+            CHANGE_FEED.publish_local('insert', post['_id'], post)
+            submit_variants(post['_id'], jobs[index]['images'], collection,
+                            store)
+    return errors
+
+
+INGEST_QUEUE = IngestQueue(
+    prepare_post, insert_posts, workers=INGEST_WORKERS,
+    max_pending=MAX_PENDING_POSTS, batch_size=INGEST_BATCH_SIZE)
+
+
+def upload_new_post_to_db(post, collection, store):
     """Uploads a new post to the db collection.
 
     Assumes the event matching the post's `event_id` and the user matching
@@ -187,6 +1030,11 @@ def upload_new_post_to_db(post, collection):
             text (str): text description
             files (list): list of strings of file URLs
         collection: pymongo collection to insert into.
+        store (mediastore.MediaStore): Store to upload the files to.
+
+    The digests of the post's media are kept in its `media` list, see
+    store_media(). Resized variants of the images among the files are added
+    to the post in the background, see create_variants().
 
     Returns:
         ObjectID: DB ID of the post that was uploaded.
@@ -196,20 +1044,85 @@ def upload_new_post_to_db(post, collection):
             to upload.
         AttributeError: `post` has not enough or too many attributes.
     """
-    if post.keys() != REQUIRED_ATTRIBUTES:
-        raise AttributeError(f'Post must have exactly the '
-                             'attributes {required_attributes}')
-    if not post['text'] and not post['files']:
-        raise ValueError('One of text or files must not be empty.')
+    validate_post(post)
     # post is valid, add on timestamp, upload files, insert into db
     post['created_at'] = generate_timestamp()
-    post['files'] = [
-        upload_file_to_cloud(file) for file in post['files']]
-    return collection.insert_one(post).inserted_id
+    files = post['files']
+    stored = upload_files_to_store(files, collection, store)
+    post['files'] = [store.url(name) for _, name in stored]
+    post['media'] = [digest for digest, _ in stored]
+    post['variants'] = [None] * len(files)
+    images = read_images(files)
+    try:
+        post_id = collection.insert_one(post).inserted_id
+    except BaseException:
+        release_media(post['media'], collection, store)
+        raise
+    bump_collection_version(collection)
+    CHANGE_FEED.publish_local('insert', post_id, post)
+    submit_variants(post_id, images, collection, store)
+    return post_id
 
 
-def connect_to_cloud_storage():  # pragma: no cover
-    """Connect to Google Cloud Storage using env vars."""
+def ensure_indexes(collection, indexes=None):
+    """Reconciles the indexes on the collection with the declared indexes.
+
+    Creates declared indexes that are missing and rebuilds declared indexes
+    whose spec has drifted from the one in the DB. Indexes in the DB that are
+    not declared are left alone, but reported. Run once at startup so that
+    request handlers never have to create indexes.
+
+    Args:
+        collection (pymongo.collection): The collection to reconcile.
+        indexes (list): pymongo.IndexModels to declare, defaults to INDEXES.
+
+    Returns:
+        dict: Names of the indexes that were 'created', 'rebuilt', 'failed'
+            to build, and that exist in the DB but are 'undeclared'.
+    """
+    if indexes is None:
+        indexes = INDEXES
+    existing = collection.index_information()
+    report = {'created': [], 'rebuilt': [], 'failed': [], 'undeclared': []}
+    for index in indexes:
+        name = index.document['name']
+        try:
+            if name not in existing:
+                collection.create_indexes([index])
+                report['created'].append(name)
+            elif not index_matches(existing[name], index.document):
+                collection.drop_index(name)
+                collection.create_indexes([index])
+                report['rebuilt'].append(name)
+        except pymongo.errors.OperationFailure:
+            report['failed'].append(name)
+    declared = {index.document['name'] for index in indexes}
+    report['undeclared'] = [
+        name for name in existing if name not in declared and name != '_id_']
+    for outcome, names in report.items():
+        if names:
+            app.logger.warning('Indexes %s on %s: %s',
+                               outcome, collection.name, ', '.join(names))
+    return report
+
+
+def index_matches(info, spec):
+    """Determines if an index from index_information() matches an index spec.
+
+    Only compares keys and uniqueness, as no text indexes are declared.
+    """
+    return (list(info['key']) == list(spec['key'].items())
+            and info.get('unique', False) == spec.get('unique', False))
+
+
+def connect_to_media_store():  # pragma: no cover
+    """Connect to the store for media files using env vars.
+
+    Media is stored on local disk in MEDIA_DIRECTORY if it is set, and
+    served under MEDIA_BASE_URL, the absolute URL of this service's
+    /v1/media/. Otherwise it is stored in the GCLOUD_STORAGE_BUCKET_NAME
+    bucket.
+    """
 
     class StorageNotConnectedError(ConnectionError):
         """Raised when not able to connect to the storage."""
@@ -219,16 +1132,20 @@ def connect_to_cloud_storage():  # pragma: no cover
 
         def __getattribute__(self, _):
             raise StorageNotConnectedError(
-                'Not able to find GCLOUD_STORAGE_BUCKET_NAME environment variable')
+                f'Not able to find {missing} environment variable')
 
+    media_directory = os.environ.get('MEDIA_DIRECTORY')
+    if media_directory is not None:
+        media_base_url = os.environ.get('MEDIA_BASE_URL')
+        if media_base_url is None:
+            missing = 'MEDIA_BASE_URL'
+            return Thrower()  # not able to find where media is served
+        return LocalMediaStore(media_directory, media_base_url)
     bucket_name = os.environ.get('GCLOUD_STORAGE_BUCKET_NAME')
     if bucket_name is None:
+        missing = 'MEDIA_DIRECTORY or GCLOUD_STORAGE_BUCKET_NAME'
         return Thrower()  # not able to find storage config var
-    storage_client = storage.Client()
-    return storage_client.get_bucket(bucket_name)
-
-
-CLOUD_STORAGE_BUCKET = connect_to_cloud_storage()
+    return GCSMediaStore(bucket_name)
 
 
 def connect_to_mongodb():  # pragma: no cover
@@ -247,10 +1164,20 @@ def connect_to_mongodb():  # pragma: no cover
     mongodb_uri = os.environ.get('MONGODB_URI')
     if mongodb_uri is None:
         return Thrower()  # not able to find db config var
-    return pymongo.MongoClient(mongodb_uri).posts_db.posts_collection
+    collection = pymongo.MongoClient(mongodb_uri).posts_db.posts_collection
+    ensure_indexes(collection)
+    # pages are walked by created_at, and strings sort after every datetime
+    if migrate_string_times(collection)['converted']:
+        bump_collection_version(collection)
+    CHANGE_FEED.watch(collection)
+    return collection
 
 
-app.config['COLLECTION'] = connect_to_mongodb()
+# when this file is run as a script, the spawned resize workers of
+# RESIZE_POOL run it again as __mp_main__, and must not connect
+if __name__ != '__mp_main__':
+    app.config['MEDIA_STORE'] = connect_to_media_store()
+    app.config['COLLECTION'] = connect_to_mongodb()
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -0,0 +1,149 @@
+"""Resized WebP variants of the images attached to posts."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import multiprocessing
+import threading
+from concurrent import futures
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = ImageOps = None  # pylint: disable=invalid-name
+
+# variant name -> most pixels on the longest side of the variant
+VARIANTS = {'thumbnail': 320, 'display': 1280}
+VARIANT_EXTENSION = '.webp'
+VARIANT_QUALITY = 80
+
+
+def make_variants(data, variants=None):
+    """Resizes an image into WebP variants.
+
+    Images are never enlarged, so a variant of a small image is only
+    re-encoded. Meant to be run in a process pool, as it is CPU bound.
+
+    Args:
+        data (bytes): Contents of an image file.
+        variants (dict): Longest sides by variant name, defaults to VARIANTS.
+
+    Returns:
+        dict: WebP file contents by variant name, or None if data is not an
+            image that can be decoded or Pillow is not installed.
+    """
+    if Image is None:
+        return None
+    if variants is None:
+        variants = VARIANTS
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # decode JPEGs at a reduced scale when the variants are small
+            largest = max(variants.values())
+            image.draft('RGB', (largest, largest))
+            # phone photos are stored sideways with an EXIF orientation
+            image = ImageOps.exif_transpose(image)
+            has_alpha = ('A' in image.getbands()
+                         or 'transparency' in image.info)
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+            results = {}
+            # resize largest first, so each smaller variant starts closer
+            for name, size in sorted(variants.items(), key=lambda item: -item[1]):
+                image.thumbnail((size, size), Image.LANCZOS)
+                output = io.BytesIO()
+                image.save(output, 'WEBP', quality=VARIANT_QUALITY)
+                results[name] = output.getvalue()
+            return results
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+class ResizePool():
+    """Pool of worker processes running make_variants(), started on first use.
+
+    Workers are spawned rather than forked, as forking a threaded process can
+    deadlock. They only need this module, so nothing is started before an
+    image has to be resized.
+
+    Attributes:
+        workers: Number of worker processes.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def make_variants(self, data, variants=None):
+        """Runs make_variants() in a worker process and returns its result."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.get_context('spawn').Pool(
+                    self.workers)
+            pool = self._pool
+        return pool.apply(make_variants, (data, variants))
+
+    def close(self):
+        """Stops the worker processes, if they were started."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+
+class VariantExecutor():
+    """Thread pool for making variants that refuses work when it is behind.
+
+    Tasks are given the contents of an image, and the queue of a
+    futures.ThreadPoolExecutor has no limit, so during a burst of uploads
+    every image would be held in memory until its variants were made. At
+    most max_pending tasks are queued or running here, and more are refused.
+
+    Attributes:
+        max_pending: Most tasks queued or running at a time.
+    """
+
+    def __init__(self, workers=2, max_pending=16):
+        self.max_pending = max_pending
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='variants')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, function, *args, **kwargs):
+        """Runs function(*args, **kwargs) on the pool.
+
+        Returns:
+            futures.Future: The task, or None if max_pending tasks already
+                are queued or running.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        def run():
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._slots.release()
+
+        try:
+            return self._executor.submit(run)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def shutdown(self, wait=True):
+        """Stops the pool, waiting for the queued tasks by default."""
+        self._executor.shutdown(wait)
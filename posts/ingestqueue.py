@@ -0,0 +1,158 @@
+"""Queue completing accepted writes in the background, in batches."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent import futures
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class IngestQueue():
+    """Runs accepted jobs in two stages on background threads.
+
+    First a pool of workers prepares each job on its own with `prepare`,
+    e.g. uploading its files. Then a single writer thread writes prepared
+    jobs in batches with `write_batch`, e.g. one insert_many for many jobs.
+
+    Each job has a status: {'status': 'pending'} until it is written, then
+    {'status': 'done'} or {'status': 'failed', 'error': message}. Statuses
+    of finished jobs are kept for the `max_finished` most recent ones.
+
+    Jobs only live in memory, so jobs pending when the process exits are
+    lost.
+
+    Attributes:
+        max_pending: Most jobs that may be pending at once.
+        batch_size: Most prepared jobs written together.
+        batch_seconds: Longest a prepared job waits for others to be
+            written with.
+        max_finished: Number of finished jobs to keep the status of.
+    """
+
+    def __init__(self, prepare, write_batch, workers=4, max_pending=256,
+                 batch_size=50, batch_seconds=0.05, max_finished=1024):
+        """Creates a queue, which starts its writer thread on first use.
+
+        Args:
+            prepare (callable): Takes a job and returns it prepared. Jobs
+                for which it raises fail.
+            write_batch (callable): Takes a list of prepared jobs and
+                returns a list with an error for each job that failed and
+                None for each that was written. Every job fails if it
+                raises.
+        """
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.max_finished = max_finished
+        self._prepare = prepare
+        self._write_batch = write_batch
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='ingest')
+        self._prepared = queue.Queue()  # (job_id, prepared job) pairs
+        self._pending = set()
+        self._finished = OrderedDict()  # job_id -> status
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._writer = None
+
+    def __len__(self):
+        """Number of pending jobs."""
+        return len(self._pending)
+
+    def submit(self, job_id, job):
+        """Accepts a job to run in the background.
+
+        Returns:
+            bool: False if too many jobs are pending, in which case the job
+                is not run.
+        """
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(job_id)
+            self._finished.pop(job_id, None)
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_prepared, daemon=True)
+                self._writer.start()
+        self._executor.submit(self._prepare_job, job_id, job)
+        return True
+
+    def status(self, job_id):
+        """Returns the status of a job, or None if it is not known."""
+        with self._lock:
+            if job_id in self._pending:
+                return {'status': 'pending'}
+            status = self._finished.get(job_id)
+            return None if status is None else dict(status)
+
+    def join(self, timeout=None):
+        """Waits until no jobs are pending.
+
+        Returns:
+            bool: False if jobs are still pending after timeout seconds.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+    def _prepare_job(self, job_id, job):
+        """Prepares a job and queues it to be written."""
+        try:
+            prepared = self._prepare(job)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning('Could not prepare job %s: %s', job_id, error)
+            self._finish(job_id, error)
+            return
+        self._prepared.put((job_id, prepared))
+
+    def _write_prepared(self):
+        """Writes prepared jobs in batches, forever."""
+        while True:
+            batch = [self._prepared.get()]
+            deadline = time.monotonic() + self.batch_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._prepared.get(
+                        timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                errors = self._write_batch([job for _, job in batch])
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning('Could not write %d jobs: %s', len(batch),
+                               error)
+                errors = [error] * len(batch)
+            for (job_id, _), error in zip(batch, errors):
+                self._finish(job_id, error)
+
+    def _finish(self, job_id, error):
+        """Records that a job was written, or failed if error isn't None."""
+        if error is None:
+            status = {'status': 'done'}
+        else:
+            status = {'status': 'failed', 'error': str(error)}
+        with self._lock:
+            self._pending.discard(job_id)
+            self._finished[job_id] = status
+            while len(self._finished) > self.max_finished:
+                self._finished.popitem(last=False)
+            if not self._pending:
+                self._idle.notify_all()
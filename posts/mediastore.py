@@ -0,0 +1,126 @@
+"""Backends storing the media files attached to posts."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import abc
+import os
+import shutil
+import tempfile
+from urllib.parse import urlsplit
+
+
+class MediaStore(abc.ABC):
+    """Interface of a place media files are stored and served from.
+
+    Files are identified by a name chosen by the caller, which must be a
+    plain file name without any directories.
+    """
+
+    @abc.abstractmethod
+    def put(self, file, name):
+        """Stores the contents of a file object under name.
+
+        The file is read in chunks, so it never has to fit in memory.
+        """
+
+    @abc.abstractmethod
+    def delete(self, name):
+        """Deletes the file stored under name."""
+
+    @abc.abstractmethod
+    def url(self, name):
+        """Returns the public URL of the file stored under name."""
+
+
+class GCSMediaStore(MediaStore):
+    """Stores media in a Google Cloud Storage bucket.
+
+    The bucket is only looked up on first use, so that the service can start
+    without reaching Google Cloud.
+    """
+
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        """The google.cloud.storage.Bucket the media is stored in."""
+        if self._bucket is None:
+            from google.cloud import storage  # pylint: disable=import-outside-toplevel
+            self._bucket = storage.Client().get_bucket(self.bucket_name)
+        return self._bucket
+
+    def put(self, file, name):
+        self.bucket.blob(name).upload_from_file(file)
+
+    def delete(self, name):
+        self.bucket.blob(name).delete()
+
+    def url(self, name):
+        return self.bucket.blob(name).public_url
+
+
+class LocalMediaStore(MediaStore):
+    """Stores media in a directory on local disk.
+
+    The service serves the files itself, from the URLs under `base_url`.
+
+    Attributes:
+        directory: Absolute path of the directory the files are stored in.
+        base_url: Absolute URL the file names are appended to. URLs are
+            linked from pages served by other services, so a path alone
+            would be resolved against those.
+
+    Raises:
+        ValueError: if base_url is not an absolute URL.
+    """
+
+    def __init__(self, directory, base_url):
+        parts = urlsplit(base_url)
+        if not parts.scheme or not parts.netloc:
+            raise ValueError(f'Media base URL {base_url!r} is not absolute.')
+        self.directory = os.path.abspath(directory)
+        self.base_url = base_url
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, name):
+        """Returns the path of the file stored under name.
+
+        Raises:
+            ValueError: if name is not a plain file name.
+        """
+        if not name or name.startswith('.') or os.path.basename(name) != name:
+            raise ValueError(f'Invalid media file name {name!r}.')
+        return os.path.join(self.directory, name)
+
+    def put(self, file, name):
+        path = self.path(name)
+        # write to a temporary file first so a partly written file is never
+        # served, then move it into place
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                shutil.copyfileobj(file, temp_file)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def delete(self, name):
+        os.remove(self.path(name))
+
+    def url(self, name):
+        return self.base_url + name
@@ -0,0 +1,108 @@
+"""Unit tests for making resized variants of images."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import threading
+import unittest
+import derivatives
+from derivatives import Image
+
+
+def make_image(size, mode='RGB', image_format='PNG', color='red'):
+    """Returns the contents of an image file of the given size."""
+    output = io.BytesIO()
+    Image.new(mode, size, color).save(output, image_format)
+    return output.getvalue()
+
+
+def image_info(data):
+    """Returns the (format, size, mode) of the image in data."""
+    with Image.open(io.BytesIO(data)) as image:
+        return image.format, image.size, image.mode
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class TestMakeVariants(unittest.TestCase):
+    """Test derivatives.make_variants()."""
+
+    def test_resize(self):
+        """Each variant fits its longest side, keeping the aspect ratio."""
+        variants = derivatives.make_variants(make_image((2560, 1280)))
+        self.assertEqual(set(variants), set(derivatives.VARIANTS))
+        self.assertEqual(image_info(variants['display']),
+                         ('WEBP', (1280, 640), 'RGB'))
+        self.assertEqual(image_info(variants['thumbnail']),
+                         ('WEBP', (320, 160), 'RGB'))
+
+    def test_jpeg(self):
+        """JPEGs are resized from a reduced decode."""
+        variants = derivatives.make_variants(
+            make_image((4000, 3000), image_format='JPEG'),
+            {'small': 100})
+        self.assertEqual(image_info(variants['small'])[1], (100, 75))
+
+    def test_no_enlarging(self):
+        """Small images are re-encoded at their own size."""
+        variants = derivatives.make_variants(make_image((200, 100)))
+        self.assertEqual(image_info(variants['display'])[1], (200, 100))
+        self.assertEqual(image_info(variants['thumbnail'])[1], (200, 100))
+
+    def test_transparency(self):
+        """Transparent images keep their alpha channel."""
+        variants = derivatives.make_variants(
+            make_image((50, 50), 'RGBA', color=(255, 0, 0, 128)))
+        self.assertEqual(image_info(variants['thumbnail'])[2], 'RGBA')
+        variants = derivatives.make_variants(make_image((50, 50), 'L'))
+        self.assertEqual(image_info(variants['thumbnail'])[2], 'RGB')
+
+    def test_not_an_image(self):
+        """Files that aren't images have no variants."""
+        self.assertIsNone(derivatives.make_variants(b'just some text'))
+        self.assertIsNone(derivatives.make_variants(
+            make_image((50, 50))[:40]))
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class TestResizePool(unittest.TestCase):
+    """Test derivatives.ResizePool."""
+
+    def test_lazy_workers(self):
+        """Workers are started on first use and make the same variants."""
+        pool = derivatives.ResizePool(workers=1)
+        self.addCleanup(pool.close)
+        self.assertIsNone(pool._pool)  # pylint: disable=protected-access
+        data = make_image((400, 200))
+        self.assertEqual(pool.make_variants(data, {'small': 100}),
+                         derivatives.make_variants(data, {'small': 100}))
+        pool.close()
+        self.assertIsNone(pool._pool)  # pylint: disable=protected-access
+
+
+class TestVariantExecutor(unittest.TestCase):
+    """Test derivatives.VariantExecutor."""
+
+    def test_max_pending(self):
+        """Tasks are refused while max_pending are queued or running."""
+        executor = derivatives.VariantExecutor(workers=1, max_pending=2)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+        tasks = [executor.submit(release.wait, 5) for _ in range(3)]
+        self.assertIsNone(tasks[2])
+        release.set()
+        for task in tasks[:2]:
+            self.assertTrue(task.result(timeout=5))
+        # slots are given back when tasks are done
+        self.assertEqual(executor.submit(sum, [1, 2]).result(timeout=5), 3)
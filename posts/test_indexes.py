@@ -0,0 +1,56 @@
+"""Unit tests for posts service index management."""
+
+# Authors: mukobi
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mongomock
+import pymongo
+import app
+
+
+class TestEnsureIndexes(unittest.TestCase):
+    """Test app.ensure_indexes()."""
+
+    def setUp(self):
+        """Create mock DB for testing."""
+        self.collection = mongomock.MongoClient().db.collection
+
+    def test_creates_missing_indexes(self):
+        """Declared indexes are created on an empty collection."""
+        report = app.ensure_indexes(self.collection)
+        declared = [index.document['name'] for index in app.INDEXES]
+        self.assertEqual(report['created'], declared)
+        for name in declared:
+            self.assertIn(name, self.collection.index_information())
+
+    def test_idempotent(self):
+        """Reconciling twice does no work the second time."""
+        app.ensure_indexes(self.collection)
+        report = app.ensure_indexes(self.collection)
+        self.assertEqual(report['created'], [])
+        self.assertEqual(report['rebuilt'], [])
+
+    def test_reports_undeclared_index(self):
+        """Indexes that are not declared are reported but not dropped."""
+        self.collection.create_index(
+            [('text', pymongo.ASCENDING)], name='extra')
+        report = app.ensure_indexes(self.collection)
+        self.assertEqual(report['undeclared'], ['extra'])
+        self.assertIn('extra', self.collection.index_information())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""Unit tests for the IngestQueue completing writes in the background."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+import ingestqueue
+
+
+class TestIngestQueue(unittest.TestCase):
+    """Test preparing and writing jobs with an IngestQueue."""
+
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+        self.queue = ingestqueue.IngestQueue(
+            self.prepare, self.write_batch, workers=2, max_pending=4,
+            batch_size=3, batch_seconds=0.05, max_finished=2)
+
+    def prepare(self, job):
+        """Prepares a job, failing for negative jobs."""
+        self.release.wait()
+        if job < 0:
+            raise ValueError('negative job')
+        return job * 10
+
+    def write_batch(self, jobs):
+        """Writes a batch, failing for prepared jobs of 30."""
+        self.batches.append(jobs)
+        return [ValueError('thirty') if job == 30 else None for job in jobs]
+
+    def test_batches(self):
+        """Prepared jobs are written together, at most batch_size at once."""
+        self.release.clear()  # so every job is prepared at about once
+        for job in range(1, 5):
+            self.assertTrue(self.queue.submit(job, job))
+        self.release.set()
+        self.assertTrue(self.queue.join(5))
+        self.assertCountEqual(sum(self.batches, []), [10, 20, 30, 40])
+        self.assertLess(len(self.batches), 4)
+        self.assertTrue(all(len(batch) <= 3 for batch in self.batches))
+
+    def test_statuses(self):
+        """Jobs are pending until written, then done or failed."""
+        self.release.clear()
+        self.queue.submit('a', -1)
+        self.queue.submit('b', 1)
+        self.queue.submit('c', 3)
+        self.assertEqual(self.queue.status('b'), {'status': 'pending'})
+        self.assertEqual(len(self.queue), 3)
+        self.release.set()
+        self.assertTrue(self.queue.join(5))
+        self.assertEqual(self.queue.status('b'), {'status': 'done'})
+        self.assertEqual(self.queue.status('c'),
+                         {'status': 'failed', 'error': 'thirty'})
+        # only the last max_finished statuses are kept, and 'a' failed first
+        self.assertIsNone(self.queue.status('a'))
+        self.assertIsNone(self.queue.status('d'))
+        self.assertEqual(len(self.queue), 0)
+
+    def test_failed_prepare(self):
+        """Jobs that can't be prepared fail without being written."""
+        self.queue.submit('a', -1)
+        self.assertTrue(self.queue.join(5))
+        self.assertEqual(self.queue.status('a'),
+                         {'status': 'failed', 'error': 'negative job'})
+        self.assertEqual(self.batches, [])
+
+    def test_max_pending(self):
+        """Jobs are refused while max_pending jobs are pending."""
+        self.release.clear()
+        for job in range(4):
+            self.assertTrue(self.queue.submit(job, job))
+        self.assertFalse(self.queue.submit(4, 4))
+        self.assertIsNone(self.queue.status(4))
+        self.release.set()
+        self.assertTrue(self.queue.join(5))
+        self.assertTrue(self.queue.submit(4, 4))
+        self.assertTrue(self.queue.join(5))
+
+    def test_failed_batch(self):
+        """Every job in a batch fails if writing it raises."""
+        self.queue = ingestqueue.IngestQueue(
+            self.prepare, lambda jobs: 1 / 0)
+        self.queue.submit('a', 1)
+        self.assertTrue(self.queue.join(5))
+        self.assertEqual(self.queue.status('a')['status'], 'failed')
@@ -0,0 +1,115 @@
+"""Unit tests for the media storage backends."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+import mediastore
+
+
+class TestLocalMediaStore(unittest.TestCase):
+    """Test storing media on local disk."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = mediastore.LocalMediaStore(
+            directory.name, 'http://posts/v1/media/')
+
+    def test_put(self):
+        """Files are written under their name, without temporary files."""
+        self.store.put(io.BytesIO(b'picture'), 'cat.jpg')
+        with open(self.store.path('cat.jpg'), 'rb') as file:
+            self.assertEqual(file.read(), b'picture')
+        self.assertEqual(os.listdir(self.store.directory), ['cat.jpg'])
+
+    def test_failed_put(self):
+        """Nothing is left behind if reading the file fails."""
+        file = mock.MagicMock()
+        file.read.side_effect = OSError('connection reset')
+        with self.assertRaises(OSError):
+            self.store.put(file, 'cat.jpg')
+        self.assertEqual(os.listdir(self.store.directory), [])
+
+    def test_delete(self):
+        """Deleted files are removed from disk."""
+        self.store.put(io.BytesIO(b'picture'), 'cat.jpg')
+        self.store.delete('cat.jpg')
+        self.assertFalse(os.path.exists(self.store.path('cat.jpg')))
+
+    def test_url(self):
+        """URLs are the file name under the base URL."""
+        self.assertEqual(self.store.url('cat.jpg'),
+                         'http://posts/v1/media/cat.jpg')
+
+    def test_relative_base_url(self):
+        """Base URLs must be absolute, as pages of other services link them."""
+        for base_url in ['/v1/media/', 'posts/v1/media/']:
+            with self.assertRaises(ValueError):
+                mediastore.LocalMediaStore(self.store.directory, base_url)
+
+    def test_invalid_names(self):
+        """Names can't point outside the directory or at hidden files."""
+        for name in ['', '../cat.jpg', 'a/cat.jpg', '.cat.jpg']:
+            with self.assertRaises(ValueError):
+                self.store.put(io.BytesIO(b'picture'), name)
+
+
+class TestMediaStore(unittest.TestCase):
+    """Test the MediaStore interface."""
+
+    def test_incomplete_store(self):
+        """Stores must implement every method to be created."""
+
+        # pylint: disable=abstract-method
+        class WriteOnlyStore(mediastore.MediaStore):
+            """Store missing delete() and url()."""
+
+            def put(self, file, name):
+                pass
+
+        with self.assertRaises(TypeError):
+            WriteOnlyStore()
+
+
+class TestGCSMediaStore(unittest.TestCase):
+    """Test storing media in a Google Cloud Storage bucket."""
+
+    def setUp(self):
+        self.store = mediastore.GCSMediaStore('bucket')
+        self.store._bucket = mock.MagicMock()  # pylint: disable=protected-access
+        self.blob = self.store.bucket.blob.return_value
+
+    def test_put(self):
+        """Files are streamed to a blob of the same name."""
+        file = io.BytesIO(b'picture')
+        self.store.put(file, 'cat.jpg')
+        self.store.bucket.blob.assert_called_with('cat.jpg')
+        self.blob.upload_from_file.assert_called_once_with(file)
+
+    def test_delete_and_url(self):
+        """Blobs are deleted and linked to by name."""
+        self.blob.public_url = 'https://storage/bucket/cat.jpg'
+        self.assertEqual(self.store.url('cat.jpg'),
+                         'https://storage/bucket/cat.jpg')
+        self.store.delete('cat.jpg')
+        self.blob.delete.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
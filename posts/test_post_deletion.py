@@ -15,7 +15,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 import unittest
+from unittest import mock
 import mongomock
 import app
 
@@ -63,13 +65,14 @@ class TestPostDeletion(unittest.TestCase):
         """Seed mock db."""
         self.collection = mongomock.MongoClient().db.collection
         self.collection.insert_many(FAKE_POSTS)
+        self.mock_store = mock.MagicMock()
 
     def test_delete_one(self):
         """Delete a single post."""
         post_id = FAKE_POSTS[0]['_id']
         author_id = FAKE_POSTS[0]['author_id']
         _, status_code = app.delete_post(
-            post_id, author_id, self.collection)
+            post_id, author_id, self.collection, self.mock_store)
         self.assertEqual(status_code, 204)
         self.assertEqual(
             self.collection.count_documents({}), len(FAKE_POSTS) - 1)
@@ -80,7 +83,7 @@ class TestPostDeletion(unittest.TestCase):
             post_id = post['_id']
             author_id = post['author_id']
             _, status_code = app.delete_post(
-                post_id, author_id, self.collection)
+                post_id, author_id, self.collection, self.mock_store)
             self.assertEqual(status_code, 204)
         self.assertEqual(self.collection.count_documents({}), 0)
 
@@ -89,7 +92,7 @@ class TestPostDeletion(unittest.TestCase):
         post_id = 'C0011C3DC0FFEED0000000DE'   # invalid
         author_id = FAKE_POSTS[0]['author_id']  # valid
         _, status_code = app.delete_post(
-            post_id, author_id, self.collection)
+            post_id, author_id, self.collection, self.mock_store)
         self.assertEqual(status_code, 404)
         self.assertEqual(self.collection.count_documents({}), len(FAKE_POSTS))
 
@@ -98,7 +101,7 @@ class TestPostDeletion(unittest.TestCase):
         post_id = FAKE_POSTS[0]['_id']                     # valid
         author_id = 'I do not think, therefore I am not.'  # invalid
         _, status_code = app.delete_post(
-            post_id, author_id, self.collection)
+            post_id, author_id, self.collection, self.mock_store)
         self.assertEqual(status_code, 404)
         self.assertEqual(self.collection.count_documents({}), len(FAKE_POSTS))
 
@@ -107,10 +110,29 @@ class TestPostDeletion(unittest.TestCase):
         post_id = FAKE_POSTS[0]['_id']          # valid
         author_id = FAKE_POSTS[1]['author_id']  # valid, but doesn't match
         _, status_code = app.delete_post(
-            post_id, author_id, self.collection)
+            post_id, author_id, self.collection, self.mock_store)
         self.assertEqual(status_code, 404)
         self.assertEqual(self.collection.count_documents({}), len(FAKE_POSTS))
 
+    def test_release_media(self):
+        """Media is deleted with the last post using it."""
+        files = [io.BytesIO(b'shared'), io.BytesIO(b'shared'),
+                 io.BytesIO(b'own')]
+        digests = [app.store_media(file, 'cat.jpg', self.collection,
+                                   self.mock_store)[0] for file in files]
+        self.collection.update_one({'_id': FAKE_POSTS[0]['_id']},
+                                   {'$set': {'media': digests[1:]}})
+        self.collection.update_one({'_id': FAKE_POSTS[1]['_id']},
+                                   {'$set': {'media': digests[:1]}})
+        names = [call[0][1] for call in self.mock_store.put.call_args_list]
+        app.delete_post(FAKE_POSTS[0]['_id'], FAKE_POSTS[0]['author_id'],
+                        self.collection, self.mock_store)
+        self.mock_store.delete.assert_called_once_with(names[1])
+        app.delete_post(FAKE_POSTS[1]['_id'], FAKE_POSTS[1]['author_id'],
+                        self.collection, self.mock_store)
+        self.mock_store.delete.assert_called_with(names[0])
+        self.assertEqual(self.mock_store.delete.call_count, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
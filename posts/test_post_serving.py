@@ -16,6 +16,10 @@
 # limitations under the License.
 
 import unittest
+from unittest import mock
+import datetime
+import json
+from bson import ObjectId, json_util
 import mongomock
 import app
 
@@ -56,6 +60,12 @@ FAKE_POSTS = [
 ]
 
 
+def newest_first(posts):
+    """Sorts posts in the order they are served, newest first."""
+    return sorted(posts, key=lambda post: (post['created_at'], post['_id']),
+                  reverse=True)
+
+
 class TestPostDBGetting(unittest.TestCase):
     """Test app.find_posts_in_db()."""
 
@@ -67,7 +77,7 @@ class TestPostDBGetting(unittest.TestCase):
     def test_find_all_posts(self):
         """Find all fake posts."""
         found = app.find_posts_in_db(self.collection)
-        self.assertEqual(found, FAKE_POSTS)
+        self.assertEqual(found, newest_first(FAKE_POSTS))
 
     def test_find_by_post_id(self):
         """Search for 1 post by post ID."""
@@ -80,7 +90,8 @@ class TestPostDBGetting(unittest.TestCase):
         """Search for many posts by event ID."""
         event_id = 'aquarium'
         found = app.find_posts_in_db(self.collection, event_id=event_id)
-        expected = [post for post in FAKE_POSTS if post['event_id'] is event_id]
+        expected = [post for post in newest_first(FAKE_POSTS)
+                    if post['event_id'] is event_id]
         self.assertEqual(found, expected)
 
     def test_missing_all_posts(self):
@@ -105,5 +116,39 @@ class TestPostDBGetting(unittest.TestCase):
         self.assertEqual(found, expected)
 
 
+class TestDumps(unittest.TestCase):
+    """Test app.dumps()."""
+
+    def setUp(self):
+        """Create a document with BSON types."""
+        self.document = {
+            '_id': ObjectId(),
+            'created_at': datetime.datetime(2019, 6, 11, 10, 33, 1),
+            'updated_at': datetime.datetime(2019, 6, 11, 10, 33, 1, 250000),
+            'names': ['a', 'b'],
+            'count': 2}
+
+    def test_matches_json_util(self):
+        """Output has the same extended JSON shape as bson.json_util."""
+        self.assertEqual(json.loads(app.dumps(self.document)),
+                         json.loads(json_util.dumps(self.document)))
+
+    def test_round_trip(self):
+        """Output can be loaded back into the original BSON types."""
+        self.assertEqual(json_util.loads(app.dumps(self.document)),
+                         self.document)
+
+    def test_without_orjson(self):
+        """Standard library fallback produces the same output."""
+        with mock.patch('app.orjson', None):
+            self.assertEqual(json.loads(app.dumps(self.document)),
+                             json.loads(json_util.dumps(self.document)))
+
+    def test_unserializable(self):
+        """Unknown types raise a TypeError."""
+        with self.assertRaises(TypeError):
+            app.dumps({'unknown': object()})
+
+
 if __name__ == '__main__':
     unittest.main()
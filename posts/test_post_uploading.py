@@ -19,20 +19,36 @@ import unittest
 from unittest import mock
 import datetime
 import collections
+import io
+import os
+import tempfile
+import threading
+import time
+from concurrent import futures
 import mongomock
+from werkzeug.datastructures import FileStorage
 import app
+import derivatives
+from mediastore import LocalMediaStore
+from test_derivatives import Image, make_image, image_info
 
 MOCK_FILE_URL = 'the url of an uploaded file'
 File = collections.namedtuple('File', 'filename')
-MOCK_FILE = File(filename='the name of a file')
+
+
+def make_file(contents=b'the contents of a file', mimetype='text/plain'):
+    """Returns an uploaded file, as found in request.files."""
+    return FileStorage(io.BytesIO(contents), 'the name of a file',
+                       content_type=mimetype)
+
 
 VALID_POST_FULL = {
     'event_id': 'abc123',
     'author_id': 'jrr_tolkien',
     'text': 'This is a very valid post with text and files.',
     'files': [
-        MOCK_FILE,
-        MOCK_FILE
+        make_file(),
+        make_file()
     ]}
 VALID_POST_TEXT_NO_FILES = {
     'event_id': 'abc123',
@@ -44,7 +60,7 @@ VALID_POST_FILES_NO_TEXT = {
     'author_id': 'No text is alright if I have files.',
     'text': '',
     'files': [
-        MOCK_FILE
+        make_file()
     ]}
 INVALID_POST_NO_TEXT_NOR_FILES = {
     'event_id': 'abc123',
@@ -79,16 +95,15 @@ class TestPostUploading(unittest.TestCase):
         """Set up mocks for testing."""
         # mock db
         self.mock_collection = mongomock.MongoClient().db.collection
-        # mock Google Cloud Storage bucket for file uploading
-        patcher = mock.patch('app.CLOUD_STORAGE_BUCKET')
-        self.mock_bucket = patcher.start()
-        self.addCleanup(patcher.stop)
-        self.mock_bucket.blob().public_url = MOCK_FILE_URL
+        # mock media store for file uploading
+        self.mock_store = mock.MagicMock()
+        self.mock_store.url.return_value = MOCK_FILE_URL
 
     def test_full_upload(self):
         """Can upload a full post object with both text and files."""
-        app.upload_new_post_to_db(VALID_POST_FULL, self.mock_collection)
-        self.mock_bucket.blob().upload_from_file.assert_called()
+        app.upload_new_post_to_db(
+            VALID_POST_FULL, self.mock_collection, self.mock_store)
+        self.mock_store.put.assert_called()
         post_in_db = self.mock_collection.find_one({})
         self.assertIsNotNone(post_in_db)
         self.assert_posts_are_equal(VALID_POST_FULL, post_in_db)
@@ -96,9 +111,9 @@ class TestPostUploading(unittest.TestCase):
     def test_partial_upload_no_files(self):
         """Can upload a post with text but no files."""
         app.upload_new_post_to_db(
-            VALID_POST_TEXT_NO_FILES, self.mock_collection)
-        # no files to upload to bucket
-        self.mock_bucket.blob().upload_from_file.assert_not_called()
+            VALID_POST_TEXT_NO_FILES, self.mock_collection, self.mock_store)
+        # no files to upload to store
+        self.mock_store.put.assert_not_called()
         post_in_db = self.mock_collection.find_one({})
         self.assertIsNotNone(post_in_db)
         self.assert_posts_are_equal(VALID_POST_TEXT_NO_FILES, post_in_db)
@@ -106,8 +121,8 @@ class TestPostUploading(unittest.TestCase):
     def test_partial_upload_no_text(self):
         """Can upload a post with files but no text."""
         app.upload_new_post_to_db(
-            VALID_POST_FILES_NO_TEXT, self.mock_collection)
-        self.mock_bucket.blob().upload_from_file.assert_called()
+            VALID_POST_FILES_NO_TEXT, self.mock_collection, self.mock_store)
+        self.mock_store.put.assert_called()
         post_in_db = self.mock_collection.find_one({})
         self.assertIsNotNone(post_in_db)
         self.assert_posts_are_equal(VALID_POST_FILES_NO_TEXT, post_in_db)
@@ -116,7 +131,7 @@ class TestPostUploading(unittest.TestCase):
         """Cannot upload a post without text and files."""
         with self.assertRaises(ValueError):
             app.upload_new_post_to_db(
-                INVALID_POST_NO_TEXT_NOR_FILES, self.mock_collection)
+                INVALID_POST_NO_TEXT_NOR_FILES, self.mock_collection, self.mock_store)
         # no posts were uploaded
         self.assertIsNone(self.mock_collection.find_one({}))
 
@@ -124,7 +139,7 @@ class TestPostUploading(unittest.TestCase):
         """Cannot upload a post missing required post attributes."""
         with self.assertRaises(AttributeError):
             app.upload_new_post_to_db(
-                INVALID_POST_NOT_ENOUGH_ATTRS, self.mock_collection)
+                INVALID_POST_NOT_ENOUGH_ATTRS, self.mock_collection, self.mock_store)
         # no posts were uploaded
         self.assertIsNone(self.mock_collection.find_one({}))
 
@@ -132,7 +147,7 @@ class TestPostUploading(unittest.TestCase):
         """Cannot upload a post with too many attributes."""
         with self.assertRaises(AttributeError):
             app.upload_new_post_to_db(
-                INVALD_POST_TOO_MANY_ATTRS, self.mock_collection)
+                INVALD_POST_TOO_MANY_ATTRS, self.mock_collection, self.mock_store)
         # no posts were uploaded
         self.assertIsNone(self.mock_collection.find_one({}))
 
@@ -147,7 +162,260 @@ class TestGenerateTimestamp(unittest.TestCase):
         mock_datetime.datetime.utcnow.return_value = test_time
         with mock.patch('app.datetime', mock_datetime):
             self.assertEqual(app.generate_timestamp(),
-                             test_time.isoformat(sep=' ', timespec='seconds'))
+                             test_time.replace(microsecond=0))
+
+
+class TestTimes(unittest.TestCase):
+    """Test parsing and migrating post times."""
+
+    def test_parse_time(self):
+        """ISO 8601 times are parsed into naive UTC datetimes."""
+        expected = datetime.datetime(2019, 6, 11, 10, 33)
+        for time_string in ['2019-06-11 10:33', '2019-06-11T10:33:00Z',
+                            '2019-06-11T12:33:00+02:00',
+                            '2019-06-11T09:03:00.000-01:30']:
+            self.assertEqual(app.parse_time(time_string), expected)
+
+    def test_parse_bad_time(self):
+        """Times that aren't ISO 8601 raise a ValueError."""
+        for time_string in ['2019-06-11T25:00', '7-30-2019', '', None]:
+            with self.assertRaises(ValueError):
+                app.parse_time(time_string)
+
+    def test_migrate_string_times(self):
+        """String times are converted and unparseable ones left alone."""
+        coll = mongomock.MongoClient().db.collection
+        coll.insert_many([
+            {'text': 'old', 'created_at': '2019-06-11 10:33:01'},
+            {'text': 'broken', 'created_at': 'sometime'},
+            {'text': 'new', 'created_at': datetime.datetime(2019, 6, 11)}])
+        report = app.migrate_string_times(coll)
+        self.assertEqual(report, {'converted': 1, 'unparseable': 1})
+        self.assertEqual(coll.find_one({'text': 'old'})['created_at'],
+                         datetime.datetime(2019, 6, 11, 10, 33, 1))
+        self.assertEqual(app.migrate_string_times(coll)['converted'], 0)
+
+
+class TestUploadFiles(unittest.TestCase):
+    """Test app.upload_files_to_store()."""
+
+    def setUp(self):
+        """Mock storing single files, slower for earlier files."""
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+        self.uploaded = []
+        self.collection = mongomock.MongoClient().db.collection
+        self.mock_store = mock.MagicMock()
+        patcher = mock.patch('app.store_media', side_effect=self.store_media)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def store_media(self, file, filename, collection, store):
+        """Mocks storing a file named by its number."""
+        self.assertEqual(file.filename, filename)
+        self.assertIs(collection, self.collection)
+        self.assertIs(store, self.mock_store)
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(0.01 * (10 - int(filename)))
+        with self.lock:
+            self.running -= 1
+        if filename == '5':
+            raise ConnectionError('upload failed')
+        with self.lock:
+            self.uploaded.append(filename)
+        return f'digest {filename}', f'name {filename}'
+
+    def upload_files(self, numbers):
+        """Uploads files named by the numbers."""
+        return app.upload_files_to_store(
+            [File(filename=str(number)) for number in numbers],
+            self.collection, self.mock_store)
+
+    def test_ordered_results(self):
+        """Stored files are returned in the order of the files."""
+        numbers = [1, 2, 3, 4, 6, 7]
+        self.assertEqual(self.upload_files(numbers),
+                         [(f'digest {number}', f'name {number}')
+                          for number in numbers])
+
+    def test_per_post_limit(self):
+        """No more than MAX_UPLOADS_PER_POST files are uploaded at once."""
+        self.upload_files([1, 2, 3, 4, 6, 7])
+        self.assertEqual(self.most_running, app.MAX_UPLOADS_PER_POST)
+
+    def test_no_files(self):
+        """Nothing is uploaded for a post without files."""
+        self.assertEqual(self.upload_files([]), [])
+
+    def test_failed_upload(self):
+        """Stored files are released if any upload fails."""
+        with mock.patch('app.release_media') as mock_release:
+            with self.assertRaises(ConnectionError):
+                self.upload_files([1, 5, 2, 3, 4, 6])
+        self.assertTrue(self.uploaded)
+        digests, collection, store = mock_release.call_args[0]
+        self.assertCountEqual(
+            digests, [f'digest {name}' for name in self.uploaded])
+        self.assertIs(collection, self.collection)
+        self.assertIs(store, self.mock_store)
+
+
+class TestStoreMedia(unittest.TestCase):
+    """Test storing media by content with app.store_media()."""
+
+    def setUp(self):
+        """Set up a mock DB and media store."""
+        self.collection = mongomock.MongoClient().db.collection
+        self.blobs = self.collection.database[app.MEDIA_BLOBS_COLLECTION]
+        self.mock_store = mock.MagicMock()
+
+    def store(self, contents):
+        """Stores a file with the contents."""
+        return app.store_media(make_file(contents), 'cat.jpg',
+                               self.collection, self.mock_store)
+
+    def test_same_content(self):
+        """Files with the same content are stored once."""
+        first_digest, first_name = self.store(b'cat')
+        second_digest, second_name = self.store(b'cat')
+        self.assertEqual(first_digest, second_digest)
+        self.assertEqual(first_name, second_name)
+        self.assertTrue(first_name.endswith('-cat.jpg'))
+        self.mock_store.put.assert_called_once()
+        self.assertEqual(self.blobs.find_one({'_id': first_digest})['refs'], 2)
+
+    def test_different_content(self):
+        """Files with different contents are stored separately."""
+        first_digest, first_name = self.store(b'cat')
+        second_digest, second_name = self.store(b'dog')
+        self.assertNotEqual(first_digest, second_digest)
+        self.assertNotEqual(first_name, second_name)
+        self.assertEqual(self.mock_store.put.call_count, 2)
+
+    def test_streamed_file(self):
+        """The whole file is uploaded after hashing it."""
+        self.mock_store.put.side_effect = \
+            lambda file, name: self.assertEqual(file.read(), b'cat')
+        self.store(b'cat')
+        self.mock_store.put.assert_called_once()
+
+    def test_release(self):
+        """Files are deleted when the last reference is released."""
+        digest, name = self.store(b'cat')
+        self.store(b'cat')
+        app.release_media([digest], self.collection, self.mock_store)
+        self.mock_store.delete.assert_not_called()
+        app.release_media([digest], self.collection, self.mock_store)
+        self.mock_store.delete.assert_called_once_with(name)
+        self.assertIsNone(self.blobs.find_one({'_id': digest}))
+        # stored anew afterwards
+        self.store(b'cat')
+        self.assertEqual(self.mock_store.put.call_count, 2)
+
+    def test_concurrent_upload(self):
+        """A file stored by another upload meanwhile is used instead."""
+        digest, name = self.store(b'cat')
+        # as if the file was released but not yet deleted
+        self.blobs.update_one({'_id': digest}, {'$set': {'refs': 0}})
+        second_digest, second_name = self.store(b'cat')
+        self.assertEqual((second_digest, second_name), (digest, name))
+        uploaded_name = self.mock_store.put.call_args[0][1]
+        self.mock_store.delete.assert_called_once_with(uploaded_name)
+        self.assertEqual(self.blobs.find_one({'_id': digest})['refs'], 1)
+
+    def test_failed_insert(self):
+        """Media of a post that can't be inserted is released."""
+        post = {'event_id': 'abc123', 'author_id': 'jrr_tolkien', 'text': '',
+                'files': [make_file(b'cat')]}
+        error = app.pymongo.errors.AutoReconnect('connection lost')
+        with mock.patch.object(self.collection, 'insert_one',
+                               side_effect=error):
+            with self.assertRaises(app.pymongo.errors.AutoReconnect):
+                app.upload_new_post_to_db(post, self.collection,
+                                          self.mock_store)
+        self.assertEqual(self.blobs.count_documents({}), 0)
+        self.mock_store.delete.assert_called_once_with(
+            self.mock_store.put.call_args[0][1])
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class TestCreateVariants(unittest.TestCase):
+    """Test making resized variants of the images of posts."""
+
+    def setUp(self):
+        """Set up a post, a media store on disk and in-process resizing."""
+        self.collection = mongomock.MongoClient().db.collection
+        self.post_id = self.collection.insert_one(
+            {'files': ['a.png', 'b.png'], 'variants': [None, None]}
+        ).inserted_id
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = LocalMediaStore(directory.name,
+                                     'http://localhost/v1/media/')
+        resize_pool = mock.Mock(make_variants=derivatives.make_variants)
+        patcher = mock.patch('app.RESIZE_POOL', resize_pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_variants(self, data):
+        """Creates variants of data as the post's second file."""
+        app.create_variants(
+            self.post_id, 1, data, self.collection, self.store)
+
+    def test_image(self):
+        """Variants of images are stored and linked from the post."""
+        self.create_variants(make_image((2000, 1000)))
+        variants = self.collection.find_one()['variants']
+        self.assertIsNone(variants[0])
+        self.assertEqual(set(variants[1]), {'thumbnail', 'display'})
+        url = variants[1]['thumbnail']
+        self.assertTrue(url.startswith(self.store.base_url))
+        name = url[len(self.store.base_url):]
+        with open(self.store.path(name), 'rb') as file:
+            self.assertEqual(image_info(file.read())[:2],
+                             ('WEBP', (320, 160)))
+
+    def test_not_an_image(self):
+        """Files Pillow can't read are left without variants."""
+        self.create_variants(b'not an image')
+        self.assertEqual(self.collection.find_one()['variants'], [None, None])
+        self.assertEqual(os.listdir(self.store.directory), [])
+
+    def test_deleted_post(self):
+        """Variants of posts deleted while resizing are deleted again."""
+        self.collection.delete_many({})
+        self.create_variants(make_image((100, 100)))
+        self.assertEqual(os.listdir(self.store.directory), [])
+
+    def test_shared_variants(self):
+        """Variants of the same image are stored once."""
+        self.create_variants(make_image((1000, 500)))
+        self.create_variants(make_image((1000, 500)))
+        post = self.collection.find_one()
+        self.assertEqual(len(post['media']), 4)
+        self.assertEqual(len(set(post['media'])), 2)
+        self.assertEqual(len(os.listdir(self.store.directory)), 2)
+
+    def test_upload(self):
+        """Variants are made in the background for images of new posts."""
+        variant_executor = futures.ThreadPoolExecutor(max_workers=1)
+        post = {
+            'event_id': 'abc123', 'author_id': 'jrr_tolkien', 'text': '',
+            'files': [
+                FileStorage(io.BytesIO(b'notes'), 'notes.txt',
+                            content_type='text/plain'),
+                FileStorage(io.BytesIO(make_image((100, 100))), 'cat.png',
+                            content_type='image/png')]}
+        with mock.patch('app.VARIANT_EXECUTOR', variant_executor):
+            post_id = app.upload_new_post_to_db(
+                post, self.collection, self.store)
+        variant_executor.shutdown()  # waits for the variants
+        variants = self.collection.find_one({'_id': post_id})['variants']
+        self.assertIsNone(variants[0])
+        self.assertEqual(set(variants[1]), {'thumbnail', 'display'})
 
 
 if __name__ == '__main__':
@@ -15,12 +15,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import unittest
 from unittest import mock
 import io
+import os
 import collections
+import tempfile
 from bson import ObjectId, json_util
 import mongomock
+import app as app_module
 from app import app
 
 MOCK_FILE_URL = 'the url of an uploaded file'
@@ -136,6 +140,15 @@ class TestDeletePostByPostIDRoute(unittest.TestCase):
         self.assertEqual(app.config['COLLECTION'].count_documents({}),
                          len(self.mock_posts))
 
+    def test_delete_changes_etag(self):
+        """Deleting a post changes the ETag of post lists."""
+        etag = self.client.get('/v1/').headers['ETag']
+        post_id = self.mock_posts[0]['_id']
+        author_id = self.mock_posts[0]['author_id']
+        self.client.delete(
+            f'/v1/{str(post_id)}', data={'author_id': author_id})
+        self.assertNotEqual(self.client.get('/v1/').headers['ETag'], etag)
+
     def test_no_author_id(self):
         """No author_id, don't delete."""
         post_id = self.mock_posts[0]['_id']          # valid
@@ -146,6 +159,52 @@ class TestDeletePostByPostIDRoute(unittest.TestCase):
                          len(self.mock_posts))
 
 
+class TestStreamChangesRoute(unittest.TestCase):
+    """Test streaming changes at endpoint GET /v1/stream."""
+
+    def setUp(self):
+        """Set up test client and mock DB for testing."""
+        app.config['COLLECTION'] = mongomock.MongoClient().db.collection
+        app.config['TESTING'] = True  # propagate exceptions to test client
+        self.client = app.test_client()
+
+    @mock.patch('app.STREAM_MAX_SECONDS', 0.2)
+    def test_stream_added_and_deleted_posts(self):
+        """Posts added and deleted while streaming are sent as SSE messages."""
+        response = self.client.get('/v1/stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        post_id = app_module.upload_new_post_to_db(
+            {'event_id': 'foo', 'author_id': 'ray_bradbury',
+             'text': 'hello', 'files': []},
+            app.config['COLLECTION'], mock.MagicMock())
+        self.client.delete(
+            f'/v1/{str(post_id)}', data={'author_id': 'ray_bradbury'})
+        messages = response.get_data().split(b'\n\n')
+        response.close()
+        self.assertEqual(len(app_module.CHANGE_FEED), 0)
+
+        changes = [message.split(b'\n') for message in messages
+                   if message.startswith(b'event: ')]
+        self.assertEqual([event_line for event_line, _ in changes],
+                         [b'event: insert', b'event: delete'])
+        inserted = json_util.loads(changes[0][1][len(b'data: '):])
+        self.assertEqual(inserted['document']['text'], 'hello')
+        deleted = json_util.loads(changes[1][1][len(b'data: '):])
+        self.assertEqual(deleted, {'operation': 'delete', '_id': post_id})
+
+    def test_too_many_subscribers(self):
+        """Clients past MAX_STREAM_SUBSCRIBERS are turned away."""
+        subscriptions = [app_module.CHANGE_FEED.subscribe()
+                         for _ in range(app_module.MAX_STREAM_SUBSCRIBERS)]
+        try:
+            response = self.client.get('/v1/stream')
+            self.assertEqual(response.status_code, 503)
+        finally:
+            for subscription in subscriptions:
+                subscription.close()
+
+
 class TestGetAllPostsRoute(unittest.TestCase):
     """Test get all posts endpoint GET /v1/."""
 
@@ -185,6 +244,148 @@ class TestGetAllPostsRoute(unittest.TestCase):
         self.assertEqual(data['num_posts'], num_expected_posts)
         self.assertEqual(len(data['posts']), num_expected_posts)
 
+    def test_stream_ndjson(self):
+        """Stream all posts as newline-delimited JSON."""
+        mock_posts = [
+            {'event_id': 'foo', 'author_id': 'ray_bradbury',
+             'text': VALID_DB_POST_TEXT_NO_FILES['text'], 'files': []}
+            for _ in range(2)]
+        app.config['COLLECTION'].insert_many(mock_posts)
+        result = self.client.get(
+            '/v1/', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.mimetype, 'application/x-ndjson')
+        lines = result.data.splitlines()
+        self.assertEqual(len(lines), len(mock_posts))
+        for line in lines:
+            self.assertEqual(json_util.loads(line)['text'],
+                             VALID_DB_POST_TEXT_NO_FILES['text'])
+
+    def test_conditional_get(self):
+        """Revalidate the post list with its ETag."""
+        result = self.client.get('/v1/')
+        etag = result.headers['ETag']
+        result = self.client.get('/v1/', headers={'If-None-Match': etag})
+        self.assertEqual(result.status_code, 304)
+        result = self.client.get('/v1/',
+                                 headers={'If-None-Match': 'W/' + etag})
+        self.assertEqual(result.status_code, 304)
+        # adding a post changes the ETag
+        app.config['COLLECTION'].insert_one({'text': 'new post'})
+        app_module.bump_collection_version(app.config['COLLECTION'])
+        result = self.client.get('/v1/', headers={'If-None-Match': etag})
+        self.assertEqual(result.status_code, 200)
+        self.assertNotEqual(result.headers['ETag'], etag)
+
+    def test_conditional_get_ndjson(self):
+        """JSON and NDJSON post lists have different ETags."""
+        etag = self.client.get('/v1/').headers['ETag']
+        result = self.client.get('/v1/', headers={
+            'Accept': 'application/x-ndjson', 'If-None-Match': etag})
+        self.assertEqual(result.status_code, 200)
+        self.assertNotEqual(result.headers['ETag'], etag)
+
+    def test_time_range(self):
+        """Only get posts created within the from and to times."""
+        app.config['COLLECTION'].insert_many([
+            {'text': f'post {hour}',
+             'created_at': datetime.datetime(2019, 6, 11, hour)}
+            for hour in range(8, 12)])
+        result = self.client.get(
+            '/v1/?from=2019-06-11T09:00:00Z&to=2019-06-11T11:00:00Z')
+        self.assertEqual(result.status_code, 200)
+        data = json_util.loads(result.data)
+        self.assertEqual([post['text'] for post in data['posts']],
+                         ['post 10', 'post 9'])
+
+    def test_fields(self):
+        """Only get the requested fields of each post."""
+        app.config['COLLECTION'].insert_many([
+            {'event_id': 'foo', 'author_id': 'ray_bradbury',
+             'text': 'a post', 'files': []} for _ in range(2)])
+        result = self.client.get('/v1/?fields=author_id')
+        self.assertEqual(result.status_code, 200)
+        data = json_util.loads(result.data)
+        self.assertEqual([sorted(post) for post in data['posts']],
+                         [['_id', 'author_id'], ['_id', 'author_id']])
+        result = self.client.get('/v1/?fields=password')
+        self.assertEqual(result.status_code, 400)
+
+    def test_bad_time_range(self):
+        """Malformatted from or to times are rejected."""
+        result = self.client.get('/v1/?from=yesterday')
+        self.assertEqual(result.status_code, 400)
+
+    def test_pages(self):
+        """Page through posts newest first with limit and before."""
+        app.config['COLLECTION'].delete_many({})
+        created_at = datetime.datetime(2019, 6, 11, 9)
+        # two posts share a creation time so the _id breaks the tie
+        app.config['COLLECTION'].insert_many(
+            [{'text': f'post {hour}',
+              'created_at': datetime.datetime(2019, 6, 11, hour)}
+             for hour in range(8, 12)]
+            + [{'text': 'post 9b', 'created_at': created_at}])
+        pages = []
+        url = '/v1/?limit=2'
+        while url:
+            result = self.client.get(url)
+            self.assertEqual(result.status_code, 200)
+            data = json_util.loads(result.data)
+            pages.append([post['text'] for post in data['posts']])
+            cursor = data['next_cursor']
+            url = cursor and f'/v1/?limit=2&before={cursor}'
+        self.assertEqual(pages, [['post 11', 'post 10'],
+                                 ['post 9b', 'post 9'],
+                                 ['post 8']])
+
+    def test_pages_with_fields(self):
+        """Pages of only some fields still have cursors."""
+        app.config['COLLECTION'].delete_many({})
+        app.config['COLLECTION'].insert_many(
+            [{'text': f'post {hour}',
+              'created_at': datetime.datetime(2019, 6, 11, hour)}
+             for hour in range(8, 11)])
+        result = self.client.get('/v1/?limit=2&fields=text')
+        self.assertEqual(result.status_code, 200)
+        data = json_util.loads(result.data)
+        self.assertEqual([post['text'] for post in data['posts']],
+                         ['post 10', 'post 9'])
+        result = self.client.get(
+            f'/v1/?limit=2&fields=text&before={data["next_cursor"]}')
+        data = json_util.loads(result.data)
+        self.assertEqual([post['text'] for post in data['posts']],
+                         ['post 8'])
+
+    def test_pages_with_string_times(self):
+        """Legacy posts with string times are paged once migrated."""
+        app.config['COLLECTION'].delete_many({})
+        app.config['COLLECTION'].insert_many(
+            [{'text': f'post {hour}', 'created_at': f'2019-06-11 {hour:02}:00'}
+             for hour in range(8, 11)])
+        result = self.client.get('/v1/?limit=2')
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(
+            json_util.loads(result.data)['next_cursor'].startswith(
+                '2019-06-11T09:00:00_'))
+
+        app_module.migrate_string_times(app.config['COLLECTION'])
+        pages = []
+        url = '/v1/?limit=2'
+        while url:
+            data = json_util.loads(self.client.get(url).data)
+            pages.append([post['text'] for post in data['posts']])
+            url = data['next_cursor'] and (
+                f'/v1/?limit=2&before={data["next_cursor"]}')
+        self.assertEqual(pages, [['post 10', 'post 9'], ['post 8']])
+
+    def test_bad_page_args(self):
+        """Malformatted limits and cursors are rejected."""
+        for query in ['limit=0', 'limit=many', 'limit=1001',
+                      'before=yesterday', 'before=2019-06-11T09:00:00_1']:
+            result = self.client.get(f'/v1/?{query}')
+            self.assertEqual(result.status_code, 400, query)
+
 
 class TestGetPostByEventIDRoute(unittest.TestCase):
     """Test get post by event  endpoint GET /v1/by_event/<event_id>."""
@@ -213,8 +414,9 @@ class TestGetPostByEventIDRoute(unittest.TestCase):
     def test_yes_post_found(self):
         """Find multiple posts by event ID."""
         event_id = self.mock_posts[0]['event_id']
-        expected_posts = [
-            post for post in self.mock_posts if post['event_id'] is event_id]
+        # newest first, the posts having been inserted in order
+        expected_posts = [post for post in reversed(self.mock_posts)
+                          if post['event_id'] is event_id]
         num_expected_posts = len(expected_posts)
         result = self.client.get(f'/v1/by_event/{str(event_id)}')
         self.assertEqual(result.status_code, 200)
@@ -224,6 +426,19 @@ class TestGetPostByEventIDRoute(unittest.TestCase):
         self.assertEqual(data['posts'], expected_posts)
 
 
+    def test_stream_ndjson(self):
+        """Stream posts for an event as newline-delimited JSON."""
+        event_id = VALID_DB_POST_FILES_NO_TEXT['event_id']
+        result = self.client.get(
+            f'/v1/by_event/{event_id}',
+            headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.mimetype, 'application/x-ndjson')
+        lines = result.data.splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json_util.loads(lines[0])['event_id'], event_id)
+
+
 class TestGetPostByPostIDRoute(unittest.TestCase):
     """Test get post by post ID endpoint GET /v1/<post_id>."""
 
@@ -260,6 +475,47 @@ class TestGetPostByPostIDRoute(unittest.TestCase):
         self.assertEqual(data['posts'][0]['_id'], post_id)
 
 
+class TestGetMediaRoute(unittest.TestCase):
+    """Test serving media files at GET /v1/media/<name>."""
+
+    def setUp(self):
+        """Set up test client and a media store on local disk."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        app.config['MEDIA_STORE'] = app_module.LocalMediaStore(
+            directory.name, 'http://localhost/v1/media/')
+        app.config['TESTING'] = True  # propagate exceptions to test client
+        self.client = app.test_client()
+
+    def test_upload_and_serve(self):
+        """Uploaded files are served from their URL."""
+        app.config['COLLECTION'] = mongomock.MongoClient().db.collection
+        data = dict(VALID_REQUEST_TEXT_NO_FILES,
+                    file=(io.BytesIO(b'picture'), '../cat.txt'))
+        result = self.client.post('/v1/add', data=data,
+                                  content_type='multipart/form-data')
+        self.assertEqual(result.status_code, 201)
+        post = app.config['COLLECTION'].find_one({})
+        url, = post['files']
+        self.assertTrue(url.startswith('http://localhost/v1/media/'))
+        self.assertTrue(url.endswith('-cat.txt'))
+        result = self.client.get(url)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.data, b'picture')
+        result.close()
+
+    def test_missing_file(self):
+        """Files that were never uploaded are not found."""
+        result = self.client.get('/v1/media/missing.jpg')
+        self.assertEqual(result.status_code, 404)
+
+    def test_not_local(self):
+        """Media stored elsewhere is not served by the service."""
+        app.config['MEDIA_STORE'] = mock.MagicMock()
+        result = self.client.get('/v1/media/cat.jpg')
+        self.assertEqual(result.status_code, 404)
+
+
 class TestUploadNewPostRoute(unittest.TestCase):
     """Test upload new post endpoint POST /v1/add."""
 
@@ -268,11 +524,13 @@ class TestUploadNewPostRoute(unittest.TestCase):
         app.config['COLLECTION'] = mongomock.MongoClient().db.collection
         app.config['TESTING'] = True  # propagate exceptions to test client
         self.client = app.test_client()
-        # mock Google Cloud Storage bucket for file uploading
-        patcher = mock.patch('app.CLOUD_STORAGE_BUCKET')
-        self.mock_bucket = patcher.start()
+        # mock media store for file uploading
+        app.config['MEDIA_STORE'] = mock.MagicMock()
+        app.config['MEDIA_STORE'].url.return_value = MOCK_FILE_URL
+        # variants of images are tested in test_post_uploading
+        patcher = mock.patch('app.VARIANT_EXECUTOR')
+        patcher.start()
         self.addCleanup(patcher.stop)
-        self.mock_bucket.blob().public_url = MOCK_FILE_URL
 
     def assert_count_in_collection(self, query, target_count):
         """Assert the count of a given object in the database."""
@@ -320,5 +578,102 @@ class TestUploadNewPostRoute(unittest.TestCase):
         self.assert_count_in_collection({}, 0)
 
 
+
+class TestUploadNewPostAsyncRoute(unittest.TestCase):
+    """Test accepting posts at POST /v1/add with `Prefer: respond-async`."""
+
+    def setUp(self):
+        """Set up test client, mock DB and media store and spool directory."""
+        app.config['COLLECTION'] = mongomock.MongoClient().db.collection
+        app.config['TESTING'] = True  # propagate exceptions to test client
+        self.client = app.test_client()
+        app.config['MEDIA_STORE'] = mock.MagicMock()
+        app.config['MEDIA_STORE'].url.return_value = MOCK_FILE_URL
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spool_directory = directory.name
+        for name, value in [('app.SPOOL_DIRECTORY', directory.name),
+                            ('app.VARIANT_EXECUTOR', mock.MagicMock())]:
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, data):
+        """Posts data asynchronously."""
+        return self.client.post(
+            '/v1/add', data=data, content_type='multipart/form-data',
+            headers={'Prefer': 'respond-async'})
+
+    def test_accept(self):
+        """Posts are accepted, then inserted in the background."""
+        data = dict(VALID_REQUEST_TEXT_NO_FILES,
+                    file_1=(io.BytesIO(b'first file'), 'file_1.txt'),
+                    file_2=(io.BytesIO(b'second file'), 'file_2.txt'))
+        result = self.post(data)
+        self.assertEqual(result.status_code, 202)
+        self.assertEqual(result.headers['Preference-Applied'], 'respond-async')
+        post_id = result.data.decode()
+        self.assertTrue(result.headers['Location'].endswith(
+            f'/v1/pending/{post_id}'))
+        self.assertTrue(app_module.INGEST_QUEUE.join(5))
+        result = self.client.get(f'/v1/pending/{post_id}')
+        self.assertEqual(json_util.loads(result.data), {'status': 'done'})
+        self.assertTrue(result.headers['Location'].endswith(f'/v1/{post_id}'))
+        post = app.config['COLLECTION'].find_one({'_id': ObjectId(post_id)})
+        self.assertEqual(post['text'], VALID_REQUEST_TEXT_NO_FILES['text'])
+        self.assertEqual(post['files'], [MOCK_FILE_URL, MOCK_FILE_URL])
+        self.assertEqual(len(post['media']), 2)
+        # spooled files are uploaded in full, then removed
+        uploads = [call[0][0]
+                   for call in app.config['MEDIA_STORE'].put.call_args_list]
+        self.assertCountEqual([file.filename for file in uploads],
+                              ['file_1.txt', 'file_2.txt'])
+        self.assertEqual(os.listdir(self.spool_directory), [])
+
+    def test_failed_upload(self):
+        """Posts whose files can't be uploaded fail."""
+        app.config['MEDIA_STORE'].put.side_effect = ConnectionError('down')
+        data = dict(VALID_REQUEST_TEXT_NO_FILES,
+                    file_1=(io.BytesIO(b'first file'), 'file_1.txt'))
+        post_id = self.post(data).data.decode()
+        self.assertTrue(app_module.INGEST_QUEUE.join(5))
+        result = self.client.get(f'/v1/pending/{post_id}')
+        self.assertEqual(json_util.loads(result.data),
+                         {'status': 'failed', 'error': 'down'})
+        self.assert_no_posts()
+
+    def test_invalid(self):
+        """Invalid posts are refused up front."""
+        result = self.post(INVALID_REQUEST_NO_TEXT_NOR_FILES)
+        self.assertEqual(result.status_code, 400)
+        self.assert_no_posts()
+
+    def test_too_many_pending(self):
+        """Posts are refused while too many are pending."""
+        with mock.patch.object(app_module.INGEST_QUEUE, 'max_pending', 0):
+            result = self.post(dict(
+                VALID_REQUEST_TEXT_NO_FILES,
+                file_1=(io.BytesIO(b'first file'), 'file_1.txt')))
+        self.assertEqual(result.status_code, 503)
+        self.assertIn('Retry-After', result.headers)
+        self.assertEqual(os.listdir(self.spool_directory), [])
+
+    def test_unknown_status(self):
+        """Posts not pending in this instance are done if inserted."""
+        post_id = app.config['COLLECTION'].insert_one(
+            {'text': 'inserted elsewhere'}).inserted_id
+        result = self.client.get(f'/v1/pending/{post_id}')
+        self.assertEqual(json_util.loads(result.data), {'status': 'done'})
+        result = self.client.get(f'/v1/pending/{ObjectId()}')
+        self.assertEqual(result.status_code, 404)
+        result = self.client.get('/v1/pending/not-an-id')
+        self.assertEqual(result.status_code, 400)
+
+    def assert_no_posts(self):
+        """Asserts no posts were inserted."""
+        self.assertEqual(app.config['COLLECTION'].count_documents({}), 0)
+
+
+
 if __name__ == '__main__':  # pragma: no cover
     unittest.main()
@@ -3,6 +3,7 @@
 Features include
     - adding/updating users in the users db
     - getting the authorization level of a user
+    - authenticating and authorizing a user with a single request
 """
 
 # Author: mukobi
@@ -25,7 +26,8 @@ from flask import Flask, jsonify, request, make_response
 import pymongo
 from werkzeug.exceptions import BadRequestKeyError
 from google.oauth2 import id_token
-from google.auth.transport import requests
+from certcache import CertCache
+from tokencache import TokenCache
 
 app = Flask(__name__)  # pylint: disable=invalid-name
 
@@ -34,6 +36,19 @@ app.config['GAUTH_CLIENT_ID'] = os.environ.get('GAUTH_CLIENT_ID')
 VALID_GAUTH_TOKEN_ISSUERS = [
     'accounts.google.com', 'https://accounts.google.com']
 
+# pageserve authenticates on every page view, so verified tokens are cached
+# until they expire instead of being verified again
+TOKEN_CACHE_SIZE = 4096
+TOKEN_CACHE = TokenCache(TOKEN_CACHE_SIZE)
+
+MAX_BATCH_USERS = 100  # most users looked up by one /v1/users/batch request
+
+# indexes on the users collection, created at startup by ensure_indexes()
+INDEXES = [
+    pymongo.IndexModel([('user_id', pymongo.ASCENDING)],
+                       name='user_id', unique=True),
+]
+
 
 @app.route('/v1/authenticate', methods=['POST'])
 def authenticate_and_get_user():
@@ -63,6 +78,36 @@ def authenticate_and_get_user():
         return f'Error: {error}', 400
 
 
+@app.route('/v1/authenticate_and_authorize', methods=['POST'])
+def authenticate_and_authorize_user():
+    """Authenticate user, upsert in the db, and return it with authorization.
+
+    Answers what /v1/authenticate then /v1/authorization would, with one
+    request and one read of the db.
+
+    Request data:
+        'gauth_token': Google ID token to authenticate.
+
+    Response:
+        201: user object as it is in the db, with its 'is_organizer'
+            authorization, if authentication was successful.
+        400: error message if authentication was not successful.
+    """
+    gauth_token = request.form.get('gauth_token')
+    if gauth_token is None:
+        return 'Error: You must authenticate through Google.', 400
+    try:
+        idinfo = get_user_from_gauth_token(gauth_token)
+        user_object = {
+            'user_id': idinfo['sub'],
+            'name': idinfo['name']}
+        user_object = upsert_and_authorize_user_in_db(
+            user_object, app.config['COLLECTION'])
+        return jsonify(user_object), 201
+    except (AttributeError, ValueError, KeyError) as error:
+        return f'Error: {error}', 400
+
+
 @app.route('/v1/authorization', methods=['POST'])
 def get_authorization():
     """Finds whether the given user is an authorized organizer."""
@@ -73,6 +118,29 @@ def get_authorization():
     return jsonify(is_organizer=authorized)
 
 
+@app.route('/v1/users/batch', methods=['POST'])
+def get_users_by_ids():
+    """Finds the names and authorizations of several users with one query.
+
+    Request data:
+        'user_ids': IDs of the users, repeated once per user, at most
+            MAX_BATCH_USERS.
+
+    Response:
+        200: JSON with a list of 'users', each with its 'user_id', 'name'
+            and 'is_organizer', in the order their IDs were given, each at
+            most once. IDs of users that don't exist are left out.
+        400: error message if the IDs were missing or too many.
+    """
+    user_ids = list(dict.fromkeys(request.form.getlist('user_ids')))
+    if not user_ids:
+        return 'Error: You must supply "user_ids" POST parameters!', 400
+    if len(user_ids) > MAX_BATCH_USERS:
+        return f'Error: At most {MAX_BATCH_USERS} users may be found.', 400
+    users = find_users_in_db(user_ids, app.config['COLLECTION'])
+    return jsonify(users=users)
+
+
 @app.route('/v1/authorization/update', methods=['POST'])
 def update_authorization():
     """Updates the given user's authorization if caller is authorized."""
@@ -101,9 +169,33 @@ def find_authorization_in_db(user_id, users_collection):
     return bool(authorized)  # handle 'None' case
 
 
+def find_users_in_db(user_ids, users_collection):
+    """Finds the users with the given IDs with a single $in query.
+
+    The query is answered from the unique user_id index and only the public
+    attributes of users are read.
+
+    Returns:
+        list: dicts with the 'user_id', 'name' and 'is_organizer' of each
+            user found, in the order of user_ids.
+    """
+    found_users = users_collection.find(
+        {'user_id': {'$in': user_ids}},
+        {'_id': 0, 'user_id': 1, 'name': 1, 'is_organizer': 1})
+    users_by_id = {user['user_id']: user for user in found_users}
+    return [{'user_id': user_id,
+             'name': users_by_id[user_id].get('name'),
+             'is_organizer': bool(users_by_id[user_id].get('is_organizer'))}
+            for user_id in user_ids if user_id in users_by_id]
+
+
 def get_user_from_gauth_token(gauth_token):
     """Validate the Google auth token and return it's user object.
 
+    Tokens that were verified before are taken from TOKEN_CACHE until they
+    expire. Others are verified against the certs in app.config['CERT_CACHE'],
+    without a request to Google.
+
     Args:
         gauth_token (str): Google ID token to authenticate.
 
@@ -117,15 +209,20 @@ def get_user_from_gauth_token(gauth_token):
     Raises:
         ValueError: Token is invalid.
     """
+    idinfo = TOKEN_CACHE.get(gauth_token)
+    if idinfo is not None:
+        return idinfo
+
     # Authenticate token and match to client ID
     idinfo = id_token.verify_oauth2_token(
-        gauth_token, requests.Request(), app.config['GAUTH_CLIENT_ID'])
+        gauth_token, app.config['CERT_CACHE'], app.config['GAUTH_CLIENT_ID'])
 
     issuer = idinfo['iss']
     if issuer not in VALID_GAUTH_TOKEN_ISSUERS:
         raise ValueError(f'Invalid authentication token issuer "{issuer}".')
 
     # ID token is valid. Return the user object.
+    TOKEN_CACHE.put(gauth_token, idinfo)
     return idinfo
 
 
@@ -159,22 +256,70 @@ def update_user_authorization_in_db(
 def upsert_user_in_db(user_object, users_collection):
     """Updates or inserts the user object into users_collection.
 
+    Users sign in again on every page view, so the user is read first and
+    only written if it is new or its name changed.
+
     Args:
         user_object (dict): must contain a user_id and name and must not
             contain other attributes.
         users_collection (pymongo.collection): the MongoDB collection to use.
 
     Returns:
-        ObjectID: The ID of the upserted object from the db. This can be used
-            to find the object with collection.find_one(object_id).
+        ObjectID: The ID of the upserted object from the db if it was
+            inserted, else None. This can be used to find the object with
+            collection.find_one(object_id).
 
     Raises:
         AttributeError: if user_object is malformatted.
     """
+    check_user_object(user_object)
+    stored_user = users_collection.find_one(
+        {'user_id': user_object['user_id']}, {'_id': 0, 'name': 1})
+    if stored_user == {'name': user_object['name']}:
+        return None  # unchanged, so skip the write
+    return write_user_in_db(user_object, users_collection)
+
+
+def upsert_and_authorize_user_in_db(user_object, users_collection):
+    """Upserts the user like upsert_user_in_db() and finds its authorization.
+
+    The stored name and authorization are read with a single find_one.
+
+    Args:
+        user_object (dict): must contain a user_id and name and must not
+            contain other attributes.
+        users_collection (pymongo.collection): the MongoDB collection to use.
+
+    Returns:
+        dict: The user object with its 'is_organizer' authorization, which
+            is False for new users.
+
+    Raises:
+        AttributeError: if user_object is malformatted.
+    """
+    check_user_object(user_object)
+    stored_user = users_collection.find_one(
+        {'user_id': user_object['user_id']},
+        {'_id': 0, 'name': 1, 'is_organizer': 1})
+    if stored_user is None or stored_user.get('name') != user_object['name']:
+        write_user_in_db(user_object, users_collection)
+    authorized = stored_user is not None and stored_user.get('is_organizer')
+    return dict(user_object, is_organizer=bool(authorized))
+
+
+def check_user_object(user_object):
+    """Raises AttributeError unless user_object has just a user_id and name."""
     required_attributes = {'user_id', 'name'}
     if user_object.keys() != required_attributes:
         raise AttributeError('malformatted user object')
-    # upsert user in db
+
+
+def write_user_in_db(user_object, users_collection):
+    """Upserts the user object, keeping the authorization of existing users.
+
+    Returns:
+        ObjectID: The ID of the object if it was inserted, else None.
+    """
     return users_collection.update_one(
         {'user_id': user_object['user_id']},
         {'$set': user_object,
@@ -182,6 +327,57 @@ def upsert_user_in_db(user_object, users_collection):
         upsert=True).upserted_id
 
 
+def ensure_indexes(collection, indexes=None):
+    """Reconciles the indexes on the collection with the declared indexes.
+
+    Creates declared indexes that are missing and rebuilds declared indexes
+    whose spec has drifted from the one in the DB. Indexes in the DB that are
+    not declared are left alone, but reported. Run once at startup so that
+    request handlers never have to create indexes.
+
+    Args:
+        collection (pymongo.collection): The collection to reconcile.
+        indexes (list): pymongo.IndexModels to declare, defaults to INDEXES.
+
+    Returns:
+        dict: Names of the indexes that were 'created', 'rebuilt', 'failed'
+            to build, and that exist in the DB but are 'undeclared'.
+    """
+    if indexes is None:
+        indexes = INDEXES
+    existing = collection.index_information()
+    report = {'created': [], 'rebuilt': [], 'failed': [], 'undeclared': []}
+    for index in indexes:
+        name = index.document['name']
+        try:
+            if name not in existing:
+                collection.create_indexes([index])
+                report['created'].append(name)
+            elif not index_matches(existing[name], index.document):
+                collection.drop_index(name)
+                collection.create_indexes([index])
+                report['rebuilt'].append(name)
+        except pymongo.errors.OperationFailure:
+            report['failed'].append(name)
+    declared = {index.document['name'] for index in indexes}
+    report['undeclared'] = [
+        name for name in existing if name not in declared and name != '_id_']
+    for outcome, names in report.items():
+        if names:
+            app.logger.warning('Indexes %s on %s: %s',
+                               outcome, collection.name, ', '.join(names))
+    return report
+
+
+def index_matches(info, spec):
+    """Determines if an index from index_information() matches an index spec.
+
+    Only compares keys and uniqueness, as no text indexes are declared.
+    """
+    return (list(info['key']) == list(spec['key'].items())
+            and info.get('unique', False) == spec.get('unique', False))
+
+
 def connect_to_mongodb():  # pragma: no cover
     """Connect to MongoDB instance using env vars."""
 
@@ -198,10 +394,30 @@ def connect_to_mongodb():  # pragma: no cover
     mongodb_uri = os.environ.get('MONGODB_URI')
     if mongodb_uri is None:
         return Thrower()  # not able to find db config var
-    return pymongo.MongoClient(mongodb_uri).users_db.users_collection
+    collection = pymongo.MongoClient(mongodb_uri).users_db.users_collection
+    ensure_indexes(collection)
+    return collection
+
+
+def connect_to_cert_cache():  # pragma: no cover
+    """Loads Google's signing certs using env vars.
+
+    The certs are read from the GAUTH_CERTS_FILE fixture if it is set, for
+    running offline. Otherwise they are prefetched and kept fresh by a
+    background thread if GAUTH_CLIENT_ID is set, and fetched on first use if
+    not.
+    """
+    cert_cache = CertCache()
+    certs_file = os.environ.get('GAUTH_CERTS_FILE')
+    if certs_file is not None:
+        cert_cache.load_file(certs_file)
+    elif app.config['GAUTH_CLIENT_ID'] is not None:
+        cert_cache.start()
+    return cert_cache
 
 
 app.config['COLLECTION'] = connect_to_mongodb()
+app.config['CERT_CACHE'] = connect_to_cert_cache()
 
 
 if __name__ == '__main__':  # pragma: no cover
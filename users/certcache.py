@@ -0,0 +1,212 @@
+"""Google's public signing certs, held in memory and refreshed in the background."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import re
+import threading
+import time
+import requests
+from google.auth import exceptions, transport
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# where google.oauth2.id_token.verify_oauth2_token() gets its certs from
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+
+
+def parse_max_age(headers, default):
+    """Returns how many more seconds a response may be cached for.
+
+    Uses the max-age of the Cache-Control header, less the Age of the
+    response if a proxy already held it.
+
+    Args:
+        headers (Mapping): Headers of the response.
+        default (int): Seconds to return if there is no max-age.
+    """
+    match = re.search(r'max-age=(\d+)', headers.get('Cache-Control', ''))
+    if match is None:
+        return default
+    try:
+        age = int(headers.get('Age', 0))
+    except ValueError:
+        age = 0
+    return max(int(match.group(1)) - age, 0)
+
+
+class CertsResponse(transport.Response):
+    """Response to a request for certs, served from memory."""
+
+    def __init__(self, data):
+        self._data = data
+
+    @property
+    def status(self):
+        return 200
+
+    @property
+    def headers(self):
+        return {'Content-Type': 'application/json'}
+
+    @property
+    def data(self):
+        return self._data
+
+
+class CertCache(transport.Request):
+    """Transport for google-auth that serves certs from memory.
+
+    Pass it as the `request` of google.oauth2.id_token.verify_oauth2_token()
+    so verifying a token never makes a request itself. The certs are fetched
+    over one persistent session, kept for as long as their Cache-Control
+    header allows, and fetched again by a background thread shortly before
+    that. If fetching them again fails, the old certs keep being served
+    (Google publishes new keys well before signing with them) while the
+    thread retries. Without the thread, expired certs are fetched again the
+    next time they are asked for.
+
+    Attributes:
+        url: URL of the certs, the only URL the cache serves.
+        refresh_margin: Seconds before the certs expire to fetch them again.
+        retry_seconds: Seconds to wait before retrying a failed fetch.
+        default_max_age: Seconds to keep certs without a max-age.
+        timeout: Seconds to wait for the certs to be fetched.
+        expires_at: When the certs being served expire, as a Unix time, or
+            None if there are none yet.
+    """
+
+    def __init__(self, url=GOOGLE_CERTS_URL, session=None, refresh_margin=300,
+                 retry_seconds=30, default_max_age=3600, timeout=10):
+        self.url = url
+        self.refresh_margin = refresh_margin
+        self.retry_seconds = retry_seconds
+        self.default_max_age = default_max_age
+        self.timeout = timeout
+        self._session = requests.Session() if session is None else session
+        self._data = None  # the certs as JSON-encoded bytes
+        self.expires_at = None
+        self._lock = threading.Lock()  # held while fetching
+        self._stopped = None  # set to stop the background thread
+        self._thread = None
+
+    def __call__(self, url, method='GET', body=None, headers=None,
+                 timeout=None, **kwargs):
+        """Serves the certs, fetching them first if none are fresh.
+
+        Raises:
+            google.auth.exceptions.TransportError: The request is not for
+                the certs, or they could not be fetched and there are no old
+                ones to serve.
+        """
+        if url != self.url or method != 'GET':
+            raise exceptions.TransportError(
+                f'Only GET {self.url} can be served from the cert cache.')
+        data = self._data
+        if data is None or time.time() >= self.expires_at:
+            with self._lock:
+                if self._data is None or time.time() >= self.expires_at:
+                    self._fetch_expired()
+                data = self._data
+        return CertsResponse(data)
+
+    def load(self, certs):
+        """Serves the given certs from now on, e.g. a fixture for tests.
+
+        Loaded certs never expire, so stop() the background thread if it
+        shouldn't replace them.
+        """
+        self.expires_at = float('inf')
+        self._data = json.dumps(certs).encode()
+
+    def load_file(self, path):
+        """Serves the certs in a JSON file of {key ID: certificate}."""
+        with open(path) as certs_file:
+            self.load(json.load(certs_file))
+
+    def refresh(self):
+        """Fetches the certs again.
+
+        Returns:
+            int: Seconds until they expire.
+
+        Raises:
+            requests.RequestException: The certs could not be fetched.
+            ValueError: The response does not contain certs.
+        """
+        with self._lock:
+            return self._fetch()
+
+    def start(self):
+        """Fetches the certs on a background thread, now and before expiry."""
+        if self._thread is not None:
+            return
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._refresh_forever, args=(self._stopped,),
+            name='cert-cache', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread after its current fetch."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread = None
+
+    def _fetch(self):
+        """Fetches the certs, which the caller must hold the lock for."""
+        response = self._session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        certs = response.json()
+        if not isinstance(certs, dict) or not certs:
+            raise ValueError(f'No certificates at {self.url}')
+        max_age = parse_max_age(response.headers, self.default_max_age)
+        # set before the data, which is read without holding the lock
+        self.expires_at = time.time() + max_age
+        self._data = json.dumps(certs).encode()
+        return max_age
+
+    def _fetch_expired(self):
+        """Fetches certs that expired, which the caller must hold the lock for.
+
+        If that fails the old certs are served for another retry_seconds
+        before fetching them is tried again.
+        """
+        try:
+            self._fetch()
+        except (requests.RequestException, ValueError) as error:
+            if self._data is None:
+                raise exceptions.TransportError(
+                    f'Could not fetch certificates at {self.url}') from error
+            logger.warning('Serving expired certificates, could not fetch '
+                           'them at %s: %s', self.url, error)
+            self.expires_at = time.time() + self.retry_seconds
+
+    def _refresh_forever(self, stopped):
+        """Fetches the certs, then again before they expire, until stopped."""
+        while not stopped.is_set():
+            try:
+                max_age = self.refresh()
+                delay = max(max_age - self.refresh_margin, max_age / 2, 1)
+            except (requests.RequestException, ValueError) as error:
+                logger.warning('Could not fetch certificates at %s: %s',
+                               self.url, error)
+                delay = self.retry_seconds
+            except Exception:  # pylint: disable=broad-except
+                # keep refreshing, the thread is the only one that would
+                logger.exception('Unexpected error refreshing certificates')
+                delay = self.retry_seconds
+            stopped.wait(delay)
@@ -15,14 +15,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
 import unittest
 from unittest import mock
 import app
+import tokencache
 
 IDINFO_VALID = {
     'iss': 'accounts.google.com'}
 IDINFO_INVALID_ISSUER = {
     'iss': 'malicious.site.net'}
+FAKE_TOKEN = 'fake_token_0123'
 
 
 class TestGetUserFromGAuthToken(unittest.TestCase):
@@ -39,18 +42,19 @@ class TestGetUserFromGAuthToken(unittest.TestCase):
         patcher = mock.patch('app.id_token')
         self.verify_oauth2_token = patcher.start().verify_oauth2_token
         self.addCleanup(patcher.stop)
+        app.TOKEN_CACHE.clear()
 
     def test_valid_token(self):
         """Simulate extracting a valid token."""
         self.verify_oauth2_token.return_value = IDINFO_VALID
-        result = app.get_user_from_gauth_token(None)
+        result = app.get_user_from_gauth_token(FAKE_TOKEN)
         self.assertEqual(result, IDINFO_VALID)
 
     def test_bad_issuer(self):
         """Bad token issuer (not Google Accounts)."""
         self.verify_oauth2_token.return_value = IDINFO_INVALID_ISSUER
         with self.assertRaises(ValueError):
-            app.get_user_from_gauth_token(None)
+            app.get_user_from_gauth_token(FAKE_TOKEN)
 
     def test_authentication_failed(self):
         """Authentication failed due to invalid token.
@@ -61,7 +65,71 @@ class TestGetUserFromGAuthToken(unittest.TestCase):
         """
         self.verify_oauth2_token.side_effect = ValueError('Bad token.')
         with self.assertRaises(ValueError):
-            app.get_user_from_gauth_token(None)
+            app.get_user_from_gauth_token(FAKE_TOKEN)
+
+    def test_cached_token(self):
+        """Verified tokens are not verified again until they expire."""
+        idinfo = dict(IDINFO_VALID, exp=time.time() + 60)
+        self.verify_oauth2_token.return_value = idinfo
+        self.assertEqual(app.get_user_from_gauth_token(FAKE_TOKEN), idinfo)
+        self.assertEqual(app.get_user_from_gauth_token(FAKE_TOKEN), idinfo)
+        self.verify_oauth2_token.assert_called_once()
+        # other tokens are verified
+        app.get_user_from_gauth_token('another token')
+        self.assertEqual(self.verify_oauth2_token.call_count, 2)
+
+    def test_uncached_failures(self):
+        """Tokens that fail verification are not cached."""
+        self.verify_oauth2_token.return_value = dict(
+            IDINFO_INVALID_ISSUER, exp=time.time() + 60)
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                app.get_user_from_gauth_token(FAKE_TOKEN)
+        self.assertEqual(self.verify_oauth2_token.call_count, 2)
+
+
+class TestTokenCache(unittest.TestCase):
+    """Test tokencache.TokenCache."""
+
+    def setUp(self):
+        self.cache = tokencache.TokenCache(max_size=2)
+
+    def test_expiry(self):
+        """Tokens are cached until their exp claim."""
+        self.cache.put('token', {'sub': 'a', 'exp': 100}, now=40)
+        self.assertEqual(self.cache.get('token', now=99),
+                         {'sub': 'a', 'exp': 100})
+        self.assertIsNone(self.cache.get('token', now=100))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_uncacheable(self):
+        """Expired tokens and tokens without exp are not cached."""
+        self.cache.put('expired', {'sub': 'a', 'exp': 100}, now=100)
+        self.cache.put('no exp', {'sub': 'a'}, now=100)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru(self):
+        """The least recently used tokens are evicted."""
+        for token in ['a', 'b']:
+            self.cache.put(token, {'sub': token, 'exp': 100}, now=0)
+        self.cache.get('a', now=0)
+        self.cache.put('c', {'sub': 'c', 'exp': 100}, now=0)
+        self.assertIsNone(self.cache.get('b', now=0))
+        self.assertEqual(self.cache.get('a', now=0)['sub'], 'a')
+        self.assertEqual(self.cache.get('c', now=0)['sub'], 'c')
+
+    def test_copies(self):
+        """Callers can't change the cached claims."""
+        claims = {'sub': 'a', 'exp': 100}
+        self.cache.put('token', claims, now=0)
+        claims['sub'] = 'b'
+        self.cache.get('token', now=0)['sub'] = 'c'
+        self.assertEqual(self.cache.get('token', now=0)['sub'], 'a')
+
+    def test_hashed_keys(self):
+        """Tokens themselves are not kept in memory."""
+        self.cache.put('secret token', {'exp': 100}, now=0)
+        self.assertNotIn('secret token', self.cache._entries)  # pylint: disable=protected-access
 
 
 if __name__ == '__main__':
@@ -0,0 +1,228 @@
+"""Unit tests for serving Google's signing certs from memory."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+import requests
+from google.auth import crypt, exceptions, jwt
+import app
+import certcache
+
+TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'testdata')
+CERTS_FILE = os.path.join(TESTDATA, 'gauth_certs.json')
+KEY_FILE = os.path.join(TESTDATA, 'gauth_key.pem')
+KEY_ID = 'test-key-1'
+CERTS = {'key-a': 'cert a', 'key-b': 'cert b'}
+
+
+def make_response(certs=None, headers=None, status=200):
+    """Returns a mock requests.Response with the given certs."""
+    response = mock.Mock(status_code=status, headers=headers or {})
+    response.json.return_value = CERTS if certs is None else certs
+    if status != 200:
+        response.raise_for_status.side_effect = requests.HTTPError(status)
+    return response
+
+
+def make_token(**claims):
+    """Returns an ID token signed with the fixture key."""
+    with open(KEY_FILE) as key_file:
+        signer = crypt.RSASigner.from_string(key_file.read(), KEY_ID)
+    now = int(time.time())
+    payload = {'iss': 'accounts.google.com', 'aud': 'test-client-id',
+               'sub': '123', 'name': 'Test User', 'iat': now,
+               'exp': now + 600}
+    payload.update(claims)
+    return jwt.encode(signer, payload).decode()
+
+
+class TestParseMaxAge(unittest.TestCase):
+    """Test certcache.parse_max_age()."""
+
+    def test_max_age(self):
+        """max-age is read from Cache-Control, less the Age."""
+        cache_control = 'public, max-age=19204, must-revalidate, no-transform'
+        self.assertEqual(certcache.parse_max_age(
+            {'Cache-Control': cache_control}, 60), 19204)
+        self.assertEqual(certcache.parse_max_age(
+            {'Cache-Control': cache_control, 'Age': '204'}, 60), 19000)
+        self.assertEqual(certcache.parse_max_age(
+            {'Cache-Control': 'max-age=10', 'Age': '20'}, 60), 0)
+
+    def test_default(self):
+        """The default is used without a max-age."""
+        self.assertEqual(certcache.parse_max_age({}, 60), 60)
+        self.assertEqual(certcache.parse_max_age(
+            {'Cache-Control': 'no-cache'}, 60), 60)
+
+
+class TestCertCache(unittest.TestCase):
+    """Test certcache.CertCache."""
+
+    def setUp(self):
+        self.session = mock.Mock()
+        self.session.get.return_value = make_response(
+            headers={'Cache-Control': 'public, max-age=600'})
+        self.cache = certcache.CertCache(session=self.session)
+        self.addCleanup(self.cache.stop)
+
+    def get_certs(self):
+        """Gets the certs the way google-auth does."""
+        response = self.cache(certcache.GOOGLE_CERTS_URL, method='GET')
+        self.assertEqual(response.status, 200)
+        return json.loads(response.data.decode('utf-8'))
+
+    def test_served_from_memory(self):
+        """The certs are fetched once, then served from memory."""
+        self.assertEqual(self.get_certs(), CERTS)
+        self.assertEqual(self.get_certs(), CERTS)
+        self.session.get.assert_called_once_with(
+            certcache.GOOGLE_CERTS_URL, timeout=self.cache.timeout)
+        self.assertAlmostEqual(self.cache.expires_at, time.time() + 600,
+                               delta=5)
+
+    def test_refresh(self):
+        """Refreshing replaces the certs and returns their max-age."""
+        self.get_certs()
+        self.session.get.return_value = make_response(
+            {'key-c': 'cert c'}, {'Cache-Control': 'max-age=100'})
+        self.assertEqual(self.cache.refresh(), 100)
+        self.assertEqual(self.get_certs(), {'key-c': 'cert c'})
+
+    def test_failed_refresh(self):
+        """The old certs are served if fetching new ones fails."""
+        self.get_certs()
+        self.session.get.return_value = make_response(status=503)
+        with self.assertRaises(requests.HTTPError):
+            self.cache.refresh()
+        self.session.get.return_value = make_response({})
+        with self.assertRaises(ValueError):
+            self.cache.refresh()
+        self.assertEqual(self.get_certs(), CERTS)
+
+    def test_failed_first_fetch(self):
+        """Failing to fetch the certs at all is a transport error."""
+        self.session.get.side_effect = requests.ConnectionError('offline')
+        with self.assertRaises(exceptions.TransportError):
+            self.get_certs()
+
+    def test_expired(self):
+        """Expired certs are fetched again when they are asked for."""
+        self.get_certs()
+        self.cache.expires_at = time.time() - 1
+        self.session.get.return_value = make_response({'key-c': 'cert c'})
+        self.assertEqual(self.get_certs(), {'key-c': 'cert c'})
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_failed_expired_fetch(self):
+        """Expired certs are served while fetching new ones fails."""
+        self.get_certs()
+        self.cache.expires_at = time.time() - 1
+        self.session.get.side_effect = requests.ConnectionError('offline')
+        self.assertEqual(self.get_certs(), CERTS)
+        # fetching is only retried after retry_seconds
+        self.assertEqual(self.get_certs(), CERTS)
+        self.assertEqual(self.session.get.call_count, 2)
+        self.assertAlmostEqual(self.cache.expires_at,
+                               time.time() + self.cache.retry_seconds, delta=5)
+
+    def test_other_urls(self):
+        """Only the certs are served."""
+        with self.assertRaises(exceptions.TransportError):
+            self.cache('https://example.com/', method='GET')
+        with self.assertRaises(exceptions.TransportError):
+            self.cache(certcache.GOOGLE_CERTS_URL, method='POST')
+        self.session.get.assert_not_called()
+
+    def test_background_refresh(self):
+        """The thread prefetches the certs, then fetches them before expiry."""
+        fetched = threading.Semaphore(0)
+
+        def get(url, timeout):  # pylint: disable=unused-argument
+            fetched.release()
+            return make_response(headers={'Cache-Control': 'max-age=0'})
+
+        self.session.get.side_effect = get
+        self.cache.start()
+        # certs that expire at once are fetched again a second later
+        for _ in range(2):
+            self.assertTrue(fetched.acquire(timeout=5))
+        self.cache.stop()
+        self.assertEqual(self.get_certs(), CERTS)
+
+    def test_background_refresh_survives_errors(self):
+        """The thread keeps retrying after an unexpected error."""
+        fetched = threading.Semaphore(0)
+        responses = iter([RuntimeError('unexpected'), make_response()])
+
+        def get(url, timeout):  # pylint: disable=unused-argument
+            fetched.release()
+            response = next(responses)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.session.get.side_effect = get
+        self.cache.retry_seconds = 0
+        with self.assertLogs(certcache.logger, 'ERROR'):
+            self.cache.start()
+            for _ in range(2):
+                self.assertTrue(fetched.acquire(timeout=5))
+        self.cache.stop()
+        self.assertEqual(self.get_certs(), CERTS)
+
+    def test_load_file(self):
+        """Fixture certs are served without fetching them."""
+        self.cache.load_file(CERTS_FILE)
+        self.assertIn(KEY_ID, self.get_certs())
+        self.assertEqual(self.cache.expires_at, float('inf'))
+        self.session.get.assert_not_called()
+
+
+class TestVerifyWithFixtureCerts(unittest.TestCase):
+    """Test verifying real tokens offline, against the fixture certs."""
+
+    def setUp(self):
+        cert_cache = certcache.CertCache(session=mock.Mock())
+        cert_cache.load_file(CERTS_FILE)
+        patcher = mock.patch.dict(app.app.config, {
+            'CERT_CACHE': cert_cache, 'GAUTH_CLIENT_ID': 'test-client-id'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app.TOKEN_CACHE.clear()
+
+    def test_valid_token(self):
+        """Tokens signed with the fixture key are verified."""
+        idinfo = app.get_user_from_gauth_token(make_token())
+        self.assertEqual((idinfo['sub'], idinfo['name']), ('123', 'Test User'))
+        app.app.config['CERT_CACHE']._session.get.assert_not_called()  # pylint: disable=protected-access
+
+    def test_invalid_tokens(self):
+        """Expired tokens and tokens for other clients are rejected."""
+        with self.assertRaises(ValueError):
+            app.get_user_from_gauth_token(make_token(
+                iat=int(time.time()) - 7200, exp=int(time.time()) - 3600))
+        with self.assertRaises(ValueError):
+            app.get_user_from_gauth_token(make_token(aud='another-client'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -78,6 +78,7 @@ class TestAuthenticateUser(unittest.TestCase):
         patcher = mock.patch('app.id_token')
         self.verify_oauth2_token = patcher.start().verify_oauth2_token
         self.addCleanup(patcher.stop)
+        app.TOKEN_CACHE.clear()
 
     def assert_equal_idinfos(self, response, fake):
         """Asserts if the 2 idinfo objects are the same.
@@ -139,6 +140,57 @@ class TestAuthenticateUser(unittest.TestCase):
         self.assertEqual(result.status_code, 400)
 
 
+class TestAuthenticateAndAuthorizeUser(unittest.TestCase):
+    """Test endpoint POST /v1/authenticate_and_authorize."""
+
+    def setUp(self):
+        """Set up test client and seed mock DB for testing."""
+        app.app.config['COLLECTION'] = mongomock.MongoClient().db.collection
+        app.app.config['COLLECTION'].insert_many(
+            [dict(user) for user in FAKE_USERS])
+        app.app.config['TESTING'] = True  # propagate exceptions to test client
+        self.client = app.app.test_client()
+        patcher = mock.patch('app.id_token')
+        self.verify_oauth2_token = patcher.start().verify_oauth2_token
+        self.addCleanup(patcher.stop)
+        app.TOKEN_CACHE.clear()
+
+    def authenticate(self, idinfo):
+        """Posts a token for the given idinfo and returns the response."""
+        self.verify_oauth2_token.return_value = idinfo
+        return self.client.post(
+            '/v1/authenticate_and_authorize', data=DUMMY_GAUTH_REQUEST_DATA)
+
+    def test_authorized(self):
+        """An organizer is returned with its authorization and new name."""
+        result = self.authenticate(IDINFO_VALID)
+        self.assertEqual(result.status_code, 201)
+        self.assertEqual(json.loads(result.data), {
+            'user_id': AUTHORIZED_USER_ID, 'name': 'John Doe',
+            'is_organizer': True})
+        found_user = app.app.config['COLLECTION'].find_one(
+            {'user_id': AUTHORIZED_USER_ID})
+        self.assertEqual(found_user['name'], 'John Doe')
+        self.assertTrue(found_user['is_organizer'])
+
+    def test_new_user(self):
+        """A new user is inserted and not authorized."""
+        result = self.authenticate(dict(IDINFO_VALID, sub=MISSING_USER))
+        self.assertEqual(result.status_code, 201)
+        self.assertFalse(json.loads(result.data)['is_organizer'])
+        self.assertEqual(app.app.config['COLLECTION'].count_documents(
+            {'user_id': MISSING_USER, 'is_organizer': False}), 1)
+
+    def test_authentication_failed(self):
+        """Bad tokens, missing names and missing tokens are errors."""
+        self.assertEqual(self.authenticate(IDINFO_INVALID_ISSUER).status_code,
+                         400)
+        self.assertEqual(self.authenticate(IDINFO_MISSING_NAME).status_code,
+                         400)
+        result = self.client.post('/v1/authenticate_and_authorize')
+        self.assertEqual(result.status_code, 400)
+
+
 class TestGetAuthorization(unittest.TestCase):
     """Test get authorization endpoint POST /v1/authorization."""
 
@@ -179,6 +231,40 @@ class TestGetAuthorization(unittest.TestCase):
         self.assertEqual(result.status_code, 400)
 
 
+class TestGetUsersByIDs(unittest.TestCase):
+    """Test batch lookup endpoint POST /v1/users/batch."""
+
+    def setUp(self):
+        """Set up test client and seed mock DB for testing."""
+        app.app.config['COLLECTION'] = mongomock.MongoClient().db.collection
+        app.app.config['COLLECTION'].insert_many(
+            [dict(user) for user in FAKE_USERS])
+        app.app.config['TESTING'] = True  # propagate exceptions to test client
+        self.client = app.app.test_client()
+
+    def test_found_users(self):
+        """Users are returned in the order given, without repeats."""
+        result = self.client.post('/v1/users/batch', data={'user_ids': [
+            NON_AUTHORIZED_USER_ID, MISSING_USER, AUTHORIZED_USER_ID,
+            MALFORMATTED_IN_DB_USER, NON_AUTHORIZED_USER_ID]})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(json.loads(result.data)['users'], [
+            {'user_id': NON_AUTHORIZED_USER_ID,
+             'name': NON_AUTHORIZED_USER_ID, 'is_organizer': False},
+            {'user_id': AUTHORIZED_USER_ID,
+             'name': AUTHORIZED_USER_ID, 'is_organizer': True},
+            {'user_id': MALFORMATTED_IN_DB_USER,
+             'name': None, 'is_organizer': False}])
+
+    def test_bad_ids(self):
+        """Missing IDs and too many IDs are errors."""
+        result = self.client.post('/v1/users/batch')
+        self.assertEqual(result.status_code, 400)
+        result = self.client.post('/v1/users/batch', data={
+            'user_ids': [str(i) for i in range(app.MAX_BATCH_USERS + 1)]})
+        self.assertEqual(result.status_code, 400)
+
+
 @mock.patch('app.get_user_from_gauth_token',
             mock.Mock(return_value=IDINFO_AUTHORIZED_UPDATER))
 class TestUpdateAuthorization(unittest.TestCase):
@@ -16,6 +16,7 @@
 # limitations under the License.
 
 import unittest
+from unittest import mock
 import mongomock
 import app
 
@@ -137,6 +138,49 @@ class TestUserUpsertion(unittest.TestCase):
         returned_user = self.mock_collection.find_one(upserted_id)
         self.assertEqual(returned_user, found_user)
 
+    def test_unchanged_user_not_written(self):
+        """Upserting a stored user with the same name doesn't write."""
+        user_to_insert = {
+            'user_id': USER_ID,
+            'name': USER_NAME
+        }
+        app.upsert_user_in_db(user_to_insert, self.mock_collection)
+        with mock.patch.object(self.mock_collection, 'update_one',
+                               wraps=self.mock_collection.update_one) as update:
+            for _ in range(3):
+                self.assertIsNone(app.upsert_user_in_db(
+                    dict(user_to_insert), self.mock_collection))
+            update.assert_not_called()
+            # a new name is written
+            app.upsert_user_in_db(
+                {'user_id': USER_ID, 'name': 'New Name'},
+                self.mock_collection)
+            update.assert_called_once()
+        self.assertEqual(self.mock_collection.find_one(
+            {'user_id': USER_ID})['name'], 'New Name')
+
+    def test_upsert_and_authorize(self):
+        """Users are upserted and returned with their authorization."""
+        user_to_insert = {
+            'user_id': USER_ID,
+            'name': USER_NAME
+        }
+        self.assertEqual(
+            app.upsert_and_authorize_user_in_db(
+                dict(user_to_insert), self.mock_collection),
+            dict(user_to_insert, is_organizer=False))
+        self.mock_collection.update_one(
+            {'user_id': USER_ID}, {'$set': {'is_organizer': True}})
+        with mock.patch.object(self.mock_collection, 'update_one') as update:
+            self.assertEqual(
+                app.upsert_and_authorize_user_in_db(
+                    dict(user_to_insert), self.mock_collection),
+                dict(user_to_insert, is_organizer=True))
+            update.assert_not_called()
+        with self.assertRaises(AttributeError):
+            app.upsert_and_authorize_user_in_db(
+                {'user_id': USER_ID}, self.mock_collection)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,92 @@
+"""In-memory cache of verified ID tokens, kept until they expire."""
+
+# Copyright 2019 The Knative Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def token_key(token):
+    """Returns the key a token is cached under.
+
+    Tokens are credentials, so only their SHA-256 is kept in memory.
+    """
+    return hashlib.sha256(token.encode()).digest()
+
+
+class TokenCache():
+    """LRU cache of the claims of verified tokens.
+
+    Entries are dropped once the token expires, i.e. at its `exp` claim, so a
+    cached token is never accepted for longer than verifying it again would
+    accept it.
+
+    Attributes:
+        max_size: Most tokens kept at once. The least recently used are
+            evicted to stay under it.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (claims, expires at)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token, now=None):
+        """Returns a copy of the claims of a verified token.
+
+        Returns:
+            dict: The claims, or None if the token isn't cached or expired.
+        """
+        key = token_key(token)
+        if now is None:
+            now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if now >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(claims)
+
+    def put(self, token, claims, now=None):
+        """Caches the claims of a token that was just verified.
+
+        Tokens without an `exp` claim, or that already expired, are not
+        cached.
+        """
+        expires_at = claims.get('exp')
+        if now is None:
+            now = time.time()
+        if not isinstance(expires_at, (int, float)) or now >= expires_at:
+            return
+        key = token_key(token)
+        with self._lock:
+            self._entries[key] = (dict(claims), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries."""
+        with self._lock:
+            self._entries.clear()